@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import zlib
+import random
+
+# Parámetros de MinHash
+NUM_PERM = 64
+SHINGLE_SIZE = 3  # palabras por shingle
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1234)  # semilla fija: mismas firmas entre ejecuciones
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+
+def normalize_text(s: str) -> str:
+    s = re.sub(r"[^a-z0-9áéíóúñ ]", "", s.lower())
+    return s.strip()
+
+def chunk_size(ch):
+    return len(json.dumps(ch))
+
+
+# NEAR-DUPLICATES (MinHash + LSH)
+def shingles(text: str):
+    words = normalize_text(text).split()
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i+SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash(shingle_set):
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingle_set]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+def lsh_params(threshold):
+    """Elige (bandas, filas) con bandas*filas = NUM_PERM cuyo umbral (1/b)^(1/r) quede más cerca del pedido"""
+    options = [(NUM_PERM // r, r) for r in range(1, NUM_PERM + 1) if NUM_PERM % r == 0]
+    return min(options, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# DEDUPLICACIÓN
+def dedup_indices(chunks, near_threshold=None):
+    """
+    Devuelve los índices de los chunks que se conservan, en orden.
+    - Exactos: recomendación normalizada igual, índice hash O(n).
+    - Casi duplicados (si near_threshold): similitud de Jaccard de shingles de la recomendación
+      >= near_threshold dentro de la misma dimensión, candidatos por MinHash/LSH y verificados con Jaccard exacto.
+    Entre duplicados se prefiere el más largo/completo, que ocupa la posición del primero.
+    """
+    kept = []          # índices conservados (posición -> índice en chunks)
+    sizes = []         # tamaño del chunk conservado en cada posición
+    by_key = {}        # recomendación normalizada -> posición
+    shingle_sets = []  # shingles del chunk conservado en cada posición
+    buckets = {}       # (banda, firma parcial) -> posiciones
+    if near_threshold:
+        bands, rows = lsh_params(near_threshold)
+
+    for idx, ch in enumerate(chunks):
+        if not ch.get("recomendacion") or not ch.get("dimension_IMECH"):
+            continue
+        key = normalize_text(ch["recomendacion"])
+        size = chunk_size(ch)
+
+        pos = by_key.get(key)
+        sh = None
+        band_keys = []
+        if pos is None and near_threshold:
+            sh = shingles(ch["recomendacion"])
+            sig = minhash(sh) if sh else ()
+            dim = ch.get("dimension_IMECH")
+            band_keys = [(dim, b, sig[b*rows:(b+1)*rows]) for b in range(bands)] if sig else []
+            candidates = {p for bk in band_keys for p in buckets.get(bk, ())}
+            for p in sorted(candidates):
+                if jaccard(sh, shingle_sets[p]) >= near_threshold:
+                    pos = p
+                    break
+
+        if pos is None:
+            pos = len(kept)
+            kept.append(idx)
+            sizes.append(size)
+            shingle_sets.append(sh)
+        elif size > sizes[pos]:
+            kept[pos] = idx
+            sizes[pos] = size
+            if sh is not None:
+                shingle_sets[pos] = sh
+        by_key.setdefault(key, pos)
+        for bk in band_keys:
+            buckets.setdefault(bk, []).append(pos)
+
+    return kept
+
+def remove_duplicates(chunks, near_threshold=None):
+    """
+    Elimina chunks con acciones o temas duplicados.
+    Prefiere los más largos/completos.
+    """
+    return [chunks[i] for i in dedup_indices(chunks, near_threshold)]
+
+def dedup_across_files(processed_dir, near_threshold=None):
+    """
+    Deduplica las recomendaciones entre todos los JSON de processed_dir (en orden de nombre)
+    y reescribe los archivos que pierden chunks. Devuelve cuántos chunks se eliminaron.
+    """
+    files = sorted(f for f in os.listdir(processed_dir) if f.endswith(".json"))
+    datas = {}
+    all_chunks = []
+    owners = []
+    for file in files:
+        with open(os.path.join(processed_dir, file), "r", encoding="utf-8") as f:
+            datas[file] = json.load(f)
+        for pos, ch in enumerate(datas[file].get("chunks_enriquecidos", [])):
+            all_chunks.append(ch)
+            owners.append((file, pos))
+
+    kept = set(dedup_indices(all_chunks, near_threshold))
+    kept_by_file = {file: [] for file in files}
+    for i, (file, _) in enumerate(owners):
+        if i in kept:
+            kept_by_file[file].append(all_chunks[i])
+
+    removed = 0
+    for file in files:
+        original = datas[file].get("chunks_enriquecidos", [])
+        if len(kept_by_file[file]) == len(original):
+            continue
+        removed += len(original) - len(kept_by_file[file])
+        datas[file]["chunks_enriquecidos"] = kept_by_file[file]
+        with open(os.path.join(processed_dir, file), "w", encoding="utf-8") as f:
+            json.dump(datas[file], f, ensure_ascii=False, indent=2)
+    return removed
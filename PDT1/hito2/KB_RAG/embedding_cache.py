@@ -0,0 +1,184 @@
+import os
+import time
+import sqlite3
+import hashlib
+import math
+import threading
+from array import array
+
+# VARIABLES GLOBALES
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, "embedding_cache.sqlite"))
+DEFAULT_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+EMBEDDING_MODEL = "gemini-embedding-001"
+EMBED_BATCH_SIZE = 100  # máximo de textos por petición embed_content
+FULL_EMBEDDING_DIM = 3072
+# Dimensionalidad de salida (768, 1536...). Cambiarla obliga a regenerar el vector store
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "0")) or None
+
+
+class EmbeddingCache:
+    """
+    Cache en disco (SQLite) de embeddings, direccionado por contenido.
+    - Clave: sha256(modelo, dimensionalidad de salida, texto)
+    - Valor: vector float32 como blob
+    - Eviction LRU cuando el tamaño total supera max_mb
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_mb=DEFAULT_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text, model=EMBEDDING_MODEL, output_dimensionality=None):
+        raw = f"{model}\x00{output_dimensionality or ''}\x00{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """Devuelve {key: vector} para las claves presentes y actualiza su uso (LRU)"""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items):
+        """Guarda pares (key, vector) y aplica la eviction por tamaño"""
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+            "size_mb": round(size / (1024 * 1024), 2)
+        }
+
+    def print_stats(self, tag="EMBEDDING CACHE"):
+        s = self.stats()
+        print(f"[{tag}] hits: {s['hits']}, misses: {s['misses']} (hit rate {s['hit_rate']:.1%}), "
+              f"entradas: {s['entries']}, tamaño: {s['size_mb']} MB")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def dummy_embedding():
+    return [0.0] * (EMBEDDING_DIM or FULL_EMBEDDING_DIM)
+
+def l2_normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+def get_gemini_embeddings(client, texts, cache=None, model=EMBEDDING_MODEL, output_dimensionality=EMBEDDING_DIM,
+                          batch_size=EMBED_BATCH_SIZE, retries=5, delay=5):
+    """
+    Obtiene embeddings de Gemini para una lista de textos.
+    Consulta primero el cache y solo envía los textos faltantes, en lotes de batch_size por petición.
+    Con una dimensionalidad reducida Gemini no entrega los vectores normalizados: se normalizan aquí.
+    """
+    texts = list(texts)
+    keys = [EmbeddingCache.make_key(t, model, output_dimensionality) for t in texts]
+    found = cache.get_many(list(set(keys))) if cache else {}
+
+    # Textos faltantes sin repetir
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            pending.setdefault(key, text)
+    pending_keys = list(pending.keys())
+
+    config = None
+    if output_dimensionality:
+        from google.genai import types
+        config = types.EmbedContentConfig(output_dimensionality=output_dimensionality)
+
+    for i in range(0, len(pending_keys), batch_size):
+        batch_keys = pending_keys[i:i+batch_size]
+        batch_texts = [pending[k] for k in batch_keys]
+        for attempt in range(retries):
+            try:
+                resp = client.models.embed_content(
+                    model=model,
+                    contents=batch_texts,
+                    config=config
+                )
+                vectors = [e.values for e in resp.embeddings]
+                break
+            except Exception as e:
+                print(f"[ERROR] Intento {attempt+1}/{retries} fallido: {e}")
+                if attempt < retries - 1:
+                    time.sleep(delay)
+                else:
+                    raise
+        found.update(zip(batch_keys, vectors))
+        if cache:
+            cache.put_many(zip(batch_keys, vectors))
+
+    if output_dimensionality and output_dimensionality != FULL_EMBEDDING_DIM:
+        return [l2_normalize(found[k]) for k in keys]
+    return [found[k] for k in keys]
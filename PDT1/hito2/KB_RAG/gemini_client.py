@@ -0,0 +1,22 @@
+import os
+import threading
+
+# Cliente de Gemini compartido y creado a pedido: importar un módulo del pipeline no importa google.genai
+# ni exige GOOGLE_API_KEY, eso pasa recién cuando algo necesita llamar a la API.
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(timeout=None):
+    """Devuelve el cliente de Gemini (uno por timeout en segundos), creándolo la primera vez"""
+    with _lock:
+        if timeout not in _clients:
+            import google.genai as genai
+            from dotenv import load_dotenv
+            load_dotenv()
+            api_key = os.getenv("GOOGLE_API_KEY")
+            if not api_key:
+                raise ValueError("[GEMINI SETUP] ERROR: No se encontró GOOGLE_API_KEY en el entorno o .env")
+            http_options = {"timeout": int(timeout * 1000)} if timeout else None
+            _clients[timeout] = genai.Client(api_key=api_key, http_options=http_options)
+        return _clients[timeout]
@@ -1,14 +1,16 @@
 import os
 import json
 import re
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from bs4 import BeautifulSoup
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredHTMLLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langdetect import detect
-import google.genai as genai
+from llm_cache import LLMCache, cached_generate_content
+from gemini_client import get_client
+
+# PyPDF2, lxml, langdetect y el splitter de LangChain se importan dentro de las funciones que los usan:
+# importar este módulo (o levantar un proceso del pool) no paga esas dependencias hasta necesitarlas.
 
 
 # VARIABLES GLOBALES
@@ -16,19 +18,21 @@ BASE_DIR = os.path.join(os.path.dirname(__file__), "./docs")
 PDF_DIR = os.path.join(BASE_DIR, "pdf")
 HTML_DIR = os.path.join(BASE_DIR, "html")
 OUT_DIR = os.path.join(os.path.dirname(__file__), "./extracted_texts_jsons")
+MANIFEST_PATH = os.path.join(os.path.dirname(__file__), "ingest_manifest.json")
 
-os.makedirs(OUT_DIR, exist_ok=True)
+# Versiones de las plantillas de prompt: subirlas al modificar la plantilla invalida su cache
+PDF_META_PROMPT_VERSION = "1"
+HTML_META_PROMPT_VERSION = "2"
 
-print()
+# HTML
+HTML_SNIPPET_CHARS = 6000
+HTML_BLOCK_TAGS = ("p", "div", "section", "article", "main", "header", "footer", "li", "ul", "ol", "table",
+                   "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "br", "dd", "dt")
 
-# GEMINI AI SETUP
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("[GEMINI SETUP] ERROR: No se encontró GOOGLE_API_KEY en el entorno o .env\n")
+# Se inicializan en setup(); los procesos del pool de parseo no los usan
+client = None
+llm_cache = None
 
-client = genai.Client(api_key=API_KEY)
-print("[GEMINI SETUP] PASS: Gemini configurado correctamente.\n")
 
 # FUNCIONES AUXILIARES
 def clean_filename(name):
@@ -76,8 +80,7 @@ def extract_date_from_text(text):
 
 def safe_parse_json(text: str):
     try:
-        clean_text = re.sub(r"^```json|```$", "", text.strip())
-        parsed = json.loads(clean_text)
+        parsed = json.loads(clean_json_text(text))
         # Normalizar valores vacíos
         for key in ["fecha", "entidad_emisora", "titulo"]:
             if key not in parsed or parsed[key] in [None, "", "null", "desconocida"]:
@@ -86,12 +89,75 @@ def safe_parse_json(text: str):
     except:
         return {"fecha": None, "entidad_emisora": None, "titulo": None}
 
+def clean_json_text(text):
+    return re.sub(r"^```json|```$", "", text.strip())
+
+def is_json_object(text):
+    """Validador del cache del LLM: solo se guardan respuestas de metadata que son un objeto JSON"""
+    try:
+        return isinstance(json.loads(clean_json_text(text)), dict)
+    except ValueError:
+        return False
+
+
+# MANIFEST DE DOCUMENTOS FUENTE
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[MANIFEST] No se pudo leer {MANIFEST_PATH}, se reprocesa todo: {e}")
+        return {}
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def check_source(path, entry):
+    """
+    Compara un documento con su entrada del manifest.
+    Devuelve (cambió, entrada_actualizada). Solo calcula el hash si cambió tamaño o mtime.
+    """
+    st = os.stat(path)
+    if entry and entry.get("output") and os.path.exists(os.path.join(OUT_DIR, entry["output"])):
+        if entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime:
+            return False, entry
+        digest = file_sha256(path)
+        if digest == entry.get("sha256"):
+            # Solo cambió el mtime (copia, touch): se actualiza sin reprocesar
+            return False, {**entry, "size": st.st_size, "mtime": st.st_mtime}
+    else:
+        digest = file_sha256(path)
+    return True, {"sha256": digest, "size": st.st_size, "mtime": st.st_mtime}
+
 
 # METADATA
-def get_pdf_metadata(pdf_path):
+def extract_pdf(pdf_path):
+    """
+    Lee el PDF una sola vez y devuelve (textos por página, metadata del documento).
+    El chunker, las heurísticas de fecha y el snippet para Gemini reutilizan estos textos.
+    """
+    from PyPDF2 import PdfReader
     reader = PdfReader(pdf_path)
-    info = reader.metadata
+    page_texts = [page.extract_text() or "" for page in reader.pages]
+    return page_texts, reader.metadata
 
+def get_pdf_metadata(pdf_path, page_texts, info, full_text=None):
+    """
+    Metadata local del PDF, sin llamar a Gemini.
+    Devuelve (fecha, autor, titulo, snippet); snippet no es None si faltan datos y hay que consultar a Gemini.
+    """
     fecha = "desconocida"
     autor = "desconocida"
     titulo = None
@@ -112,37 +178,40 @@ def get_pdf_metadata(pdf_path):
     if not titulo or titulo.strip() == "":
         titulo = pdf_path.split(os.sep)[-1].replace(".pdf", "")
 
-    # Convertir pages a lista para poder manipular slices
-    pages = list(reader.pages)
-
-    # Extraer texto completo
-    full_text = "\n".join([page.extract_text() or "" for page in pages])
+    # Texto completo desde el cache de páginas
+    if full_text is None:
+        full_text = "\n".join(page_texts)
 
     # Si fecha sigue desconocida, intentar extraer del texto
     if fecha in ["desconocida", None, "null"]:
         fecha = extract_date_from_text(full_text)
 
-    # Si autor o fecha aún son desconocidos, usar Gemini
+    # Si autor o fecha aún son desconocidos, hay que usar Gemini
+    snippet = None
     if autor in ["desconocida", None, "null"] or fecha in ["desconocida", None, "null"]:
         # Tomar primeros 3 y últimos 3 fragmentos del PDF
-        first_pages = [pages[i].extract_text() or "" for i in range(min(3, len(pages)))]
-        last_pages = [pages[i].extract_text() or "" for i in range(max(len(pages)-3, 0), len(pages))]
+        first_pages = page_texts[:3]
+        last_pages = page_texts[max(len(page_texts)-3, 0):]
         snippet = "\n".join(first_pages + last_pages)
 
-        gemini_meta = infer_pdf_metadata_with_gemini(snippet, pdf_path)
+    return fecha, autor, titulo, snippet
 
-        # Validar y actualizar fecha y autor si Gemini devuelve datos válidos
-        fecha_candidato = gemini_meta.get("fecha", "").strip()
-        if re.match(r"^\d{2}-\d{2}-\d{4}$", fecha_candidato):
-            fecha = fecha_candidato
+def complete_pdf_metadata_with_gemini(fecha, autor, snippet, pdf_path, log=print):
+    """Completa fecha y autor del PDF con Gemini. Devuelve (fecha, autor)"""
+    gemini_meta = infer_pdf_metadata_with_gemini(snippet, pdf_path, log)
 
-        autor_candidato = gemini_meta.get("entidad_emisora", "").strip()
-        if autor_candidato:
-            autor = autor_candidato
+    # Validar y actualizar fecha y autor si Gemini devuelve datos válidos
+    fecha_candidato = gemini_meta.get("fecha", "").strip()
+    if re.match(r"^\d{2}-\d{2}-\d{4}$", fecha_candidato):
+        fecha = fecha_candidato
 
-    return fecha, autor, titulo
+    autor_candidato = gemini_meta.get("entidad_emisora", "").strip()
+    if autor_candidato:
+        autor = autor_candidato
 
-def infer_pdf_metadata_with_gemini(pdf_text, pdf_path):
+    return fecha, autor
+
+def infer_pdf_metadata_with_gemini(pdf_text, pdf_path, log=print):
     """
     Usa Gemini para inferir metadata de un PDF (fecha, autor, título)
     pdf_text: texto de los primeros y últimos fragmentos del PDF
@@ -169,11 +238,9 @@ def infer_pdf_metadata_with_gemini(pdf_text, pdf_path):
     PDF path: {pdf_path}
     """
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=[prompt]
-        )
-        meta = safe_parse_json(response.text)
+        text = cached_generate_content(client, prompt, "pdf_metadata", PDF_META_PROMPT_VERSION, cache=llm_cache,
+                                       validate=is_json_object)
+        meta = safe_parse_json(text)
 
         # Validar fecha
         if not meta.get("fecha") or not re.match(r"^\d{2}-\d{2}-\d{4}$", meta["fecha"]):
@@ -189,57 +256,98 @@ def infer_pdf_metadata_with_gemini(pdf_text, pdf_path):
 
         return meta
     except Exception as e:
-        print(f"[GEMINI AI] Error infiriendo metadata del PDF: {e}")
+        log(f"[GEMINI AI] Error infiriendo metadata del PDF: {e}")
         return {
             "fecha": datetime(datetime.today().year, 1, 1).strftime("%d-%m-%Y"),
             "entidad_emisora": "Entidad desconocida",
             "titulo": pdf_path.split(os.sep)[-1].replace(".pdf", "")
         }
 
-def get_html_metadata(html_path):
-    """Obtiene fecha, autor y URL del HTML; usa Gemini si hace falta"""
+def extract_html(html_path):
+    """
+    Lee y parsea el HTML una sola vez con lxml.
+    Devuelve un dict con el texto principal (sin scripts ni estilos), título, meta tags y la URL "saved from".
+    """
+    with open(html_path, "rb") as f:
+        raw = f.read()
+    raw_text = raw.decode("utf-8", errors="replace")
+
+    # URL de páginas guardadas desde el navegador (comentario al inicio del archivo)
+    url = None
+    match = re.search(r'<!-- saved from url=\(\d+\)(.*?) -->', raw_text[:4096]) or \
+            re.search(r'<!-- saved from url=\(\d+\)(.*?) -->', raw_text)
+    if match:
+        url = match.group(1).strip()
+
+    from lxml import html as lxml_html, etree as lxml_etree
+    tree = lxml_html.document_fromstring(raw, parser=lxml_html.HTMLParser(encoding="utf-8"))
+    meta_tags = {}
+    for meta in tree.iter("meta"):
+        name = meta.get("name") or meta.get("property")
+        content = meta.get("content")
+        if name and content and name.lower() not in meta_tags:
+            meta_tags[name.lower()] = content.strip()
+    title_el = tree.find(".//title")
+    title = title_el.text_content().strip() if title_el is not None else ""
+
+    # Texto principal: sin scripts/estilos y con un salto de línea por bloque
+    lxml_etree.strip_elements(tree, "script", "style", "noscript", "template", "svg", with_tail=False)
+    body = tree.find("body")
+    body = body if body is not None else tree
+    for el in body.iter(*HTML_BLOCK_TAGS):
+        el.tail = "\n" + (el.tail or "")
+    lines = (re.sub(r"\s+", " ", line).strip() for line in body.text_content().splitlines())
+    text = "\n".join(line for line in lines if line)
+
+    return {"text": text, "title": title, "meta": meta_tags, "url": url}
+
+def html_excerpt(extracted, max_chars=HTML_SNIPPET_CHARS):
+    """Extracto acotado y limpio para Gemini: título, meta tags e inicio del texto"""
+    head = [f"Título: {extracted['title']}"] if extracted["title"] else []
+    head += [f"meta {k}: {v}" for k, v in extracted["meta"].items()]
+    head_text = "\n".join(head)[:max_chars // 3]
+    body_chars = max(max_chars - len(head_text), 0)
+    return f"{head_text}\n\n{extracted['text'][:body_chars]}".strip()
+
+def get_html_metadata(html_path, extracted):
+    """
+    Obtiene fecha, autor y URL del HTML ya extraído, sin llamar a Gemini.
+    Devuelve (fecha, autor, url, extracto); extracto no es None si faltan datos y hay que consultar a Gemini.
+    """
     fecha = "desconocida"
     autor = "desconocida"
-    url = None
-
-    with open(html_path, "r", encoding="utf-8") as f:
-        text = f.read()
-        soup = BeautifulSoup(text, "html.parser")
-
-        # Extraer URL
-        match = re.search(r'<!-- saved from url=\(\d+\)(.*?) -->', text)
-        if match:
-            url = match.group(1).strip()
-
-        # Extraer meta tags
-        meta_author = soup.find("meta", attrs={"name": "author"}) or \
-                      soup.find("meta", attrs={"property": "author"})
-        if meta_author and meta_author.get("content"):
-            autor = meta_author["content"]
-
-        meta_date = soup.find("meta", attrs={"name": "date"}) or \
-                    soup.find("meta", attrs={"property": "article:published_time"})
-        if meta_date and meta_date.get("content"):
-            fecha = meta_date["content"]
-            # normalizar DD-MM-AAAA
-            m = re.search(r'(\d{4})-(\d{2})-(\d{2})', fecha)
-            if m:
-                fecha = f"{m.group(3)}-{m.group(2)}-{m.group(1)}"
-
-    # Si falta info, usar Gemini
-    if fecha == "desconocida" or autor == "desconocida":
-        print(f"[HTML METADATA] Usando Gemini para {html_path}")
-        gemini_meta = infer_html_metadata_with_gemini(text, url if url else "desconocida")
-        if fecha == "desconocida":
-            fecha = gemini_meta.get("fecha", "desconocida")
-        if autor == "desconocida":
-            autor = gemini_meta.get("entidad_emisora", "desconocida")
-
-    return fecha, autor, url
-
-def infer_html_metadata_with_gemini(html_text, url):
+    url = extracted["url"]
+    meta = extracted["meta"]
+
+    # Extraer meta tags
+    if meta.get("author"):
+        autor = meta["author"]
+
+    meta_date = meta.get("date") or meta.get("article:published_time")
+    if meta_date:
+        fecha = meta_date
+        # normalizar DD-MM-AAAA
+        m = re.search(r'(\d{4})-(\d{2})-(\d{2})', fecha)
+        if m:
+            fecha = f"{m.group(3)}-{m.group(2)}-{m.group(1)}"
+
+    # Si falta info, hay que usar Gemini con un extracto acotado
+    excerpt = html_excerpt(extracted) if fecha == "desconocida" or autor == "desconocida" else None
+    return fecha, autor, url, excerpt
+
+def complete_html_metadata_with_gemini(fecha, autor, html_text, url, html_path, log=print):
+    """Completa fecha y autor del HTML con Gemini. Devuelve (fecha, autor)"""
+    log(f"[HTML METADATA] Usando Gemini para {html_path}")
+    gemini_meta = infer_html_metadata_with_gemini(html_text, url if url else "desconocida", log)
+    if fecha == "desconocida":
+        fecha = gemini_meta.get("fecha", "desconocida")
+    if autor == "desconocida":
+        autor = gemini_meta.get("entidad_emisora", "desconocida")
+    return fecha, autor
+
+def infer_html_metadata_with_gemini(html_text, url, log=print):
     prompt = f"""
-    Analiza el siguiente HTML y devuelve SOLO un JSON con estos campos:
+    Analiza el siguiente extracto de una página HTML y devuelve SOLO un JSON con estos campos:
 
     {{
       "fecha": "",             # Formato DD-MM-AAAA
@@ -247,23 +355,21 @@ def infer_html_metadata_with_gemini(html_text, url):
     }}
 
     Reglas:
-    1. Busca primero cualquier fecha exacta mencionada en el HTML (ejemplo: "Published 17 December 2018").
+    1. Busca primero cualquier fecha exacta mencionada en el extracto (ejemplo: "Published 17 December 2018").
     2. Si hay varias fechas, usa la más probable de publicación original.
     3. Si no encuentras ninguna fecha, puedes inventar una fecha aproximada coherente, nunca la dejes vacía o pongas N/A.
     4. Devuelve SIEMPRE un valor válido en "fecha" en formato DD-MM-AAAA.
     5. Devuelve solo JSON válido, sin explicaciones adicionales.
 
-    HTML:
-    {html_text}
+    Extracto (título, meta tags y texto de la página, máximo {HTML_SNIPPET_CHARS} caracteres):
+    {html_text[:HTML_SNIPPET_CHARS]}
 
     URL: {url}
     """
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=[prompt]
-        )
-        meta = safe_parse_json(response.text)
+        text = cached_generate_content(client, prompt, "html_metadata", HTML_META_PROMPT_VERSION, cache=llm_cache,
+                                       validate=is_json_object)
+        meta = safe_parse_json(text)
 
         # Verificar que la fecha cumpla DD-MM-AAAA
         fecha_valida = False
@@ -280,7 +386,7 @@ def infer_html_metadata_with_gemini(html_text, url):
 
         return meta
     except Exception as e:
-        print(f"[GEMINI AI] Error infiriendo metadatos: {e}")
+        log(f"[GEMINI AI] Error infiriendo metadatos: {e}")
         inicio_anio = datetime(datetime.today().year, 1, 1)
         return {
             "fecha": inicio_anio.strftime("%d-%m-%Y"),
@@ -289,74 +395,259 @@ def infer_html_metadata_with_gemini(html_text, url):
 
 
 # SPLITTER DE TEXTO
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=150,
-    separators=["\n\n", "\n", ".", " ", ""]
-)
-
-
-# PROCESAR PDFS
-pdf_files = [f for f in os.listdir(PDF_DIR) if f.lower().endswith(".pdf")]
-print(f"[SETUP] Archivos PDF detectados:\n {pdf_files}\n")
+_text_splitter = None
+
+def get_text_splitter():
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=150,
+            separators=["\n\n", "\n", ".", " ", ""]
+        )
+    return _text_splitter
 
-for file in pdf_files:
-    path = os.path.join(PDF_DIR, file)
-    print(f"\n[PDF] Procesando PDF: {file}\n")
-    loader = PyPDFLoader(path)
-    docs = loader.load()
-    print(f" - Páginas cargadas: {len(docs)}")
 
-    full_text = "\n".join([d.page_content for d in docs])
+# PROCESAR DOCUMENTOS
+def parse_document(tipo, path, file):
+    """
+    Parte CPU del procesamiento, se ejecuta en un proceso del pool:
+    extracción de texto, idioma, chunks y metadata local (sin Gemini).
+    Los mensajes se devuelven en "logs" para imprimirlos en orden desde el proceso principal.
+    """
+    logs = []
+    if tipo == "pdf":
+        logs.append(f"\n[PDF] Procesando PDF: {file}\n")
+        page_texts, info = extract_pdf(path)
+        logs.append(f" - Páginas cargadas: {len(page_texts)}")
+        full_text = "\n".join(page_texts)
+    else:
+        logs.append(f"\n[HTML] Procesando HTML: {file}\n")
+        extracted = extract_html(path)
+        full_text = extracted["text"]
+        logs.append(f" - Texto extraído: {len(full_text)} caracteres")
+
+    from langdetect import detect
     idioma = detect(full_text)
-    print(f" - Idioma detectado: {idioma}")
-
-    chunks = text_splitter.split_text(full_text)
-    print(f" - Número de chunks generados: {len(chunks)}")
-
-    sample_text = " ".join(chunks[:2])
-
-    fecha_doc, autor_doc, titulo_doc = get_pdf_metadata(path)
-    metadata = {
-        "fuente": titulo_doc,
-        "tipo": "pdf",
-        "idioma": idioma,
-        "fecha": fecha_doc,
-        "entidad_emisora": autor_doc,
+    logs.append(f" - Idioma detectado: {idioma}")
+
+    chunks = get_text_splitter().split_text(full_text)
+    logs.append(f" - Número de chunks generados: {len(chunks)}")
+
+    if tipo == "pdf":
+        fecha_doc, autor_doc, fuente_doc, gemini_input = get_pdf_metadata(path, page_texts, info, full_text)
+    else:
+        fecha_doc, autor_doc, fuente_doc, gemini_input = get_html_metadata(path, extracted)
+
+    return {
+        "tipo": tipo,
+        "path": path,
+        "file": file,
+        "chunks": chunks,
+        "metadata": {
+            "fuente": fuente_doc,
+            "tipo": tipo,
+            "idioma": idioma,
+            "fecha": fecha_doc,
+            "entidad_emisora": autor_doc,
+        },
+        "gemini_input": gemini_input,
+        "logs": logs
     }
 
-    base_name = clean_filename(file)
-    save_doc_json(chunks, metadata, base_name)
+def complete_metadata(doc):
+    """Consulta a Gemini la metadata faltante de un documento (corre en la cola de Gemini)"""
+    if doc["gemini_input"] is None:
+        return doc
+    meta = doc["metadata"]
+    log = doc["logs"].append
+    if doc["tipo"] == "pdf":
+        meta["fecha"], meta["entidad_emisora"] = complete_pdf_metadata_with_gemini(
+            meta["fecha"], meta["entidad_emisora"], doc["gemini_input"], doc["path"], log
+        )
+    else:
+        meta["fecha"], meta["entidad_emisora"] = complete_html_metadata_with_gemini(
+            meta["fecha"], meta["entidad_emisora"], doc["gemini_input"], meta["fuente"], doc["path"], log
+        )
+    doc["gemini_input"] = None
+    return doc
 
+def run_inline(fn, *fn_args):
+    """Ejecuta fn en el proceso actual y devuelve un Future ya resuelto (modo --workers 1)"""
+    future = Future()
+    try:
+        future.set_result(fn(*fn_args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
 
-# PROCESAR HTML
-html_files = [f for f in os.listdir(HTML_DIR) if f.lower().endswith(".html")]
-print(f"\n[SETUP] Archivos HTML detectados:\n {html_files}\n")
 
-for file in html_files:
-    path = os.path.join(HTML_DIR, file)
-    print(f"\n[HTML] Procesando HTML: {file}\n")
-    loader = UnstructuredHTMLLoader(path)
-    docs = loader.load()
-    print(f" - Fragmentos cargados: {len(docs)}")
+def setup(no_llm_cache=False):
+    """Crea el cliente de Gemini y el cache de respuestas (también lo usa streaming_pipeline.py)"""
+    global client, llm_cache
 
-    full_text = "\n".join([d.page_content for d in docs])
-    idioma = detect(full_text)
-    print(f" - Idioma detectado: {idioma}")
+    os.makedirs(OUT_DIR, exist_ok=True)
 
-    chunks = text_splitter.split_text(full_text)
-    print(f" - Número de chunks generados: {len(chunks)}")
+    # GEMINI AI SETUP
+    client = get_client()
+    print("[GEMINI SETUP] PASS: Gemini configurado correctamente.\n")
 
-    sample_text = " ".join(chunks[:2])
+    llm_cache = LLMCache(bypass=no_llm_cache or None)
+    llm_cache.invalidate_stale("pdf_metadata", PDF_META_PROMPT_VERSION)
+    llm_cache.invalidate_stale("html_metadata", HTML_META_PROMPT_VERSION)
 
-    fecha_doc, autor_doc, url_doc = get_html_metadata(path)
-    metadata = {
-        "fuente": url_doc,
-        "tipo": "html",
-        "idioma": idioma,
-        "fecha": fecha_doc,
-        "entidad_emisora": autor_doc,
-    }
+def list_sources():
+    pdf_files = sorted(f for f in os.listdir(PDF_DIR) if f.lower().endswith(".pdf"))
+    print(f"[SETUP] Archivos PDF detectados:\n {pdf_files}\n")
+    html_files = sorted(f for f in os.listdir(HTML_DIR) if f.lower().endswith(".html"))
+    print(f"[SETUP] Archivos HTML detectados:\n {html_files}\n")
+    return [("pdf", PDF_DIR, f) for f in pdf_files] + [("html", HTML_DIR, f) for f in html_files]
 
+def plan_ingest(sources, force=False):
+    """
+    Separa los documentos nuevos o modificados de los que no cambiaron.
+    Devuelve (manifest anterior, manifest nuevo con los omitidos, pendientes, omitidos).
+    Con force todos quedan pendientes, pero el manifest anterior se devuelve igual para borrar
+    las salidas de los documentos eliminados.
+    """
+    old_manifest = load_manifest()
+    manifest = {}
+    pending, skipped = [], []
+    for tipo, folder, file in sources:
+        key = f"{tipo}/{file}"
+        path = os.path.join(folder, file)
+        changed, entry = check_source(path, None if force else old_manifest.get(key))
+        if not changed:
+            manifest[key] = entry
+            skipped.append(key)
+        else:
+            pending.append((key, tipo, path, file, entry))
+    return old_manifest, manifest, pending, skipped
+
+def chain_metadata(parse_future, gemini_pool):
+    """Future que termina cuando el documento está parseado y con su metadata completa (o con el error de cualquiera)"""
+    result = Future()
+
+    def copy_result(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(future.result())
+
+    def on_parsed(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+            return
+        try:
+            gemini_pool.submit(complete_metadata, future.result()).add_done_callback(copy_result)
+        except RuntimeError as e:  # Pool cerrado porque se dejó de consumir el generador
+            result.set_exception(e)
+
+    parse_future.add_done_callback(on_parsed)
+    return result
+
+def iter_parsed_documents(pending, workers=1, gemini_workers=4):
+    """
+    Procesa los documentos pendientes y los entrega en orden como (key, file, entry, doc, error).
+    El parseo (CPU) va al pool de procesos y, apenas termina cada uno, su metadata faltante va al pool de Gemini.
+    Solo hay una ventana de 2 * max(workers, gemini_workers) documentos en curso: cada documento se entrega
+    en cuanto él y los anteriores están listos, y la memoria no depende del tamaño del corpus.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    gemini_pool = ThreadPoolExecutor(max_workers=gemini_workers)
+    submit = pool.submit if pool else run_inline
+    window_size = 2 * max(workers, gemini_workers, 1)
+    if pool:
+        print(f"[SETUP] Parseando {len(pending)} documentos con {workers} procesos\n")
+
+    try:
+        window = deque()
+        remaining = iter(pending)
+        while True:
+            # Completar la ventana, salvo que el documento más antiguo ya se pueda entregar
+            while len(window) < window_size and not (window and window[0][1].done()):
+                item = next(remaining, None)
+                if item is None:
+                    break
+                _, tipo, path, file, _ = item
+                window.append((item, chain_metadata(submit(parse_document, tipo, path, file), gemini_pool)))
+            if not window:
+                break
+
+            (key, _, _, file, entry), meta_future = window.popleft()
+            try:
+                yield key, file, entry, meta_future.result(), None
+            except Exception as e:
+                yield key, file, entry, None, e
+    finally:
+        gemini_pool.shutdown()
+        if pool:
+            pool.shutdown()
+
+def save_parsed_document(key, file, entry, doc, manifest, old_manifest):
+    """Guarda el JSON del documento y lo registra en el manifest. Devuelve el nombre del JSON"""
+    for line in doc["logs"]:
+        print(line)
     base_name = clean_filename(file)
-    save_doc_json(chunks, metadata, base_name)
\ No newline at end of file
+    save_doc_json(doc["chunks"], doc["metadata"], base_name)
+
+    entry["output"] = f"{base_name}.json"
+    manifest[key] = entry
+    # Guardar tras cada documento para no perder el avance si el proceso se corta
+    save_manifest({**old_manifest, **manifest})
+    return entry["output"]
+
+def remove_deleted_outputs(sources, old_manifest):
+    """Documentos eliminados: borrar sus JSON de salida. Devuelve las claves eliminadas"""
+    removed = []
+    current_keys = {f"{tipo}/{file}" for tipo, _, file in sources}
+    for key, entry in old_manifest.items():
+        if key in current_keys:
+            continue
+        out_path = os.path.join(OUT_DIR, entry.get("output", ""))
+        if entry.get("output") and os.path.exists(out_path):
+            os.remove(out_path)
+            print(f"[MANIFEST] Eliminado {out_path} (fuente {key} ya no existe)")
+        removed.append(key)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta incremental de documentos PDF y HTML")
+    parser.add_argument("--force", action="store_true", help="Reprocesa todos los documentos ignorando el manifest")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos para parsear documentos en paralelo")
+    parser.add_argument("--gemini-workers", type=int, default=4, help="Consultas simultáneas a Gemini para metadata")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Ignora las respuestas guardadas en el cache del LLM")
+    args = parser.parse_args()
+
+    print()
+    setup(no_llm_cache=args.no_llm_cache)
+
+    sources = list_sources()
+    old_manifest, manifest, pending, skipped = plan_ingest(sources, force=args.force)
+    processed, failed = [], []
+
+    # Los resultados se guardan e imprimen en el orden de los documentos
+    for key, file, entry, doc, error in iter_parsed_documents(pending, args.workers, args.gemini_workers):
+        if error is not None:
+            print(f"[ERROR] No se pudo procesar {key}: {error}")
+            failed.append(key)
+            continue
+        save_parsed_document(key, file, entry, doc, manifest, old_manifest)
+        processed.append(key)
+
+    removed = remove_deleted_outputs(sources, old_manifest)
+    save_manifest(manifest)
+
+    print("\n[RESUMEN INGESTA]")
+    print(f" - Procesados: {len(processed)}")
+    print(f" - Sin cambios (omitidos): {len(skipped)}")
+    print(f" - Eliminados: {len(removed)}")
+    if failed:
+        print(f" - Con error: {len(failed)} {failed}")
+    llm_cache.print_stats()
+
+
+if __name__ == "__main__":
+    main()
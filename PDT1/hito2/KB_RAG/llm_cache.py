@@ -0,0 +1,165 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# VARIABLES GLOBALES
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(BASE_DIR, "llm_cache.sqlite"))
+DEFAULT_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+DEFAULT_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+DEFAULT_BYPASS = os.getenv("LLM_CACHE_BYPASS", "") not in ("", "0", "false", "False")
+
+
+class LLMCache:
+    """
+    Cache en disco (SQLite) de respuestas de generate_content.
+    - Clave: sha256(modelo, plantilla, versión de plantilla, prompt)
+    - Expiración por TTL y eviction LRU cuando el tamaño total supera max_mb
+    - Cambiar la versión de una plantilla invalida solo las entradas de esa plantilla
+    - bypass=True ignora las entradas guardadas (siempre llama al modelo) pero guarda la respuesta nueva;
+      por defecto se toma de la variable de entorno LLM_CACHE_BYPASS
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_days=DEFAULT_TTL_DAYS, max_mb=DEFAULT_MAX_MB, bypass=None):
+        self.path = path
+        self.ttl = ttl_days * 24 * 3600 if ttl_days else None
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.bypass = DEFAULT_BYPASS if bypass is None else bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                template TEXT NOT NULL,
+                version TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_template ON responses(template, version)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, template, version, prompt):
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = f"{model}\x00{template}\x00{version}\x00{prompt_hash}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def invalidate_stale(self, template, version):
+        """Borra las entradas de la plantilla generadas con otra versión. Devuelve cuántas borró"""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM responses WHERE template = ? AND version != ?", (template, str(version))
+            )
+            self._conn.commit()
+        if cur.rowcount:
+            print(f"[LLM CACHE] {cur.rowcount} respuestas de '{template}' invalidadas (nueva versión {version})")
+        return cur.rowcount
+
+    def get(self, model, template, version, prompt):
+        if self.bypass:
+            with self._lock:
+                self.misses += 1
+            return None
+        key = self.make_key(model, template, str(version), prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, template, version, prompt, response):
+        key = self.make_key(model, template, str(version), prompt)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, template, version, model, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, template, str(version), model, response, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+            "size_mb": round(size / (1024 * 1024), 2)
+        }
+
+    def print_stats(self, tag="LLM CACHE"):
+        s = self.stats()
+        modo = " (bypass)" if self.bypass else ""
+        print(f"[{tag}]{modo} hits: {s['hits']}, misses: {s['misses']} (hit rate {s['hit_rate']:.1%}), "
+              f"entradas: {s['entries']}, tamaño: {s['size_mb']} MB")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def cached_generate_content(client, prompt, template, version, model="gemini-2.5-flash-lite", cache=None, before_call=None,
+                            validate=None):
+    """
+    Llama a generate_content con un prompt de texto y devuelve response.text, pasando por el cache.
+    before_call se ejecuta solo cuando hay que llamar al modelo (ej. rate_limiter.wait).
+    validate(text) indica si la respuesta se puede usar: las que no pasan no se guardan, y si hay una
+    guardada que no pasa se vuelve a llamar al modelo (así una respuesta malformada no se repite en cada ejecución).
+    Las excepciones de la API se propagan sin guardar nada.
+    """
+    if cache:
+        cached = cache.get(model, template, version, prompt)
+        if cached is not None and (validate is None or validate(cached)):
+            return cached
+    if before_call:
+        before_call()
+    response = client.models.generate_content(
+        model=model,
+        contents=[prompt]
+    )
+    text = response.text or ""
+    if cache and text.strip() and (validate is None or validate(text)):
+        cache.put(model, template, version, prompt, text)
+    return text
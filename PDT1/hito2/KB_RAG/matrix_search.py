@@ -0,0 +1,82 @@
+import numpy as np
+
+# Búsqueda exacta por lotes con NumPy: la KB completa es una matriz (n_docs x dim) en memoria,
+# las consultas otra (n_consultas x dim) y la similitud de todas contra todas es un solo producto de matrices.
+# Los vectores se normalizan, así el producto es la similitud coseno (mismo orden que la distancia L2
+# de Chroma para embeddings normalizados como los de Gemini).
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def bits_to_mask(bits, n):
+    """Bitset (int) del índice de metadata -> arreglo booleano de largo n"""
+    if not n:
+        return np.zeros(0, dtype=bool)
+    raw = np.frombuffer(bits.to_bytes((n + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little")[:n].astype(bool)
+
+def load_kb_matrix(vector_store, index):
+    """Lee los embeddings de la colección y los ordena según las posiciones del MetadataIndex"""
+    raw = vector_store._collection.get(include=["embeddings"])
+    matrix = np.zeros((len(index), len(raw["embeddings"][0]) if len(raw["ids"]) else 0), dtype=np.float32)
+    for doc_id, emb in zip(raw["ids"], raw["embeddings"]):
+        pos = index.position.get(doc_id)
+        if pos is not None:
+            matrix[pos] = emb
+    return normalize_rows(matrix)
+
+
+class MatrixSearch:
+    """
+    Top-k exacto para muchas consultas a la vez.
+    - index: MetadataIndex de retriever.py (sus posiciones son las filas de la matriz)
+    - matrix: embeddings normalizados de la KB, alineados con el índice
+    """
+
+    def __init__(self, index, matrix):
+        self.index = index
+        self.matrix = matrix
+        self._masks = {}
+
+    def mask(self, filters):
+        key = repr(sorted((k, repr(v)) for k, v in (filters or {}).items()))
+        if key not in self._masks:
+            self._masks[key] = bits_to_mask(self.index.match(filters), len(self.index))
+        return self._masks[key]
+
+    def search_many(self, query_matrix, requests):
+        """
+        requests: lista de (fila de query_matrix, filtros, top_k).
+        Devuelve, por cada request, las posiciones de sus top_k documentos que cumplen los filtros,
+        de más a menos similar. Todas las similitudes salen de un solo producto de matrices
+        y las máscaras y el top-k se aplican sobre la matriz completa de requests.
+        """
+        if not requests or not len(self.index):
+            return [[] for _ in requests]
+        # Si la KB está en dimensión reducida se usan las primeras componentes de la consulta (MRL)
+        query_matrix = np.asarray(query_matrix, dtype=np.float32)[:, :self.matrix.shape[1]]
+        scores = normalize_rows(query_matrix) @ self.matrix.T  # (n_consultas, n_docs)
+
+        rows = np.array([r for r, _, _ in requests])
+        masks = np.stack([self.mask(f) for _, f, _ in requests])
+        masked = np.where(masks, scores[rows], -np.inf)
+
+        k_max = min(max(k for _, _, k in requests), masked.shape[1])
+        top = np.argpartition(-masked, k_max - 1, axis=1)[:, :k_max]
+        top_scores = np.take_along_axis(masked, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        results = []
+        for i, (_, _, k) in enumerate(requests):
+            valid = np.isfinite(top_scores[i, :k])
+            results.append(top[i, :k][valid].tolist())
+        return results
+
+    def documents(self, positions):
+        return [self.index.document(pos) for pos in positions]
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import random
+import argparse
+import numpy as np
+from retriever import MetadataIndex, Retriever, open_backend
+from matrix_search import normalize_rows
+
+# Backend vectorial alternativo a Chroma: la KB es una matriz NumPy en disco (vectors.npy) que se abre
+# con mmap sin copiarla, más un archivo de metadata por columnas. La búsqueda es top-k exacto sobre
+# los vectores guardados, que pueden ir en dimensión reducida y float16/int8 con re-rank opcional en float32.
+# Al ser de solo lectura, varios procesos pueden abrir el mismo archivo y compartir las páginas en memoria.
+
+# VARIABLES GLOBALES
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+NUMPY_INDEX_DIR = os.path.join(BASE_DIR, "vectorstore_numpy")
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+FULL_VECTORS_FILE = "vectors_full.npy"
+METADATA_FILE = "metadata.json"
+DTYPES = ("float32", "float16", "int8")
+RERANK_FACTOR = 4  # candidatos de la búsqueda gruesa por cada resultado pedido
+
+
+# COMPRESIÓN
+def truncate(vectors, dim):
+    """Primeras dim componentes renormalizadas (los embeddings de Gemini se entrenan con MRL)"""
+    if not dim or dim >= vectors.shape[1]:
+        return vectors
+    return normalize_rows(vectors[:, :dim])
+
+def quantize(vectors, dtype):
+    """Vectores normalizados -> (matriz guardada, escala por fila si es int8)"""
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+def coarse_scores(stored, scales, q, block_rows=2048):
+    """Producto por bloques: float16/int8 se convierten a float32 de a un bloque (más rápido que operar en float16)"""
+    if stored.dtype == np.float32:
+        scores = stored @ q
+    else:
+        scores = np.empty(len(stored), dtype=np.float32)
+        for start in range(0, len(stored), block_rows):
+            scores[start:start + block_rows] = stored[start:start + block_rows].astype(np.float32) @ q
+    if scales is not None:
+        scores = scores * scales
+    return scores
+
+def top_k_rows(scores, k):
+    """Índices de los k mayores puntajes, de mayor a menor"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+def search_rows(stored, scales, query, k, full=None, rerank_factor=RERANK_FACTOR, rows=None):
+    """
+    Top-k sobre las filas rows (o todas). Búsqueda gruesa sobre la matriz comprimida y, si hay
+    vectores completos, re-rank exacto en float32 de los k*rerank_factor mejores candidatos.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    q = normalize_rows(query[:stored.shape[1]].reshape(1, -1))[0]
+    sub = stored if rows is None else stored[rows]
+    sub_scales = None if scales is None else (scales if rows is None else scales[rows])
+    scores = coarse_scores(sub, sub_scales, q)
+
+    if full is None or len(query) < full.shape[1]:
+        top = top_k_rows(scores, k)
+    else:
+        candidates = top_k_rows(scores, k * rerank_factor)
+        cand_rows = candidates if rows is None else rows[candidates]
+        q_full = normalize_rows(query[:full.shape[1]].reshape(1, -1))[0]
+        exact = np.asarray(full[cand_rows], dtype=np.float32) @ q_full
+        top = candidates[top_k_rows(exact, k)]
+    return top if rows is None else rows[top]
+
+
+# ESCRITURA
+def write_index(ids, documents, metadatas, embeddings, path=NUMPY_INDEX_DIR, dtype="float32", dim=None, rerank=False):
+    """
+    Guarda la KB con las filas en el orden del MetadataIndex (texto más largo primero),
+    así la fila de cada documento coincide con su posición en el índice de metadata.
+    - dtype: float32, float16 o int8 (con una escala float32 por fila)
+    - dim: guarda solo las primeras dim componentes (768, 1536...)
+    - rerank: guarda además los vectores completos en float32 para re-rankear los candidatos
+    """
+    index = MetadataIndex(ids, documents, metadatas)
+    emb_by_id = dict(zip(ids, embeddings))
+    full = normalize_rows(np.array([emb_by_id[doc_id] for doc_id in index.ids], dtype=np.float32))
+    coarse = truncate(full, dim)
+    stored, scales = quantize(coarse, dtype)
+
+    fields = sorted({k for meta in index.metadatas for k in meta})
+    data = {
+        "dtype": dtype,
+        "dim": int(coarse.shape[1]) if len(coarse) else 0,
+        "full_dim": int(full.shape[1]) if len(full) else 0,
+        "rerank": bool(rerank),
+        "ids": index.ids,
+        "documents": index.documents,
+        "columns": {field: [meta.get(field) for meta in index.metadatas] for field in fields}
+    }
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {VECTORS_FILE: stored, SCALES_FILE: scales, FULL_VECTORS_FILE: full if rerank else None}
+    for name, arr in arrays.items():
+        file_path = os.path.join(path, name)
+        if arr is None:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            continue
+        with open(file_path + ".tmp", "wb") as f:
+            np.save(f, arr)
+        os.replace(file_path + ".tmp", file_path)
+    metadata_path = os.path.join(path, METADATA_FILE)
+    with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(metadata_path + ".tmp", metadata_path)
+    print(f"[NUMPY INDEX] {len(index)} vectores {dtype} de dimensión {data['dim']}"
+          f"{' (con re-rank float32)' if rerank else ''} guardados en: {path}")
+
+def export_from_chroma(vector_store, path=NUMPY_INDEX_DIR, dtype="float32", dim=None, rerank=False):
+    raw = vector_store._collection.get(include=["documents", "metadatas", "embeddings"])
+    write_index(raw["ids"], raw["documents"], raw["metadatas"], raw["embeddings"],
+                path=path, dtype=dtype, dim=dim, rerank=rerank)
+
+
+# BACKEND
+class NumpyBackend:
+    """
+    Top-k sobre la matriz abierta con mmap; mismo contrato que ChromaBackend en retriever.py.
+    Si el índice se guardó con rerank, la búsqueda es en dos etapas (gruesa + exacta).
+    """
+
+    name = "numpy"
+    supports_candidates = True
+
+    def __init__(self, path=NUMPY_INDEX_DIR, rerank_factor=RERANK_FACTOR):
+        self.path = path
+        self.rerank_factor = rerank_factor
+
+    def _load_array(self, name):
+        file_path = os.path.join(self.path, name)
+        return np.load(file_path, mmap_mode="r") if os.path.exists(file_path) else None
+
+    def load(self):
+        with open(os.path.join(self.path, METADATA_FILE), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.vectors = self._load_array(VECTORS_FILE)
+        self.scales = self._load_array(SCALES_FILE) if data.get("dtype") == "int8" else None
+        self.full = self._load_array(FULL_VECTORS_FILE) if data.get("rerank") else None
+        self.ids = data["ids"]
+        self.documents = data["documents"]
+        columns = data["columns"]
+        self.metadatas = [
+            {field: col[i] for field, col in columns.items() if col[i] is not None}
+            for i in range(len(self.ids))
+        ]
+        self.row = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return self.ids, self.documents, self.metadatas
+
+    def query(self, query_emb, n_results, candidates=None):
+        rows = None
+        if candidates is not None:
+            rows = np.fromiter((self.row[c] for c in candidates if c in self.row), dtype=np.int64)
+        top = search_rows(self.vectors, self.scales, query_emb, n_results,
+                          full=self.full, rerank_factor=self.rerank_factor, rows=rows)
+        return [(self.ids[i], self.documents[i], self.metadatas[i]) for i in top]
+
+    def matrix(self, index):
+        """
+        Matriz float32 normalizada en el orden del índice para el modo por lotes:
+        los vectores completos si existen, si no los comprimidos (int8 se descomprime)
+        """
+        if self.full is not None:
+            matrix = self.full
+        elif self.scales is not None:
+            matrix = self.vectors.astype(np.float32) * self.scales[:, None]
+        else:
+            matrix = self.vectors
+        if index.ids == self.ids:
+            return matrix
+        return matrix[[self.row[doc_id] for doc_id in index.ids]]
+
+
+# BENCHMARK
+def dir_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total / (1024 * 1024)
+
+def full_query_vectors(retrievers, rows):
+    """Embeddings completos (float32) de las filas del índice NumPy, para usarlos como queries en ambos backends"""
+    numpy_backend = retrievers["numpy"].backend
+    if numpy_backend.full is not None:
+        return [np.asarray(numpy_backend.full[row], dtype=np.float32).tolist() for row in rows]
+    ids = [numpy_backend.ids[row] for row in rows]
+    unique_ids = list(dict.fromkeys(ids))
+    raw = retrievers["chroma"].backend.vector_store._collection.get(ids=unique_ids, include=["embeddings"])
+    by_id = dict(zip(raw["ids"], raw["embeddings"]))
+    return [np.asarray(by_id[doc_id], dtype=np.float32).tolist() for doc_id in ids]
+
+def benchmark(n_queries=200, top_k=5, seed=0):
+    """
+    Compara Chroma y el backend NumPy con las mismas consultas: vectores de la propia KB como query
+    (sin llamar a Gemini) y filtros aleatorios de dimensión y nivel.
+    Las queries son los embeddings completos en float32 (vectors_full.npy o los guardados en Chroma), no los
+    comprimidos: ambos backends reciben la misma query y el NumPy la reduce a su dimensión al buscar.
+    """
+    retrievers = {}
+    for name in ("chroma", "numpy"):
+        start = time.perf_counter()
+        retrievers[name] = Retriever(open_backend(name), embed_fn=None)
+        print(f"[BENCHMARK] {name}: abierto en {(time.perf_counter() - start) * 1000:.1f} ms ({len(retrievers[name])} vectores)")
+
+    index = retrievers["numpy"].index
+    rng = random.Random(seed)
+    dims = sorted(v for v in index.postings.get("dimension", {}) if v)
+    niveles = sorted(v for v in index.postings.get("nivel", {}) if v)
+    sampled = []
+    for _ in range(n_queries):
+        row = rng.randrange(len(index))
+        filters = {}
+        if dims and rng.random() < 0.8:
+            filters["dimension"] = rng.choice(dims)
+        if niveles and rng.random() < 0.6:
+            filters["nivel"] = rng.choice(niveles)
+        sampled.append((row, filters))
+    embeddings = full_query_vectors(retrievers, [row for row, _ in sampled])
+    queries = [(emb, filters) for emb, (_, filters) in zip(embeddings, sampled)]
+
+    results = {}
+    for name, retriever in retrievers.items():
+        latencies = []
+        results[name] = []
+        for query_emb, filters in queries:
+            start = time.perf_counter()
+            docs = retriever.search_by_vector(query_emb, top_k, filters)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results[name].append([d.metadata.get("doc_id") or d.page_content for d in docs])
+        latencies.sort()
+        print(f"[BENCHMARK] {name}: latencia media {sum(latencies) / len(latencies):.2f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms")
+
+    overlaps = [
+        len(set(a) & set(b)) / max(len(a), 1)
+        for a, b in zip(results["chroma"], results["numpy"])
+    ]
+    print(f"[BENCHMARK] Coincidencia top-{top_k} chroma vs numpy: {sum(overlaps) / len(overlaps):.1%}")
+    print(f"[BENCHMARK] Tamaño en disco: chroma {dir_size_mb(os.path.join(BASE_DIR, 'vectorstore_chroma')):.1f} MB, "
+          f"numpy {dir_size_mb(NUMPY_INDEX_DIR):.1f} MB")
+
+
+def compression_report(dims=(768, 1536), dtypes=DTYPES, n_queries=200, top_k=10, rerank_factor=RERANK_FACTOR,
+                       seed=0, out_path=None):
+    """
+    Memoria, latencia y recall@k de cada combinación (dimensión, dtype, re-rank) contra la configuración
+    actual (vectores completos en float32, búsqueda exacta). Las consultas son vectores de la propia KB
+    excluyendo su propio documento de los resultados (leave-one-out), sin llamar a Gemini.
+    """
+    raw = open_backend("chroma").vector_store._collection.get(include=["embeddings"])
+    full = normalize_rows(np.array(raw["embeddings"], dtype=np.float32))
+    n, full_dim = full.shape
+    rng = random.Random(seed)
+    query_rows = [rng.randrange(n) for _ in range(n_queries)]
+
+    def run(search):
+        latencies, results = [], []
+        for row in query_rows:
+            start = time.perf_counter()
+            top = search(full[row])
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append([r for r in top.tolist() if r != row][:top_k])
+        return sum(latencies) / len(latencies), results
+
+    base_latency, truth = run(lambda q: top_k_rows(full @ q, top_k + 1))
+    base_mb = full.nbytes / (1024 * 1024)
+    rows = [{"dim": full_dim, "dtype": "float32", "rerank": False, "memoria_mb": round(base_mb, 2),
+             "latencia_ms": round(base_latency, 3), "recall": 1.0}]
+
+    for dim in sorted({d for d in dims if d and d < full_dim} | {full_dim}):
+        coarse = truncate(full, dim)
+        for dtype in dtypes:
+            stored, scales = quantize(coarse, dtype)
+            mem_mb = (stored.nbytes + (scales.nbytes if scales is not None else 0)) / (1024 * 1024)
+            for rerank in (False, True):
+                if dim == full_dim and dtype == "float32":
+                    continue
+                latency, results = run(lambda q: search_rows(stored, scales, q, top_k + 1,
+                                                             full=full if rerank else None,
+                                                             rerank_factor=rerank_factor))
+                recall = sum(len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth)) / len(truth)
+                rows.append({"dim": dim, "dtype": dtype, "rerank": rerank, "memoria_mb": round(mem_mb, 2),
+                             "latencia_ms": round(latency, 3), "recall": round(recall, 4)})
+
+    print(f"\n[REPORTE] {n} vectores, {n_queries} consultas, recall@{top_k} contra {full_dim}-d float32 exacto")
+    print(f"{'dim':>5} {'dtype':>8} {'re-rank':>8} {'memoria MB':>11} {'latencia ms':>12} {'recall':>7}")
+    for r in rows:
+        print(f"{r['dim']:>5} {r['dtype']:>8} {'sí' if r['rerank'] else 'no':>8} {r['memoria_mb']:>11.2f} "
+              f"{r['latencia_ms']:>12.3f} {r['recall']:>7.3f}")
+    print("Con re-rank los vectores completos se leen del mmap solo para los candidatos; la memoria indicada es la del índice grueso.")
+
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"n": n, "queries": n_queries, "top_k": top_k, "resultados": rows}, f, ensure_ascii=False, indent=2)
+        print(f"[REPORTE] Guardado en: {out_path}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice vectorial NumPy (mmap) como alternativa a Chroma")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Exporta la colección de Chroma al índice NumPy")
+    build.add_argument("--dtype", choices=DTYPES, default="float32", help="Tipo de los vectores guardados")
+    build.add_argument("--dim", type=int, default=None, help="Guarda solo las primeras N componentes (ej. 768, 1536)")
+    build.add_argument("--rerank", action="store_true", help="Guarda además los vectores completos para re-rankear en float32")
+    bench = sub.add_parser("benchmark", help="Compara latencia y resultados de Chroma y NumPy")
+    bench.add_argument("--queries", type=int, default=200, help="Número de consultas")
+    bench.add_argument("--top-k", type=int, default=5, help="Resultados por consulta")
+    report = sub.add_parser("report", help="Memoria, latencia y recall@k de dimensiones reducidas y cuantización")
+    report.add_argument("--dims", type=int, nargs="+", default=[768, 1536], help="Dimensiones a evaluar")
+    report.add_argument("--dtypes", nargs="+", choices=DTYPES, default=list(DTYPES), help="Tipos a evaluar")
+    report.add_argument("--queries", type=int, default=200, help="Número de consultas")
+    report.add_argument("--top-k", type=int, default=10, help="k del recall@k")
+    report.add_argument("--rerank-factor", type=int, default=RERANK_FACTOR, help="Candidatos por resultado en el re-rank")
+    report.add_argument("--out", default=None, help="Guarda el reporte en JSON")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        chroma = open_backend("chroma")
+        export_from_chroma(chroma.vector_store, dtype=args.dtype, dim=args.dim, rerank=args.rerank)
+    elif args.command == "report":
+        compression_report(dims=args.dims, dtypes=args.dtypes, n_queries=args.queries, top_k=args.top_k,
+                           rerank_factor=args.rerank_factor, out_path=args.out)
+    else:
+        benchmark(n_queries=args.queries, top_k=args.top_k)
+
+
+if __name__ == "__main__":
+    main()
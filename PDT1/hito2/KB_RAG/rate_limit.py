@@ -0,0 +1,26 @@
+import time
+import threading
+
+
+class RateLimiter:
+    """
+    Limita las peticiones por minuto compartidas entre hilos.
+    Reparte las peticiones en intervalos uniformes de 60/rpm segundos.
+    """
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        """Bloquea hasta que haya un turno disponible"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
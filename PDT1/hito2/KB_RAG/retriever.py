@@ -0,0 +1,304 @@
+import os
+import ast
+import threading
+
+# VARIABLES GLOBALES
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VECTOR_DB_DIR = os.path.join(BASE_DIR, "vectorstore_chroma")
+DEFAULT_BACKEND = os.getenv("KB_BACKEND", "chroma")
+
+# Campos de metadata que se guardan normalizados al indexar, como <campo>_norm
+STRUCTURED_FIELDS = ("tags", "tema", "nivel", "dimension")
+NORM_SUFFIX = "_norm"
+LIST_SEP = "|"
+
+
+# LangChain se importa recién al construir el primer Document
+_document_cls = None
+
+def make_document(page_content, metadata):
+    global _document_cls
+    if _document_cls is None:
+        from langchain.docstore.document import Document
+        _document_cls = Document
+    return _document_cls(page_content=page_content, metadata=metadata)
+
+
+# NORMALIZACIÓN
+def normalize_str(s):
+    if not s:
+        return ""
+    return str(s).strip().lower()
+
+def normalize_list(lst):
+    return [normalize_str(x) for x in lst]
+
+def parse_list(value):
+    """Convierte una lista guardada como texto ("['MFA', 'contraseñas']") en lista de Python"""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str) and value.startswith("[") and value.endswith("]"):
+        try:
+            parsed = ast.literal_eval(value)
+            if isinstance(parsed, (list, tuple)):
+                return list(parsed)
+        except (ValueError, SyntaxError):
+            pass
+        items = value[1:-1].replace("'", "").replace('"', "").split(",")
+        return [t.strip() for t in items if t.strip()]
+    if value is None or value == "":
+        return []
+    return [value]
+
+def structured_metadata(meta: dict):
+    """
+    Versión normalizada de tags, tema, nivel y dimension para guardar junto a la metadata al indexar.
+    Chroma solo admite escalares, así que las listas se guardan como "|valor1|valor2|".
+    """
+    out = {}
+    for field in STRUCTURED_FIELDS:
+        if field not in meta:
+            continue
+        values = [v for v in normalize_list(parse_list(meta[field])) if v]
+        out[field + NORM_SUFFIX] = LIST_SEP + LIST_SEP.join(values) + LIST_SEP if values else ""
+    return out
+
+def field_values(meta: dict, field):
+    """Valores normalizados de un campo. Usa el campo *_norm si el índice lo tiene, si no lo deriva"""
+    norm = meta.get(field + NORM_SUFFIX)
+    if isinstance(norm, str) and (norm == "" or norm.startswith(LIST_SEP)):
+        return [v for v in norm.split(LIST_SEP) if v]
+    value = meta.get(field)
+    if field in ("tags", "tema"):
+        return [v for v in normalize_list(parse_list(value)) if v]
+    return [normalize_str(value)]
+
+
+# ÍNDICE INVERTIDO DE METADATA
+def iter_bits(bits):
+    """Posiciones de los bits encendidos, de menor a mayor"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+class MetadataIndex:
+    """
+    Índice invertido en memoria: campo -> valor normalizado -> bitset (int) de posiciones.
+    Las posiciones siguen el orden de prioridad del filtrado (texto más largo primero),
+    así los primeros bits encendidos de la intersección son directamente el top-k.
+    Semántica de los filtros (la de semantic_query):
+    - tags: alguno de los tags pedidos coincide exacto con un tag del documento
+    - nivel: el nivel del documento está en la lista pedida
+    - resto (tema, dimension, fuente...): el valor pedido es substring de algún valor del documento
+    """
+
+    def __init__(self, ids, documents, metadatas):
+        order = sorted(range(len(ids)), key=lambda i: len(documents[i] or ""), reverse=True)
+        self.ids = [ids[i] for i in order]
+        self.documents = [documents[i] for i in order]
+        self.metadatas = [metadatas[i] or {} for i in order]
+        self.position = {doc_id: pos for pos, doc_id in enumerate(self.ids)}
+        self.all_bits = (1 << len(self.ids)) - 1
+
+        self.present = {}   # campo -> bitset de documentos que tienen el campo
+        self.postings = {}  # campo -> valor -> bitset
+        self._substring_cache = {}
+        for pos, meta in enumerate(self.metadatas):
+            bit = 1 << pos
+            for field in meta:
+                if field.endswith(NORM_SUFFIX):
+                    continue
+                self.present[field] = self.present.get(field, 0) | bit
+                postings = self.postings.setdefault(field, {})
+                for value in field_values(meta, field):
+                    postings[value] = postings.get(value, 0) | bit
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _exact(self, field, values):
+        postings = self.postings.get(field, {})
+        bits = 0
+        for v in values:
+            bits |= postings.get(normalize_str(v), 0)
+        return bits
+
+    def _substring(self, field, value):
+        value = normalize_str(value)
+        if not value:
+            return self.present.get(field, 0)
+        key = (field, value)
+        if key not in self._substring_cache:
+            bits = 0
+            for v, b in self.postings.get(field, {}).items():
+                if value in v:
+                    bits |= b
+            self._substring_cache[key] = bits
+        return self._substring_cache[key]
+
+    def match(self, filters):
+        """Bitset de los documentos que cumplen todos los filtros"""
+        bits = self.all_bits
+        for key, val in (filters or {}).items():
+            if key in ("tags", "nivel"):
+                bits &= self._exact(key, val if isinstance(val, list) else [val])
+            else:
+                bits &= self._substring(key, val)
+            if not bits:
+                break
+        return bits
+
+    def document(self, pos):
+        return make_document(self.documents[pos], self.metadatas[pos])
+
+
+# BACKENDS
+# Un backend entrega la KB completa (load) y busca los vecinos de un vector (query),
+# opcionalmente restringido a una lista de IDs candidatos si supports_candidates es True.
+class ChromaBackend:
+    """Colección de langchain_chroma (índice HNSW). Los candidatos se pasan como where doc_id $in"""
+
+    name = "chroma"
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+        self.supports_candidates = False
+
+    def load(self):
+        raw = self.vector_store._collection.get(include=["documents", "metadatas"])
+        self.supports_candidates = bool(raw["ids"]) and all("doc_id" in (m or {}) for m in raw["metadatas"])
+        if raw["ids"] and not self.supports_candidates:
+            print("[RETRIEVER] La colección no tiene doc_id en la metadata (reindexar con vector_store.py); "
+                  "las búsquedas filtradas usarán sobre-muestreo")
+        return raw["ids"], raw["documents"], raw["metadatas"]
+
+    def query(self, query_emb, n_results, candidates=None):
+        raw = self.vector_store._collection.query(
+            query_embeddings=[query_emb],
+            n_results=n_results,
+            where={"doc_id": {"$in": candidates}} if candidates is not None else None,
+            include=["documents", "metadatas"]
+        )
+        return list(zip(raw["ids"][0], raw["documents"][0], raw["metadatas"][0]))
+
+    def matrix(self, index):
+        """Embeddings de la KB como matriz NumPy alineada con el índice (modo por lotes)"""
+        from matrix_search import load_kb_matrix
+        return load_kb_matrix(self.vector_store, index)
+
+
+def open_backend(name=DEFAULT_BACKEND):
+    """Abre el backend pedido ("chroma" o "numpy") importando solo las dependencias de ese backend"""
+    if name == "numpy":
+        from numpy_index import NumpyBackend
+        return NumpyBackend()
+    if name == "chroma":
+        from langchain_chroma import Chroma
+        return ChromaBackend(Chroma(collection_name="kb_rag", persist_directory=VECTOR_DB_DIR))
+    raise ValueError(f"Backend desconocido: {name}")
+
+
+# RETRIEVER
+def popcount(bits):
+    return bin(bits).count("1")
+
+class Retriever:
+    """
+    semantic_query sobre un backend vectorial (ChromaBackend o NumpyBackend de numpy_index.py).
+    Al cargar lee una sola vez la KB y arma el índice de metadata; las búsquedas solo por filtros
+    no vuelven a leer la colección.
+    Con query_text los filtros se resuelven antes de buscar: el índice entrega los documentos candidatos
+    y la búsqueda vectorial se restringe a ellos, así devuelve k resultados que cumplen.
+    Si el backend no puede restringir la búsqueda se piden más resultados hasta completar k.
+    """
+
+    OVERFETCH = 4
+
+    def __init__(self, backend, embed_fn):
+        self.backend = backend
+        self.embed_fn = embed_fn
+        ids, documents, metadatas = backend.load()
+        self.index = MetadataIndex(ids, documents, metadatas)
+        self.stats = {"searches": 0, "filtered_searches": 0, "overfetch_rounds": 0}
+        self._stats_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def _query(self, query_emb, n_results, candidates=None):
+        self._count("searches")
+        return self.backend.query(query_emb, n_results, candidates)
+
+    def _in_bits(self, doc_id, bits):
+        pos = self.index.position.get(doc_id)
+        return pos is not None and bits >> pos & 1
+
+    def _filtered_search(self, query_emb, top_k, bits):
+        """Los top_k documentos más similares dentro del bitset de candidatos"""
+        count = popcount(bits)
+        if not count:
+            return []
+        if bits == self.index.all_bits:
+            return self._query(query_emb, top_k)
+        self._count("filtered_searches")
+        if self.backend.supports_candidates:
+            candidates = [self.index.ids[pos] for pos in iter_bits(bits)]
+            return self._query(query_emb, min(top_k, count), candidates)
+
+        # Colección antigua: pedir más vecinos hasta reunir top_k que cumplan o recorrerla entera
+        n_results = top_k * self.OVERFETCH
+        while True:
+            n_results = min(n_results, len(self.index))
+            matched = [h for h in self._query(query_emb, n_results) if self._in_bits(h[0], bits)]
+            if len(matched) >= top_k or n_results >= len(self.index):
+                return matched[:top_k]
+            self._count("overfetch_rounds")
+            n_results *= self.OVERFETCH
+
+    def topk_then_filter_count(self, query_text, top_k, filters):
+        """
+        Cuántos resultados daría la búsqueda antigua (top_k sin filtros y después filtrar).
+        Solo para métricas: el embedding sale del cache y la búsqueda es local.
+        """
+        hits = self._query(self.embed_fn(query_text), top_k)
+        bits = self.index.match(filters)
+        return sum(1 for h in hits if self._in_bits(h[0], bits))
+
+    def search_by_vector(self, query_emb, top_k=5, filters=None):
+        """Top-k por similitud entre los documentos que cumplen los filtros (sin ordenar por largo)"""
+        hits = self._filtered_search(query_emb, top_k, self.index.match(filters))
+        return [make_document(d, m) for _, d, m in hits]
+
+    def semantic_query(self, query_text="", top_k=5, filters=None):
+        """
+        Busca recomendaciones por:
+        - query_text: similitud semántica
+        - filters: metadata (dimension, nivel, tags, tema...)
+        """
+        if filters:
+            print(f"[DEBUG] Aplicando filtros: {filters}")
+
+        if not query_text:
+            bits = self.index.match(filters)
+            results = []
+            for pos in iter_bits(bits):
+                results.append(self.index.document(pos))
+                if len(results) >= top_k:
+                    break
+            if filters:
+                print(f"[DEBUG] Total documentos encontrados después de filtros: {popcount(bits)}")
+            return results
+
+        print(f"[DEBUG] Buscando por query: {query_text}")
+        results = self.search_by_vector(self.embed_fn(query_text), top_k, filters)
+        if not filters:
+            return results
+
+        print(f"[DEBUG] Total documentos encontrados después de filtros: {len(results)}")
+        results.sort(key=lambda x: len(x.page_content), reverse=True)
+        return results
@@ -1,73 +1,95 @@
 import os
 import json
 import re
-from dotenv import load_dotenv
-import google.genai as genai
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limit import RateLimiter
+from llm_cache import LLMCache, cached_generate_content
+from dedup import remove_duplicates, dedup_across_files
+from gemini_client import get_client
 
 # VARIABLES GLOBALES
 BASE_DIR = os.path.dirname(__file__)
 IN_DIR = os.path.join(BASE_DIR, "extracted_texts_jsons")
 OUT_DIR = os.path.join(BASE_DIR, "processed_jsons")
+CHECKPOINT_DIR = os.path.join(BASE_DIR, "enrichment_checkpoints")
 
-os.makedirs(OUT_DIR, exist_ok=True)
+# Versiones de las plantillas de prompt: subirlas al modificar la plantilla invalida su cache
+CHUNK_PROMPT_VERSION = "1"
+BATCH_PROMPT_VERSION = "1"
+
+# Se inicializan en setup()
+client = None
+rate_limiter = None
+llm_cache = None
+executor = None
+batch_size = 1
 
 
 # GEMINI AI
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("[GEMINI AI CONFIG] No se encontró GOOGLE_API_KEY en el entorno o .env")
+def setup(workers=8, rpm=60, batch=1, timeout=120, no_llm_cache=False):
+    """Crea el cliente de Gemini, el rate limiter, el cache del LLM y el pool de hilos del enriquecimiento"""
+    global client, rate_limiter, llm_cache, executor, batch_size
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+
+    client = get_client(timeout=timeout)
+    rate_limiter = RateLimiter(rpm)
+    llm_cache = LLMCache(bypass=no_llm_cache or None)
+    llm_cache.invalidate_stale("enrich_chunk", CHUNK_PROMPT_VERSION)
+    llm_cache.invalidate_stale("enrich_batch", BATCH_PROMPT_VERSION)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    batch_size = max(1, batch)
+    print("[GEMINI AI CONFIG] PASS: Gemini configurado correctamente\n")
 
-client = genai.Client(api_key=API_KEY)
-print("[GEMINI AI CONFIG] PASS: Gemini configurado correctamente\n")
+def shutdown():
+    if executor:
+        executor.shutdown()
 
 
 # FUNCIONES AUXILIARES
 def clean_filename(name):
     return "".join(c if c.isalnum() else "_" for c in name)
 
+def json_text_between(text: str, open_char, close_char):
+    """Texto de la respuesta entre el primer open_char y el último close_char (None si no hay)"""
+    clean_text = re.sub(r"^```json|```$", "", text.strip())
+    start = clean_text.find(open_char)
+    end = clean_text.rfind(close_char) + 1
+    if start == -1 or end == 0:
+        return None
+    return clean_text[start:end]
+
 def safe_parse_json(text: str):
     """
     Limpia y parsea el JSON que devuelve Gemini.
     """
     try:
-        clean_text = re.sub(r"^```json|```$", "", text.strip())
-        # Buscar primer '{' y último '}'
-        start = clean_text.find("{")
-        end = clean_text.rfind("}") + 1
-        if start == -1 or end == -1:
+        json_text = json_text_between(text, "{", "}")
+        if json_text is None:
             return {}
-        json_text = clean_text[start:end]
         return json.loads(json_text)
     except Exception as e:
         print(f"[GEMINI AI] ERROR al parsear JSON: {e}")
         return {}
 
-def normalize_text(s: str) -> str:
-    s = re.sub(r"[^a-z0-9áéíóúñ ]", "", s.lower())
-    return s.strip()
-
-def remove_duplicates(chunks):
-    """
-    Elimina chunks con acciones o temas duplicados.
-    Prefiere los más largos/completos.
-    """
-    unique = []
-    seen = set()
+def is_json_object_response(text: str):
+    """Validador del cache del LLM (modo por chunk): la respuesta trae un objeto JSON parseable"""
+    try:
+        return isinstance(json.loads(json_text_between(text, "{", "}") or ""), dict)
+    except ValueError:
+        return False
 
-    for ch in chunks:
-        if not ch.get("recomendacion") or not ch.get("dimension_IMECH"):
-            continue
-        key = normalize_text(ch["recomendacion"])
-        if key not in seen:
-            seen.add(key)
-            unique.append(ch)
-        else:
-            existing = next((u for u in unique if normalize_text(u["recomendacion"]) == key), None)
-            if existing and len(json.dumps(ch)) > len(json.dumps(existing)):
-                unique.remove(existing)
-                unique.append(ch)
-    return unique
+def is_json_array_response(text: str):
+    """Validador del cache del LLM (modo por lotes): la respuesta trae un array JSON con algún chunk_index"""
+    try:
+        items = json.loads(json_text_between(text, "[", "]") or "")
+    except ValueError:
+        return False
+    return isinstance(items, list) and any(isinstance(item, dict) and "chunk_index" in item for item in items)
 
 def is_valid_chunk(ch):
     """
@@ -107,8 +129,7 @@ def flatten_chunks(chunks):
             flat.extend([c for c in ch if isinstance(c, dict)])
     return flat
 
-def enrich_chunk_with_gemini(chunk_text: str, source_file: str):
-    imech_context = """
+IMECH_CONTEXT = """
     MODELO IMECH (Instrumento de Medición de Ciberhigiene)
     -----------------------------------------------------
     El IMECH evalúa prácticas de ciberhigiene en instituciones críticas (como hospitales, puertos, o servicios públicos).
@@ -136,12 +157,8 @@ def enrich_chunk_with_gemini(chunk_text: str, source_file: str):
     -----------------------------------------------------
     """
 
-    prompt = f"""
-    {imech_context}
-
-    Analiza el siguiente texto sobre CIBERHIGIENE institucional y devuelve SOLO un JSON con los siguientes campos:
-
-    {{
+CHUNK_SCHEMA = """
+    {
       "original_text": "",       # Cita textual del fragmento procesado (máx. 300 caracteres)
       "tema": "",                # Tema general (ej. contraseñas seguras, actualización de software, phishing)
       "nivel": "",               # Nivel de conocimiento que requiere el usurio, debe ser uno de: ["básico", "promedio", "elevado", "técnico", "administrador"]
@@ -152,8 +169,22 @@ def enrich_chunk_with_gemini(chunk_text: str, source_file: str):
       "esfuerzo": "",            # Uno de: ["bajo", "medio", "alto"]
       "impacto": "",             # Uno de: ["bajo", "medio", "alto"]
       "tags": []                 # Palabras clave: ["passwords", "MFA", "phishing", "actualizaciones", "backups", "RDP", "BYOD", "EHR", "correo"]
-    }}
+    }
+    """
+
+MAX_CHUNK_CHARS = 2500
 
+
+# Contadores del modo por lotes (se actualizan desde varios hilos)
+batch_stats = {"chunks": 0, "calls": 0, "retries": 0, "prompt_chars": 0, "single_prompt_chars": 0}
+batch_stats_lock = threading.Lock()
+
+def build_chunk_prompt(chunk_text: str):
+    return f"""
+    {IMECH_CONTEXT}
+
+    Analiza el siguiente texto sobre CIBERHIGIENE institucional y devuelve SOLO un JSON con los siguientes campos:
+    {CHUNK_SCHEMA}
     Reglas:
     - Usa SOLO las categorías válidas anteriores.
     - Si el texto no se relaciona con ciberhigiene o ninguna dimensión IMECH, devuelve un JSON vacío ({{}}).
@@ -161,44 +192,228 @@ def enrich_chunk_with_gemini(chunk_text: str, source_file: str):
     - No repitas el texto original completo: resume la cita en "original_text" (300 caracteres máx).
 
     Texto a analizar:
-    {chunk_text[:2500]}
+    {chunk_text[:MAX_CHUNK_CHARS]}
+    """
+
+def build_batch_prompt(indexed_chunks):
+    """indexed_chunks: lista de (índice, texto)"""
+    fragments = "\n".join(
+        f"\n    ### Fragmento {i}\n    {text[:MAX_CHUNK_CHARS]}\n" for i, text in indexed_chunks
+    )
+    return f"""
+    {IMECH_CONTEXT}
+
+    Analiza CADA UNO de los siguientes fragmentos sobre CIBERHIGIENE institucional y devuelve SOLO un JSON array,
+    con un objeto por fragmento. Cada objeto debe tener el campo "chunk_index" con el número del fragmento
+    y además los siguientes campos:
+    {CHUNK_SCHEMA}
+    Reglas:
+    - Usa SOLO las categorías válidas anteriores.
+    - Devuelve exactamente un objeto por fragmento, en cualquier orden, identificado por "chunk_index".
+    - Si un fragmento no se relaciona con ciberhigiene o ninguna dimensión IMECH, devuelve solo {{"chunk_index": N}}.
+    - La acción recomendada debe ser práctica, clara y aplicable (no técnica).
+    - No repitas el texto original completo: resume la cita en "original_text" (300 caracteres máx).
+
+    Fragmentos a analizar:
+    {fragments}
+    """
+
+def safe_parse_json_array(text: str):
+    """
+    Parsea el JSON array del modo por lotes. Devuelve {chunk_index: objeto} solo con las entradas válidas.
     """
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=[prompt]
-        )
-        text = response.text.strip()
-        enriched = safe_parse_json(text)
-        return enriched if enriched else {}
+        json_text = json_text_between(text, "[", "]")
+        if json_text is None:
+            return {}
+        items = json.loads(json_text)
     except Exception as e:
-        print(f"[GEMINI AI] ERROR enriqueciendo chunk de {source_file}: {e}")
+        print(f"[GEMINI AI] ERROR al parsear JSON array: {e}")
         return {}
 
+    parsed = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.pop("chunk_index"))
+        except (KeyError, TypeError, ValueError):
+            continue
+        parsed[idx] = item
+    return parsed
 
+def enrich_chunk_with_gemini(chunk_text: str, source_file: str):
+    prompt = build_chunk_prompt(chunk_text)
+    try:
+        text = cached_generate_content(
+            client, prompt, "enrich_chunk", CHUNK_PROMPT_VERSION,
+            cache=llm_cache, before_call=rate_limiter.wait, validate=is_json_object_response
+        ).strip()
+        if not is_json_object_response(text):
+            # Respuesta malformada: None para no guardarla en el checkpoint y reintentarla
+            print(f"[GEMINI AI] ERROR respuesta sin JSON válido para un chunk de {source_file}")
+            return None
+        return safe_parse_json(text)
+    except Exception as e:
+        # None indica fallo de la petición o respuesta inválida, {} que el texto no aplica
+        print(f"[GEMINI AI] ERROR enriqueciendo chunk de {source_file}: {e}")
+        return None
 
-# PROCESAR JSONS
-json_files = [f for f in os.listdir(IN_DIR) if f.lower().endswith(".json")]
-print(f"[SETUP] Archivos JSON detectados para enriquecimiento:\n{json_files}\n")
+def enrich_batch_with_gemini(indexed_chunks, source_file: str):
+    """
+    Enriquece varios chunks con una sola petición. Los chunks que falten o vengan
+    malformados en la respuesta se reintentan uno a uno con enrich_chunk_with_gemini.
+    Devuelve {índice: resultado}.
+    """
+    prompt = build_batch_prompt(indexed_chunks)
+    parsed = {}
+    try:
+        text = cached_generate_content(
+            client, prompt, "enrich_batch", BATCH_PROMPT_VERSION,
+            cache=llm_cache, before_call=rate_limiter.wait, validate=is_json_array_response
+        )
+        parsed = safe_parse_json_array(text)
+    except Exception as e:
+        print(f"[GEMINI AI] ERROR enriqueciendo lote de {source_file}: {e}")
+
+    results = {}
+    retries = 0
+    for i, chunk_text in indexed_chunks:
+        if i in parsed and isinstance(parsed[i], dict):
+            results[i] = parsed[i]
+        else:
+            retries += 1
+            results[i] = enrich_chunk_with_gemini(chunk_text, source_file)
+
+    with batch_stats_lock:
+        batch_stats["chunks"] += len(indexed_chunks)
+        batch_stats["calls"] += 1 + retries
+        batch_stats["retries"] += retries
+        batch_stats["prompt_chars"] += len(prompt) + sum(
+            len(build_chunk_prompt(t)) for i, t in indexed_chunks if i not in parsed
+        )
+        batch_stats["single_prompt_chars"] += sum(len(build_chunk_prompt(t)) for _, t in indexed_chunks)
+    if retries:
+        print(f"[GEMINI AI] Lote de {source_file}: {retries}/{len(indexed_chunks)} chunks reintentados por separado")
+    return results
 
-for file in json_files:
-    path = os.path.join(IN_DIR, file)
-    print(f"\n[PROCESS] Procesando: {file}\n")
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+def enrich_single_chunk(indexed_chunk, source_file: str):
+    i, chunk_text = indexed_chunk
+    return {i: enrich_chunk_with_gemini(chunk_text, source_file)}
 
+def enrich_chunks(indexed_chunks, source_file, on_result=None):
+    """
+    Enriquece chunks (lista de (índice, texto)) en paralelo (pool de setup(), limitado a rpm).
+    Con --batch-size N > 1 cada petición lleva N chunks.
+    on_result(índice, resultado) se llama apenas termina cada chunk, en el hilo principal.
+    Devuelve {índice: resultado}; un fallo solo afecta a su chunk o lote.
+    """
+    results = {}
+    size = batch_size
+    futures = {}
+    for b in range(0, len(indexed_chunks), size):
+        group = indexed_chunks[b:b+size]
+        if size == 1:
+            future = executor.submit(enrich_single_chunk, group[0], source_file)
+        else:
+            future = executor.submit(enrich_batch_with_gemini, group, source_file)
+        futures[future] = [i for i, _ in group]
+
+    done = 0
+    for future in as_completed(futures):
+        indices = futures[future]
+        try:
+            for i, result in future.result().items():
+                results[i] = result
+                if on_result:
+                    on_result(i, result)
+        except Exception as e:
+            print(f"[GEMINI AI] ERROR inesperado en chunks {indices[0]+1}-{indices[-1]+1} de {source_file}: {e}")
+        done += len(indices)
+        print(f" - Enriquecidos chunks {indices[0]+1}-{indices[-1]+1} ({done}/{len(indexed_chunks)}) de {source_file}")
+    return results
+
+
+# CHECKPOINTS
+def chunk_hash(chunk_text: str):
+    return hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()[:16]
+
+def checkpoint_path_for(file):
+    return os.path.join(CHECKPOINT_DIR, f"{clean_filename(file)}.jsonl")
+
+def load_checkpoint(path):
+    """
+    Lee el checkpoint JSONL de un documento. Devuelve {(chunk_index, chunk_hash): resultado}.
+    Una última línea cortada por una caída del proceso se ignora y se quita del archivo (si quedó completa
+    pero sin salto de línea, se le agrega), para que el siguiente registro empiece en una línea nueva.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        offset = 0
+        for line in f:
+            try:
+                rec = json.loads(line)
+                done[(rec["chunk_index"], rec["chunk_hash"])] = rec["result"]
+                complete = True
+            except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                complete = False
+            if not line.endswith(b"\n"):
+                if complete:
+                    f.write(b"\n")
+                else:
+                    f.truncate(offset)
+            offset += len(line)
+    return done
+
+def enrich_document(file, chunks):
+    """Enriquece solo los chunks sin checkpoint y añade cada resultado al JSONL apenas termina"""
+    ckpt_path = checkpoint_path_for(file)
+    done = load_checkpoint(ckpt_path)
+    hashes = [chunk_hash(c) for c in chunks]
+    pending = [(i, c) for i, c in enumerate(chunks) if (i, hashes[i]) not in done]
+    if len(pending) < len(chunks):
+        print(f"[CHECKPOINT] {len(chunks) - len(pending)}/{len(chunks)} chunks de {file} ya enriquecidos, se reanuda")
+    if not pending:
+        return
+
+    with open(ckpt_path, "a", encoding="utf-8") as ckpt:
+        def write_checkpoint(i, result):
+            # Los fallos (None) no se guardan para reintentarlos en la próxima ejecución
+            if result is None:
+                return
+            rec = {"source": file, "chunk_index": i, "chunk_hash": hashes[i], "result": result}
+            ckpt.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            ckpt.flush()
+
+        results = enrich_chunks(pending, file, on_result=write_checkpoint)
+
+    failed = sum(1 for i, _ in pending if results.get(i) is None)
+    if failed:
+        print(f"[GEMINI AI] {failed}/{len(chunks)} chunks de {file} fallaron, se reintentarán en la próxima ejecución")
+
+def finalize_document(file, data, near_threshold=None):
+    """
+    Arma el JSON final del documento desde su checkpoint: orden de chunks, aplanado y deduplicado.
+    Devuelve el contenido escrito.
+    """
     chunks = data.get("texto", [])
+    done = load_checkpoint(checkpoint_path_for(file))
     enriched_chunks = []
-
-    for i, chunk in enumerate(chunks):
-        print(f" - Enriqueciendo chunk {i+1}/{len(chunks)} de {file}")
-        enriched = enrich_chunk_with_gemini(chunk, file)
-        if enriched:
-            enriched_chunks.append(enriched)
+    missing = 0
+    for i, c in enumerate(chunks):
+        key = (i, chunk_hash(c))
+        if key not in done:
+            missing += 1
+        elif done[key]:
+            enriched_chunks.append(done[key])
+    if missing:
+        print(f"[FINALIZE] {file}: {missing} chunks sin enriquecer, el JSON queda parcial")
 
     # Filtrar duplicados y vacíos
     enriched_chunks = flatten_chunks(enriched_chunks)
-    enriched_chunks = remove_duplicates(enriched_chunks)
+    enriched_chunks = remove_duplicates(enriched_chunks, near_threshold=near_threshold)
 
     output_data = {
         "fuente": file,
@@ -211,4 +426,59 @@ for file in json_files:
     with open(out_path, "w", encoding="utf-8") as f_out:
         json.dump(output_data, f_out, ensure_ascii=False, indent=2)
 
-    print(f"[OUTPUT] Enriquecimiento guardado en: {out_path}\n")
\ No newline at end of file
+    print(f"[OUTPUT] Enriquecimiento guardado en: {out_path}\n")
+    return output_data
+
+def print_batch_stats():
+    if not batch_stats["chunks"]:
+        return
+    calls_saved = batch_stats["chunks"] - batch_stats["calls"]
+    # Estimación de ~4 caracteres por token
+    tokens_saved = (batch_stats["single_prompt_chars"] - batch_stats["prompt_chars"]) // 4
+    print(f"[BATCH] Chunks: {batch_stats['chunks']}, peticiones: {batch_stats['calls']} "
+          f"(reintentos individuales: {batch_stats['retries']})")
+    print(f"[BATCH] Peticiones ahorradas: {calls_saved}, tokens de prompt ahorrados (aprox.): {tokens_saved}")
+
+
+# PROCESAR JSONS
+def main():
+    parser = argparse.ArgumentParser(description="Enriquecimiento semántico de chunks con Gemini")
+    parser.add_argument("--workers", type=int, default=8, help="Peticiones simultáneas a Gemini")
+    parser.add_argument("--rpm", type=float, default=60, help="Máximo de peticiones por minuto (0 = sin límite)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Chunks por petición (1 = un chunk por petición)")
+    parser.add_argument("--finalize-only", action="store_true", help="No llama a Gemini: solo arma los JSON finales desde los checkpoints")
+    parser.add_argument("--near-dup-threshold", type=float, default=None,
+                        help="Umbral de Jaccard (0-1) para eliminar recomendaciones casi duplicadas (por defecto solo exactas)")
+    parser.add_argument("--global-dedup", action="store_true", help="Deduplica también entre todos los JSON de processed_jsons")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Ignora las respuestas guardadas en el cache del LLM")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout por petición a Gemini, en segundos")
+    args = parser.parse_args()
+
+    setup(workers=args.workers, rpm=args.rpm, batch=args.batch_size, timeout=args.timeout,
+          no_llm_cache=args.no_llm_cache)
+
+    json_files = [f for f in os.listdir(IN_DIR) if f.lower().endswith(".json")]
+    print(f"[SETUP] Archivos JSON detectados para enriquecimiento:\n{json_files}\n")
+
+    for file in json_files:
+        path = os.path.join(IN_DIR, file)
+        print(f"\n[PROCESS] Procesando: {file}\n")
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if not args.finalize_only:
+            enrich_document(file, data.get("texto", []))
+        finalize_document(file, data, near_threshold=args.near_dup_threshold)
+
+    shutdown()
+
+    if args.global_dedup:
+        removed = dedup_across_files(OUT_DIR, near_threshold=args.near_dup_threshold)
+        print(f"[DEDUP] Chunks duplicados entre documentos eliminados: {removed}")
+
+    print_batch_stats()
+    llm_cache.print_stats()
+
+
+if __name__ == "__main__":
+    main()
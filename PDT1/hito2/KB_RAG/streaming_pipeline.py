@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import ingest
+import semantic_enrichment
+import vector_store
+from embedding_cache import EMBED_BATCH_SIZE
+
+# Pipeline en streaming: ingesta -> enriquecimiento -> embeddings.
+# Las etapas corren en hilos distintos unidas por colas acotadas: si una etapa se atrasa,
+# la anterior se bloquea al llenar su cola (backpressure) en vez de acumular todo en memoria.
+# Cada documento llega al vector store apenas termina su enriquecimiento.
+
+# Marca de fin de cola
+DONE = None
+
+
+# ESTADO COMPARTIDO
+class PipelineStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.first_vector = None
+        self.first_new_doc = None   # Primer documento nuevo encolado
+        self.docs_ingested = 0
+        self.docs_enriched = 0
+        self.chunks_upserted = 0
+        self.failed = []
+
+    def fail(self, stage, name, error):
+        print(f"[ERROR] [{stage}] {name}: {error}")
+        with self.lock:
+            self.failed.append(f"{stage}:{name}")
+
+    def add(self, field, n=1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def mark_once(self, field):
+        """Guarda en field los segundos desde el inicio, solo la primera vez"""
+        with self.lock:
+            if getattr(self, field) is None:
+                setattr(self, field, time.perf_counter() - self.start)
+
+
+# ETAPA 1: INGESTA
+def ingest_stage(args, doc_queue, stats):
+    """Parsea los documentos nuevos o modificados y encola (nombre del JSON, contenido) por documento"""
+    try:
+        sources = ingest.list_sources()
+        old_manifest, manifest, pending, skipped = ingest.plan_ingest(sources, force=args.force)
+
+        # Los documentos sin cambios se encolan desde su JSON ya extraído: sus chunks enriquecidos
+        # salen del checkpoint y sus embeddings del cache, así la KB queda completa sin costo extra
+        for key in skipped:
+            output = manifest[key].get("output")
+            with open(os.path.join(ingest.OUT_DIR, output), "r", encoding="utf-8") as f:
+                doc_queue.put((output, json.load(f)))
+            stats.add("docs_ingested")
+
+        # iter_parsed_documents entrega cada documento apenas está listo (con una ventana acotada en curso),
+        # así el enriquecimiento empieza mientras se siguen parseando los demás
+        for key, file, entry, doc, error in ingest.iter_parsed_documents(pending, args.workers, args.gemini_workers):
+            if error is not None:
+                stats.fail("INGESTA", key, error)
+                continue
+            output = ingest.save_parsed_document(key, file, entry, doc, manifest, old_manifest)
+            doc_queue.put((output, {"texto": doc["chunks"], "metadata": doc["metadata"]}))
+            stats.mark_once("first_new_doc")
+            stats.add("docs_ingested")
+
+        ingest.remove_deleted_outputs(sources, old_manifest)
+        ingest.save_manifest(manifest)
+    except Exception as e:
+        stats.fail("INGESTA", "pipeline", e)
+    finally:
+        doc_queue.put(DONE)
+
+
+# ETAPA 2: ENRIQUECIMIENTO
+def enrich_stage(args, doc_queue, chunk_queue, stats):
+    """Enriquece documento a documento y encola sus chunks deduplicados como Documents de LangChain"""
+    try:
+        while True:
+            item = doc_queue.get()
+            if item is DONE:
+                break
+            file, data = item
+            print(f"\n[PROCESS] Procesando: {file}\n")
+            try:
+                semantic_enrichment.enrich_document(file, data.get("texto", []))
+                output_data = semantic_enrichment.finalize_document(file, data, near_threshold=args.near_dup_threshold)
+            except Exception as e:
+                stats.fail("ENRIQUECIMIENTO", file, e)
+                continue
+            for doc in vector_store.docs_from_processed(output_data):
+                chunk_queue.put(doc)
+            stats.add("docs_enriched")
+    except Exception as e:
+        stats.fail("ENRIQUECIMIENTO", "pipeline", e)
+    finally:
+        chunk_queue.put(DONE)
+
+
+# ETAPA 3: EMBEDDINGS
+def embed_stage(args, chunk_queue, stats):
+    """
+    Junta chunks en lotes de EMBED_BATCH_SIZE y los inserta en Chroma.
+    Si no llega nada en flush_seconds se inserta el lote parcial, para no esperar al siguiente documento.
+    """
+    store = vector_store.open_vector_store()
+    batch = {}
+    finished = False
+
+    def flush():
+        if not batch:
+            return
+        try:
+            vector_store.upsert_documents(store, list(batch.keys()), list(batch.values()))
+        except Exception as e:
+            stats.fail("EMBEDDINGS", f"lote de {len(batch)} chunks", e)
+            batch.clear()
+            return
+        with stats.lock:
+            if stats.first_vector is None:
+                stats.first_vector = time.perf_counter() - stats.start
+                print(f"[EMBEDDINGS] Primeros vectores en el store a los {stats.first_vector:.1f}s")
+            stats.chunks_upserted += len(batch)
+            elapsed = time.perf_counter() - stats.start
+            print(f"[EMBEDDINGS] {stats.chunks_upserted} chunks insertados ({stats.chunks_upserted / elapsed:.1f} chunks/s)")
+        batch.clear()
+
+    while not finished:
+        try:
+            doc = chunk_queue.get(timeout=args.flush_seconds)
+        except queue.Empty:
+            flush()
+            continue
+        if doc is DONE:
+            finished = True
+        else:
+            # Chroma exige IDs únicos por lote; el mismo chunk en dos documentos se inserta una vez
+            batch.setdefault(vector_store.make_doc_id(doc.metadata), doc)
+        if finished or len(batch) >= EMBED_BATCH_SIZE:
+            flush()
+
+
+# MAIN
+def main():
+    parser = argparse.ArgumentParser(description="Construye la KB en streaming: ingesta, enriquecimiento y embeddings en paralelo")
+    parser.add_argument("--force", action="store_true", help="Reprocesa todos los documentos ignorando el manifest")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos para parsear documentos en paralelo")
+    parser.add_argument("--gemini-workers", type=int, default=4, help="Consultas simultáneas a Gemini para metadata")
+    parser.add_argument("--enrich-workers", type=int, default=8, help="Peticiones simultáneas a Gemini en el enriquecimiento")
+    parser.add_argument("--rpm", type=float, default=60, help="Máximo de peticiones por minuto del enriquecimiento (0 = sin límite)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Chunks por petición de enriquecimiento")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout por petición a Gemini, en segundos")
+    parser.add_argument("--near-dup-threshold", type=float, default=None,
+                        help="Umbral de Jaccard (0-1) para eliminar recomendaciones casi duplicadas (por defecto solo exactas)")
+    parser.add_argument("--doc-queue", type=int, default=2, help="Documentos extraídos en espera de enriquecimiento")
+    parser.add_argument("--chunk-queue", type=int, default=4 * EMBED_BATCH_SIZE, help="Chunks enriquecidos en espera de embedding")
+    parser.add_argument("--flush-seconds", type=float, default=5, help="Segundos sin chunks nuevos antes de insertar un lote parcial")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Ignora las respuestas guardadas en el cache del LLM")
+    args = parser.parse_args()
+
+    print()
+    ingest.setup(no_llm_cache=args.no_llm_cache)
+    semantic_enrichment.setup(workers=args.enrich_workers, rpm=args.rpm, batch=args.batch_size,
+                              timeout=args.timeout, no_llm_cache=args.no_llm_cache)
+    vector_store.setup()
+
+    doc_queue = queue.Queue(maxsize=max(1, args.doc_queue))
+    chunk_queue = queue.Queue(maxsize=max(1, args.chunk_queue))
+    stats = PipelineStats()
+
+    stages = [
+        threading.Thread(target=ingest_stage, args=(args, doc_queue, stats), name="ingesta"),
+        threading.Thread(target=enrich_stage, args=(args, doc_queue, chunk_queue, stats), name="enriquecimiento"),
+        threading.Thread(target=embed_stage, args=(args, chunk_queue, stats), name="embeddings"),
+    ]
+    for t in stages:
+        t.start()
+    for t in stages:
+        t.join()
+
+    semantic_enrichment.shutdown()
+    elapsed = time.perf_counter() - stats.start
+
+    print("\n[RESUMEN PIPELINE]")
+    print(f" - Documentos ingeridos: {stats.docs_ingested}")
+    print(f" - Documentos enriquecidos: {stats.docs_enriched}")
+    print(f" - Chunks insertados: {stats.chunks_upserted}")
+    if stats.first_vector is not None:
+        print(f" - Primeros vectores a los {stats.first_vector:.1f}s, total {elapsed:.1f}s")
+    if stats.first_new_doc is not None:
+        print(f" - Primer documento nuevo encolado a los {stats.first_new_doc:.1f}s")
+    if stats.failed:
+        print(f" - Con error: {len(stats.failed)} {stats.failed}")
+    semantic_enrichment.print_batch_stats()
+    ingest.llm_cache.print_stats("LLM CACHE INGESTA")
+    semantic_enrichment.llm_cache.print_stats("LLM CACHE ENRIQUECIMIENTO")
+    vector_store.embedding_cache.print_stats()
+    print("\n[VECTOR STORE] Guardado en:", vector_store.VECTOR_DB_DIR)
+
+    if stats.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
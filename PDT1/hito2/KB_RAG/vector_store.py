@@ -2,43 +2,43 @@ import os
 import json
 import uuid
 import time
-from dotenv import load_dotenv
-import google.genai as genai
-from langchain_chroma import Chroma
-from langchain.docstore.document import Document
+import argparse
+from embedding_cache import EmbeddingCache, EMBED_BATCH_SIZE, get_gemini_embeddings as cached_embeddings
+from retriever import structured_metadata, make_document
+from gemini_client import get_client
 
 # VARIABLES GLOBALES
 BASE_DIR = os.path.dirname(__file__)
 PROCESSED_DIR = os.path.join(BASE_DIR, "processed_jsons")
 VECTOR_DB_DIR = os.path.join(BASE_DIR, "vectorstore_chroma")
 
-os.makedirs(VECTOR_DB_DIR, exist_ok=True)
+# Se inicializan en setup()
+client = None
+embedding_cache = None
 
 
 # GEMINI SETUP
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("No se encontró GOOGLE_API_KEY en el entorno o .env")
-client = genai.Client(api_key=API_KEY)
+def setup():
+    """Crea el cliente de Gemini y abre el cache de embeddings"""
+    global client, embedding_cache
+    os.makedirs(VECTOR_DB_DIR, exist_ok=True)
+    client = get_client()
+    embedding_cache = EmbeddingCache()
 
 
 # FUNCIONES AUXILIARES
-def get_gemini_embedding(text: str, retries=5, delay=5):
-    """Obtiene embedding de Gemini para un texto con reintentos"""
-    for attempt in range(retries):
-        try:
-            resp = client.models.embed_content(
-                model="gemini-embedding-001",
-                contents=text
-            )
-            return resp.embeddings[0].values
-        except Exception as e:
-            print(f"[ERROR] Intento {attempt+1}/{retries} fallido: {e}")
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
-                raise
+def get_gemini_embeddings(texts):
+    """Obtiene embeddings de Gemini para una lista de textos, usando el cache en disco"""
+    return cached_embeddings(client, texts, cache=embedding_cache)
+
+def get_gemini_embedding(text: str):
+    """Obtiene embedding de Gemini para un texto"""
+    return get_gemini_embeddings([text])[0]
+
+def make_doc_id(metadata: dict):
+    """ID determinista por chunk, así reconstruir la KB actualiza en vez de duplicar"""
+    key = "|".join(str(metadata.get(k, "")) for k in ("fuente", "recomendacion", "original_text"))
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
 
 def clean_filename(name):
     return "".join(c if c.isalnum() else "_" for c in name)
@@ -56,14 +56,17 @@ def clean_metadata(meta: dict):
 
 
 # CARGAR CHUNKS ENRIQUECIDOS
-docs = []
-
-json_files = [f for f in os.listdir(PROCESSED_DIR) if f.endswith(".json")]
-for file in json_files:
-    path = os.path.join(PROCESSED_DIR, file)
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
+def chunk_fields(chunk):
+    return {
+        "tags": chunk.get("tags", []),
+        "tema": chunk.get("tema", []),
+        "nivel": chunk.get("nivel", ""),
+        "dimension": chunk.get("dimension_IMECH", "")
+    }
+
+def docs_from_processed(data):
+    """Convierte el JSON de un documento enriquecido en Documents listos para indexar"""
+    docs = []
     for chunk in data.get("chunks_enriquecidos", []):
         if not isinstance(chunk, dict):
             continue
@@ -89,41 +92,97 @@ for file in json_files:
             "tipo_documento": data.get("metadata_original", {}).get("tipo", ""),
             "fecha": data.get("metadata_original", {}).get("fecha", "")
         })
-
-        docs.append(Document(page_content=text, metadata=metadata))
-
-print(f"[SETUP] Total chunks válidos: {len(docs)}\n")
-
-
-# GENERAR EMBEDDINGS POR LOTES
-#docs = docs[:100]
-#print(f"[DEBUG] Solo se procesarán {len(docs)} chunks para testeo\n")
-
-texts = [d.page_content for d in docs]
-metadatas_list = [d.metadata for d in docs]
-
-embeddings = []
-batch_size = 50  # procesar en batches para no saturar
-for i in range(0, len(docs), batch_size):
-    batch_docs = docs[i:i+batch_size]
-    batch_emb = [get_gemini_embedding(d.page_content) for d in batch_docs]
-    embeddings.extend(batch_emb)
-    print(f"[EMBEDDINGS] Procesados {i+len(batch_docs)}/{len(docs)} chunks")
+        # tags, tema, nivel y dimension normalizados para el índice de metadata del retriever
+        metadata.update(structured_metadata(chunk_fields(chunk)))
+
+        docs.append(make_document(text, metadata))
+    return docs
+
+def load_processed_docs():
+    docs = []
+    json_files = [f for f in os.listdir(PROCESSED_DIR) if f.endswith(".json")]
+    for file in json_files:
+        path = os.path.join(PROCESSED_DIR, file)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        docs.extend(docs_from_processed(data))
+    return docs
+
+def unique_docs_by_id(docs):
+    """Un mismo chunk puede repetirse entre documentos, Chroma exige IDs únicos por lote"""
+    unique_docs = {}
+    for d in docs:
+        unique_docs.setdefault(make_doc_id(d.metadata), d)
+    return list(unique_docs.keys()), list(unique_docs.values())
 
 
 # VECTOR STORE (Chroma)
 class GeminiEmbeddings:
     def embed_documents(self, texts):
-        return [get_gemini_embedding(t) for t in texts]
+        return get_gemini_embeddings(texts)
 
     def embed_query(self, text):
         return get_gemini_embedding(text)
 
-vector_store = Chroma(
-    embedding_function=GeminiEmbeddings(),
-    collection_name="kb_rag",
-    persist_directory=VECTOR_DB_DIR
-)
+def open_vector_store():
+    from langchain_chroma import Chroma
+    return Chroma(
+        embedding_function=GeminiEmbeddings(),
+        collection_name="kb_rag",
+        persist_directory=VECTOR_DB_DIR
+    )
+
+def upsert_documents(vector_store, ids, docs):
+    """
+    Embebe un lote (hasta EMBED_BATCH_SIZE docs, una sola petición) e inserta los vectores directamente,
+    sin que Chroma vuelva a llamar a embed_documents
+    """
+    embeddings = get_gemini_embeddings([d.page_content for d in docs])
+    vector_store._collection.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        # doc_id en la metadata permite restringir la búsqueda a los candidatos del filtro (where doc_id $in)
+        metadatas=[{**d.metadata, "doc_id": doc_id} for doc_id, d in zip(ids, docs)],
+        documents=[d.page_content for d in docs]
+    )
+
 
-vector_store.add_documents(docs)
-print("\n[VECTOR STORE] Guardado en:", VECTOR_DB_DIR)
\ No newline at end of file
+# GENERAR EMBEDDINGS POR LOTES
+def main():
+    parser = argparse.ArgumentParser(description="Genera los embeddings de los chunks enriquecidos y los guarda en Chroma")
+    parser.add_argument("--numpy-index", choices=["float32", "float16", "int8"], default=None,
+                        help="Exporta además la KB al índice NumPy (mmap) con ese tipo de dato")
+    args = parser.parse_args()
+
+    setup()
+    docs = load_processed_docs()
+    print(f"[SETUP] Total chunks válidos: {len(docs)}\n")
+
+    #docs = docs[:100]
+    #print(f"[DEBUG] Solo se procesarán {len(docs)} chunks para testeo\n")
+
+    vector_store = open_vector_store()
+    ids, docs = unique_docs_by_id(docs)
+
+    start = time.perf_counter()
+    for i in range(0, len(docs), EMBED_BATCH_SIZE):
+        batch_ids = ids[i:i+EMBED_BATCH_SIZE]
+        batch_docs = docs[i:i+EMBED_BATCH_SIZE]
+        upsert_documents(vector_store, batch_ids, batch_docs)
+        elapsed = time.perf_counter() - start
+        done = i + len(batch_docs)
+        print(f"[EMBEDDINGS] Procesados {done}/{len(docs)} chunks ({done / elapsed:.1f} chunks/s)")
+
+    elapsed = time.perf_counter() - start
+    if docs:
+        print(f"\n[EMBEDDINGS] {len(docs)} chunks en {elapsed:.1f}s ({len(docs) / elapsed:.1f} chunks/s)")
+    embedding_cache.print_stats()
+    print("\n[VECTOR STORE] Guardado en:", VECTOR_DB_DIR)
+
+    if args.numpy_index:
+        from numpy_index import export_from_chroma
+        export_from_chroma(vector_store, dtype=args.numpy_index)
+
+
+if __name__ == "__main__":
+    main()
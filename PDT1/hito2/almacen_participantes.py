@@ -0,0 +1,262 @@
+import os
+import json
+import shutil
+from abc import ABC, abstractmethod
+
+# Salida y lectura de resultados por participante (análisis o recomendaciones) en distintos formatos.
+# Los sinks juntan los registros en memoria y los escriben de a lotes; los lectores los entregan de a uno,
+# así ningún paso necesita cargar el archivo completo.
+# Los sinks escriben en <ruta>.tmp y reemplazan la salida anterior solo al cerrarse sin errores: si el proceso
+# falla a la mitad queda la salida anterior completa en vez de una parcial.
+# - json: lista indentada en <nombre>.json (el formato antiguo)
+# - jsonl: un registro por línea en <nombre>.jsonl
+# - parquet: <nombre>.parquet con el número de participante y el registro como JSON, un row group por lote
+# - shards: <nombre>_shards/part-00000.jsonl, ... con a lo más shard_size registros cada uno
+
+NOMBRE = "resumen_participantes"
+FORMATOS = ("json", "jsonl", "parquet", "shards")
+DEFAULT_FORMATO = "jsonl"
+DEFAULT_BUFFER = 1000
+DEFAULT_SHARD_SIZE = 10000
+
+
+def ruta_salida(directorio, formato, nombre=NOMBRE):
+    if formato == "shards":
+        return os.path.join(directorio, f"{nombre}_shards")
+    return os.path.join(directorio, f"{nombre}.{formato}")
+
+def detectar_formato(directorio, nombre=NOMBRE):
+    """Formato de la salida escrita más recientemente en el directorio (o None si no hay ninguna)"""
+    existentes = [f for f in FORMATOS if os.path.exists(ruta_salida(directorio, f, nombre))]
+    if not existentes:
+        return None
+    return max(existentes, key=lambda f: os.path.getmtime(ruta_salida(directorio, f, nombre)))
+
+def eliminar(path):
+    """Borra un archivo o un directorio (shards) si existe"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# SINKS
+class SinkParticipantes(ABC):
+    """
+    Base de los sinks: escribir() junta registros y cada 'buffer' registros se escriben en bloque (en self.tmp).
+    cerrar() publica el resultado en self.path; abortar() descarta lo escrito y deja la salida anterior.
+    """
+
+    def __init__(self, path, buffer=DEFAULT_BUFFER):
+        self.path = path
+        self.tmp = f"{path}.tmp"
+        self.buffer = buffer
+        self.total = 0
+        self._pendientes = []
+        eliminar(self.tmp)  # Restos de una ejecución que se cortó
+
+    def escribir(self, registro):
+        self._pendientes.append(registro)
+        self.total += 1
+        if len(self._pendientes) >= self.buffer:
+            self.volcar()
+
+    def volcar(self):
+        if self._pendientes:
+            self._escribir_lote(self._pendientes)
+            self._pendientes = []
+
+    def cerrar(self):
+        self.volcar()
+        self._cerrar_archivo()
+        eliminar(self.path)
+        os.replace(self.tmp, self.path)
+
+    def abortar(self):
+        self._pendientes = []
+        self._cerrar_archivo()
+        eliminar(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.cerrar()
+        else:
+            self.abortar()
+
+    @abstractmethod
+    def _escribir_lote(self, registros):
+        """Escribe un lote de registros en self.tmp"""
+
+    @abstractmethod
+    def _cerrar_archivo(self):
+        """Cierra lo que el sink tenga abierto sobre self.tmp (se llama al cerrar y al abortar)"""
+
+
+class SinkJSON(SinkParticipantes):
+    """Lista JSON con el mismo formato que json.dump(lista, indent=2), escrita por partes"""
+
+    def __init__(self, path, buffer=DEFAULT_BUFFER):
+        super().__init__(path, buffer)
+        self._f = open(self.tmp, "w", encoding="utf-8")
+        self._escritos = 0
+
+    def _escribir_lote(self, registros):
+        partes = []
+        for registro in registros:
+            texto = json.dumps(registro, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+            partes.append(("[\n  " if self._escritos == 0 else ",\n  ") + texto)
+            self._escritos += 1
+        self._f.write("".join(partes))
+
+    def cerrar(self):
+        self.volcar()
+        self._f.write("\n]" if self._escritos else "[]")
+        super().cerrar()
+
+    def _cerrar_archivo(self):
+        self._f.close()
+
+
+class SinkJSONL(SinkParticipantes):
+
+    def __init__(self, path, buffer=DEFAULT_BUFFER):
+        super().__init__(path, buffer)
+        self._f = open(self.tmp, "w", encoding="utf-8")
+
+    def _escribir_lote(self, registros):
+        self._f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in registros))
+
+    def _cerrar_archivo(self):
+        self._f.close()
+
+
+class SinkShards(SinkParticipantes):
+    """JSONL repartido en varios archivos, para procesarlos en paralelo o copiarlos por partes"""
+
+    def __init__(self, path, buffer=DEFAULT_BUFFER, shard_size=DEFAULT_SHARD_SIZE):
+        super().__init__(path, min(buffer, shard_size))
+        self.shard_size = shard_size
+        os.makedirs(self.tmp)
+        self._escritos = 0
+
+    def _escribir_lote(self, registros):
+        while registros:
+            shard, ocupados = divmod(self._escritos, self.shard_size)
+            parte, registros = registros[:self.shard_size - ocupados], registros[self.shard_size - ocupados:]
+            with open(os.path.join(self.tmp, f"part-{shard:05d}.jsonl"), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in parte))
+            self._escritos += len(parte)
+
+    def _cerrar_archivo(self):
+        pass  # Cada lote abre y cierra su shard
+
+
+class SinkParquet(SinkParticipantes):
+    """Parquet con columnas Participante y registro (JSON); cada lote es un row group"""
+
+    def __init__(self, path, buffer=DEFAULT_BUFFER):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(path, buffer)
+        self._pa = pa
+        self._schema = pa.schema([("Participante", pa.string()), ("registro", pa.string())])
+        self._writer = pq.ParquetWriter(self.tmp, self._schema)
+
+    def _escribir_lote(self, registros):
+        tabla = self._pa.table({
+            "Participante": [str(r.get("Participante")) for r in registros],
+            "registro": [json.dumps(r, ensure_ascii=False) for r in registros]
+        }, schema=self._schema)
+        self._writer.write_table(tabla)
+
+    def _cerrar_archivo(self):
+        self._writer.close()
+
+
+def abrir_sink(directorio, formato=DEFAULT_FORMATO, nombre=NOMBRE, buffer=DEFAULT_BUFFER, shard_size=DEFAULT_SHARD_SIZE):
+    path = ruta_salida(directorio, formato, nombre)
+    if formato == "json":
+        return SinkJSON(path, buffer)
+    if formato == "jsonl":
+        return SinkJSONL(path, buffer)
+    if formato == "shards":
+        return SinkShards(path, buffer, shard_size)
+    if formato == "parquet":
+        return SinkParquet(path, buffer)
+    raise ValueError(f"Formato de salida desconocido: {formato}")
+
+
+# LECTORES
+def iterar_lista_json(path, bloque=1 << 20):
+    """Elementos de una lista JSON (o el objeto, si no es lista) sin cargar el archivo completo"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        texto = f.read(bloque)
+        pos = len(texto) - len(texto.lstrip())
+        if texto[pos:pos + 1] != "[":
+            texto += f.read()
+            yield json.loads(texto)
+            return
+        pos += 1
+        fin = False
+        while True:
+            # Saltar espacios y comas hasta el siguiente elemento
+            while True:
+                while pos < len(texto) and texto[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(texto) or fin:
+                    break
+                nuevo = f.read(bloque)
+                fin = not nuevo
+                texto, pos = texto[pos:] + nuevo, 0
+            if pos >= len(texto) or texto[pos] == "]":
+                return
+            try:
+                elemento, termino = decoder.raw_decode(texto, pos)
+            except json.JSONDecodeError:
+                termino = None
+            if termino is None or (termino == len(texto) and not fin):
+                # El elemento quedó cortado al final del bloque: leer más (al menos lo que ya hay) y reintentar
+                nuevo = f.read(max(bloque, len(texto) - pos))
+                if not nuevo:
+                    if termino is None:
+                        raise json.JSONDecodeError("Lista JSON incompleta", texto, pos)
+                    fin = True
+                    continue
+                texto, pos = texto[pos:] + nuevo, 0
+                continue
+            pos = termino
+            yield elemento
+
+def iterar_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                yield json.loads(linea)
+
+def leer_participantes(directorio, formato=None, nombre=NOMBRE):
+    """Registros de participantes del directorio, de a uno, en el formato indicado o el más reciente"""
+    formato = formato or detectar_formato(directorio, nombre)
+    if formato is None:
+        raise FileNotFoundError(f"No hay {nombre}.json/.jsonl/.parquet ni {nombre}_shards en {directorio}")
+    path = ruta_salida(directorio, formato, nombre)
+    if formato == "json":
+        yield from iterar_lista_json(path)
+    elif formato == "jsonl":
+        yield from iterar_jsonl(path)
+    elif formato == "shards":
+        for parte in sorted(os.listdir(path)):
+            if parte.startswith("part-") and parte.endswith(".jsonl"):
+                yield from iterar_jsonl(os.path.join(path, parte))
+    elif formato == "parquet":
+        import pyarrow.parquet as pq
+
+        for lote in pq.ParquetFile(path).iter_batches(columns=["registro"]):
+            for registro in lote.column(0).to_pylist():
+                yield json.loads(registro)
+    else:
+        raise ValueError(f"Formato de salida desconocido: {formato}")
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# VARIABLES GLOBALES
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KB_DIR = os.path.join(BASE_DIR, "KB_RAG")
+
+# (carpeta, módulo, tiene CLI con --help) de cada paso del pipeline.
+# Los scripts sin argparse solo se importan: correrlos con --help haría el trabajo completo.
+MODULOS = [
+    (KB_DIR, "ingest", True),
+    (KB_DIR, "semantic_enrichment", True),
+    (KB_DIR, "vector_store", True),
+    (KB_DIR, "streaming_pipeline", True),
+    (KB_DIR, "retriever", False),
+    (KB_DIR, "numpy_index", True),
+    (KB_DIR, "tester", False),
+    (BASE_DIR, "procesar_encuesta", True),
+    (BASE_DIR, "procesar_datos_encuestas", True),
+    (BASE_DIR, "obtener_querys", True),
+    (BASE_DIR, "generar_reportes", True),
+]
+
+
+def medir(cwd, args, repeticiones):
+    """Mejor tiempo (s) de correr python con args en un proceso nuevo"""
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        proc = subprocess.run([sys.executable] + args, cwd=cwd, capture_output=True, text=True)
+        dt = time.perf_counter() - inicio
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "error")
+        mejor = dt if mejor is None else min(mejor, dt)
+    return mejor
+
+def imports_mas_lentos(cwd, modulo, n):
+    """Los n imports con más tiempo acumulado según python -X importtime"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                          cwd=cwd, capture_output=True, text=True)
+    filas = []
+    for linea in proc.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        partes = [p.strip() for p in linea[len("import time:"):].split("|")]
+        if partes[1].isdigit():
+            filas.append((int(partes[1]), partes[2].strip()))
+    filas.sort(reverse=True)
+    return filas[1:n + 1]  # la primera fila es el propio módulo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de import y de arranque (--help) de cada paso del pipeline")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--limite", type=float, default=1.0, help="Segundos máximos aceptados por paso")
+    parser.add_argument("--detalle", type=int, default=0, help="Mostrar los N imports más lentos de cada módulo")
+    args = parser.parse_args()
+
+    base = medir(BASE_DIR, ["-c", "pass"], args.repeticiones)
+    print(f"Intérprete vacío: {base:.3f}s\n")
+    print(f"{'módulo':<28}{'import':>10}{'--help':>10}")
+
+    lentos = []
+    for cwd, modulo, tiene_cli in MODULOS:
+        try:
+            t_import = medir(cwd, ["-c", f"import {modulo}"], args.repeticiones)
+            t_help = medir(cwd, [modulo + ".py", "--help"], args.repeticiones) if tiene_cli else 0.0
+        except RuntimeError as e:
+            print(f"{modulo:<28}{'ERROR':>10}  {e}")
+            lentos.append(modulo)
+            continue
+        marca = "  <-- LENTO" if max(t_import, t_help) > args.limite else ""
+        help_txt = f"{t_help:>9.3f}s" if tiene_cli else f"{'-':>10}"
+        print(f"{modulo:<28}{t_import:>9.3f}s{help_txt}{marca}")
+        if marca:
+            lentos.append(modulo)
+        for us, nombre in imports_mas_lentos(cwd, modulo, args.detalle):
+            print(f"    {us / 1e6:>8.3f}s  {nombre}")
+
+    if lentos:
+        print(f"\nPasos con error o sobre {args.limite}s: {', '.join(lentos)}")
+        sys.exit(1)
+    print(f"\nTodos los pasos arrancan en menos de {args.limite}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,50 @@
 import os
+import sys
 import json
-from dotenv import load_dotenv
-import google.genai as genai
-from markdown2 import markdown
-from weasyprint import HTML
+import time
+import random
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # VARIABLES GLOBALES
 BASE_DIR = os.path.dirname(__file__)
-INPUT_JSON = os.path.join(BASE_DIR, "recomendaciones/resumen_participantes.json")
+INPUT_DIR = os.path.join(BASE_DIR, "recomendaciones")
 OUTPUT_DIR = os.path.join(BASE_DIR, "generated_reports")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-print()
+from almacen_participantes import leer_participantes
+
+sys.path.insert(0, os.path.join(BASE_DIR, "KB_RAG"))
+from llm_cache import LLMCache, cached_generate_content
+from gemini_client import get_client
+from rate_limit import RateLimiter
+
+# Versión de la plantilla del reporte: subirla al modificar el prompt invalida su cache
+REPORT_PROMPT_VERSION = "1"
+
+# Reintentos por participante: espera BACKOFF_BASE * 2^intento (más un poco de azar) entre intentos
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+
+# Se inicializan en setup()
+client = None
+llm_cache = None
+rate_limiter = None
 
-# GEMINI AI SETUP
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("[GEMINI SETUP] ERROR: No se encontró GOOGLE_API_KEY en el entorno o .env\n")
 
-client = genai.Client(api_key=API_KEY)
-print("[GEMINI SETUP] PASS: Gemini configurado correctamente.\n")
+class ReportGenerationError(Exception):
+    """Gemini no devolvió un reporte después de todos los intentos"""
+
+
+# GEMINI AI SETUP
+def setup(rpm=60, timeout=None, no_llm_cache=False):
+    global client, llm_cache, rate_limiter
+    client = get_client(timeout=timeout)
+    print("[GEMINI SETUP] PASS: Gemini configurado correctamente.\n")
+    llm_cache = LLMCache(bypass=no_llm_cache or None)
+    llm_cache.invalidate_stale("report_md", REPORT_PROMPT_VERSION)
+    rate_limiter = RateLimiter(rpm)
 
 def safe_parse_json(text):
     try:
@@ -38,9 +62,13 @@ def get_next_available_filename(base_path, base_name, ext):
     return os.path.join(base_path, candidate)
 
 
-def generate_report_md(participant_data):
+def backoff_delay(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def generate_report_md(participant_data, retries=DEFAULT_RETRIES):
     """
     Genera el contenido MD del reporte usando Gemini AI - EXPERIMENTAL -
+    Reintenta con backoff si la API falla o responde vacío; si no lo logra lanza ReportGenerationError
     """
     prompt = f"""
     A partir de esta información de un participante en una encuesta de ciberhigiene, redacta en 500 palabras o menos un pequeño pero preciso reporte, en lenguaje natural, profesional, serio y entendible para
@@ -51,51 +79,128 @@ def generate_report_md(participant_data):
     {json.dumps(participant_data, indent=2, ensure_ascii=False)}
     """
 
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=[prompt]
-        )
-        return response.text.strip()
-    except Exception as e:
-        print(f"[GEMINI] ERROR generando reporte: {e}")
-        return ""
+    before_call = rate_limiter.wait if rate_limiter else None
+    error = None
+    for attempt in range(max(1, retries)):
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+        try:
+            text = cached_generate_content(client, prompt, "report_md", REPORT_PROMPT_VERSION,
+                                           cache=llm_cache, before_call=before_call).strip()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            continue
+        if text:
+            return text
+        error = "respuesta vacía"
+    raise ReportGenerationError(f"{error} (después de {max(1, retries)} intentos)")
 
 def save_md_and_pdf(md_content, base_name):
+    """Guarda el MD y su PDF; si algo falla borra lo que alcanzó a escribir y propaga el error"""
     md_file = get_next_available_filename(OUTPUT_DIR, base_name, "md")
     pdf_file = get_next_available_filename(OUTPUT_DIR, base_name, "pdf")
 
-    with open(md_file, "w", encoding="utf-8") as f:
-        f.write(md_content)
+    try:
+        with open(md_file, "w", encoding="utf-8") as f:
+            f.write(md_content)
+
+        # Convertir MD a HTML y luego a PDF (weasyprint tarda en importarse, solo se carga al generar el primero)
+        from markdown2 import markdown
+        from weasyprint import HTML
+        html_content = markdown(md_content)
+        HTML(string=html_content).write_pdf(pdf_file)
+    except BaseException:
+        for path in (md_file, pdf_file):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
     print(f"[INFO] Reporte MD generado: {md_file}")
-
-    # Convertir MD a HTML y luego a PDF
-    html_content = markdown(md_content)
-    HTML(string=html_content).write_pdf(pdf_file)
     print(f"[INFO] Reporte PDF generado: {pdf_file}")
 
 
-with open(INPUT_JSON, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
+def participant_base_name(participant, idx):
+    return str(participant.get("Participante", f"reporte_participante_{idx}")).replace(" ", "_")
 
-'''
-# PARA GENERAR UNO SOLO
-participant = data[0] if isinstance(data, list) else data
-base_name = str(participant.get("Participante", "reporte_participante")).replace(" ", "_")
+def timed_report(participant, retries):
+    inicio = time.perf_counter()
+    return generate_report_md(participant, retries), time.perf_counter() - inicio
 
-# Generar reporte
-md_report = generate_report_md(participant)
-# Guardar MD y PDF
-save_md_and_pdf(md_report, base_name)
-'''
+def generate_reports(participants, workers=4, retries=DEFAULT_RETRIES):
+    """
+    Genera los reportes con hasta 'workers' peticiones a Gemini en curso (limitadas además por el rate limiter).
+    Los resultados se guardan y se informan en el orden de los participantes: se espera al más antiguo
+    antes de aceptar uno nuevo, así nunca hay más de 2 * workers participantes en memoria.
+    Un participante que falla (al generar o al guardar) no deja archivos; devuelve la lista de (nombre, error) de los que fallaron.
+    """
+    failed = []
+    done = 0
+    pending = deque()
+
+    def collect():
+        nonlocal done
+        name, future = pending.popleft()
+        done += 1
+        try:
+            md_report, seconds = future.result()
+        except Exception as e:
+            failed.append((name, str(e)))
+            print(f"[{done}] ERROR participante {name}: {e}")
+            return
+        try:
+            save_md_and_pdf(md_report, name)
+        except Exception as e:
+            failed.append((name, f"{type(e).__name__}: {e}"))
+            print(f"[{done}] ERROR participante {name}: no se pudo guardar el reporte: {e}")
+            return
+        print(f"[{done}] Participante {name}: reporte generado en {seconds:.1f}s")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for idx, participant in enumerate(participants):
+            if len(pending) >= 2 * max(1, workers):
+                collect()
+            name = participant_base_name(participant, idx)
+            pending.append((name, executor.submit(timed_report, participant, retries)))
+        while pending:
+            collect()
+
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generación de reportes por participante con Gemini")
+    parser.add_argument("--workers", type=int, default=4, help="Peticiones simultáneas a Gemini (1 = de a un participante)")
+    parser.add_argument("--rpm", type=float, default=60, help="Máximo de peticiones por minuto (0 = sin límite)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Intentos por participante antes de darlo por fallido")
+    parser.add_argument("--timeout", type=int, default=None, help="Timeout en segundos de cada petición a Gemini")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Ignora las respuestas guardadas en el cache del LLM")
+    args = parser.parse_args()
+
+    print()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    setup(rpm=args.rpm, timeout=args.timeout, no_llm_cache=args.no_llm_cache)
+
+    # Recomendaciones por participante, leídas de a una (json, jsonl, parquet o shards)
+    data = leer_participantes(INPUT_DIR)
+
+    '''
+    # PARA GENERAR UNO SOLO
+    participant = next(data)
+    base_name = participant_base_name(participant, 0)
 
-# PARA GENERAR TODOS
-for idx, participant in enumerate(data):
-    participante_name = str(participant.get("Participante", f"reporte_participante_{idx}")).replace(" ", "_")
-    
     # Generar reporte
     md_report = generate_report_md(participant)
-    
     # Guardar MD y PDF
-    save_md_and_pdf(md_report, participante_name)
+    save_md_and_pdf(md_report, base_name)
+    '''
+
+    # PARA GENERAR TODOS
+    failed = generate_reports(data, workers=args.workers, retries=args.retries)
+
+    llm_cache.print_stats()
+    if failed:
+        print(f"[ERROR] {len(failed)} reportes no se generaron: {', '.join(name for name, _ in failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
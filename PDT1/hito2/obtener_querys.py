@@ -1,18 +1,20 @@
-import pandas as pd
 import os
-import json
-import time
-from dotenv import load_dotenv
-import google.genai as genai
-from langchain_chroma import Chroma
-from langchain.docstore.document import Document
+import sys
+import argparse
+import threading
 
-# VARIABLES GLOBALES
+# Los módulos de la KB (embeddings, retriever, cliente de Gemini) están en KB_RAG/
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INPUT_JSON = os.path.join(BASE_DIR, "analisis_encuesta/resumen_participantes.json")
+sys.path.insert(0, os.path.join(BASE_DIR, "KB_RAG"))
+
+from almacen_participantes import FORMATOS, DEFAULT_FORMATO, DEFAULT_BUFFER, abrir_sink, leer_participantes, ruta_salida
+from embedding_cache import EmbeddingCache, get_gemini_embeddings, dummy_embedding
+from retriever import Retriever, open_backend, DEFAULT_BACKEND
+from gemini_client import get_client
+
+# VARIABLES GLOBALES
+INPUT_DIR = os.path.join(BASE_DIR, "analisis_encuesta")
 OUTPUT_DIR = os.path.join(BASE_DIR, "recomendaciones")
-OUTPUT_JSON= os.path.join(OUTPUT_DIR, "resumen_participantes.json")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 dimensiones = {
     "DAI": "Dispositivos y almacenamiento de información",
@@ -22,118 +24,35 @@ dimensiones = {
     "MCE": "Mensajería y correo electrónico"
 }
 
-VECTOR_DB_DIR = os.path.join(BASE_DIR, "KB_RAG/vectorstore_chroma")
-
-# GEMINI SETUP
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("No se encontró GOOGLE_API_KEY en el entorno o .env")
-
-client = genai.Client(api_key=API_KEY)
+# Se inicializan a pedido en get_retriever() y main()
+embedding_cache = None
+retriever = None
+fallback_metrics = False
+_retriever_lock = threading.Lock()
 
 
 # FUNCIONES AUXILIARES
 def get_gemini_embedding(text: str):
     if not text.strip():
-        return [0.0] * 3072  # embedding dummy
-    for attempt in range(5):
-        try:
-            resp = client.models.embed_content(
-                model="gemini-embedding-001",
-                contents=text
-            )
-            return resp.embeddings[0].values
-        except Exception as e:
-                print(f"[ERROR] Intento {attempt+1}/{5} fallido: {e}")
-                if attempt < 4:
-                    time.sleep(5)
-                else:
-                    raise
-
-# CARGAR VECTOR STORE
-vector_store = Chroma(
-    embedding_function=get_gemini_embedding,
-    collection_name="kb_rag",
-    persist_directory=VECTOR_DB_DIR
-)
-print("Vectores cargados:", len(vector_store._collection.get()["ids"]))
-
-
-# RETRIEVER
-def normalize_str(s):
-    if not s:
-        return ""
-    return str(s).strip().lower()
-
-def normalize_list(lst):
-    return [normalize_str(x) for x in lst]
+        return dummy_embedding()
+    return get_gemini_embeddings(get_client(), [text], cache=embedding_cache)[0]
+
+# CARGAR VECTOR STORE Y RETRIEVER
+def get_retriever(backend=None):
+    """
+    Lee la KB una vez y arma el índice invertido de metadata para los filtros.
+    El backend (chroma o numpy) se elige con KB_BACKEND o --backend
+    """
+    global embedding_cache, retriever
+    with _retriever_lock:
+        if retriever is None:
+            embedding_cache = EmbeddingCache()
+            retriever = Retriever(open_backend(backend or DEFAULT_BACKEND), get_gemini_embedding)
+            print("Vectores cargados:", len(retriever))
+    return retriever
 
 def semantic_query(query_text="", top_k=5, filters=None):
-    if query_text:
-        print(f"[DEBUG] Buscando por query: {query_text}")
-        query_emb = get_gemini_embedding(query_text)
-        results = vector_store.similarity_search_by_vector(query_emb, k=top_k)
-    else:
-        raw = vector_store._collection.get()
-        results = [
-            Document(page_content=d, metadata=m)
-            for d, m in zip(raw["documents"], raw["metadatas"])
-        ]
-    
-    # Filtrado por metadata
-    if filters:
-        print(f"[DEBUG] Aplicando filtros: {filters}")
-        filtered = []
-        for i, r in enumerate(results):
-            match = True
-            for key, val in filters.items():
-                if key not in r.metadata:
-                    match = False
-                    break
-                
-                doc_val = r.metadata.get(key)
-
-                # Tags: coincidencia exacta dentro de la lista
-                if key == "tags":
-                    if isinstance(doc_val, str) and doc_val.startswith('[') and doc_val.endswith(']'):
-                        doc_val = doc_val[1:-1].replace("'", "").replace('"','').split(',')
-                        doc_val = [t.strip() for t in doc_val if t.strip()]
-                    doc_tags = [normalize_str(t) for t in doc_val or []]
-                    filter_tags = [normalize_str(f) for f in val]
-                    if not any(f == t for f in filter_tags for t in doc_tags):
-                        match = False
-                        break
-
-                # Nivel: coincidencia exacta dentro de la lista
-                elif key == "nivel":
-                    filter_niveles = [normalize_str(f) for f in val] if isinstance(val, list) else [normalize_str(val)]
-                    if normalize_str(doc_val) not in filter_niveles:
-                        match = False
-                        break
-
-                # Tema: coincidencia parcial
-                elif key == "tema":
-                    doc_temas = doc_val if isinstance(doc_val, list) else [doc_val]
-                    doc_temas = [normalize_str(t) for t in doc_temas]
-                    if not any(normalize_str(val) in t for t in doc_temas):
-                        match = False
-                        break
-
-                # Otros campos: coincidencia parcial (substring)
-                else:
-                    doc_val_str = normalize_str(doc_val)
-                    filter_val_str = normalize_str(val)
-                    if filter_val_str not in doc_val_str:
-                        match = False
-                        break
-
-            if match:
-                filtered.append(r)
-        print(f"[DEBUG] Total documentos encontrados después de filtros: {len(filtered)}")
-        filtered.sort(key=lambda x: len(x.page_content), reverse=True)
-        return filtered[:top_k]
-    return results[:top_k]
+    return get_retriever().semantic_query(query_text, top_k=top_k, filters=filters)
 
 
 # Función para obtener recomendaciones únicas
@@ -159,6 +78,29 @@ def get_unique_recommendations(docs, existing=set(), max_rec=5):
             break
     return recs, existing
 
+# Métricas de búsquedas: las de respaldo son las que pasan al siguiente nivel por falta de resultados
+metricas = {"busquedas": 0, "busquedas_respaldo": 0, "busquedas_antiguas": 0}
+_metricas_lock = threading.Lock()
+
+def contar_busquedas_antiguas(query_text, top_k, dim, niveles, minimo):
+    """
+    Búsquedas que habría hecho el filtrado antiguo (top-k sin filtros y después filtrar)
+    recorriendo los niveles hasta juntar 'minimo' resultados
+    """
+    total = 0
+    for n, nivel in enumerate(niveles, 1):
+        total += get_retriever().topk_then_filter_count(query_text, top_k, {"dimension": dim, "nivel": [nivel]})
+        if total >= minimo:
+            return n
+    return len(niveles)
+
+def registrar_busquedas(hechas, query_text, top_k, dim, niveles, minimo):
+    antiguas = contar_busquedas_antiguas(query_text, top_k, dim, niveles, minimo) if fallback_metrics else 0
+    with _metricas_lock:
+        metricas["busquedas"] += hechas
+        metricas["busquedas_respaldo"] += hechas - 1
+        metricas["busquedas_antiguas"] += antiguas
+
 def niveles_alternativos(nivel):
     nivel = nivel.lower()
     if nivel == "básico":
@@ -172,20 +114,69 @@ def niveles_alternativos(nivel):
     return []
 
 
-# Cargar JSON de participantes
-with open(INPUT_JSON, "r", encoding="utf-8") as f:
-    data = json.load(f)
-participantes = data if isinstance(data, list) else [data]
-
-
-# Procesar cada participante
-recomendaciones_final = []
-for participante in participantes:
+def items_criticos_de(analisis):
+    return analisis.get("Items_criticos_personales", []) + analisis.get("Items_criticos_debajo_percentil35", [])
+
+def nivel_de(participante):
+    return participante.get("Datos_personales", {}).get("Nivel_expertis_ciberseguridad", "promedio").lower()
+
+
+# MODO POR LOTES
+def preparar_busqueda_por_lotes(participantes):
+    """
+    Arma todas las búsquedas (texto, top_k, dimensión, nivel) que pueden pedir los participantes,
+    embebe los textos distintos en lotes y resuelve todas las búsquedas con un solo producto de matrices.
+    Devuelve una función con la firma de semantic_query que consulta los resultados precalculados.
+    """
+    import numpy as np
+    from matrix_search import MatrixSearch
+
+    retriever = get_retriever()
+    consultas = set()
+    for participante in participantes:
+        niveles = [nivel_de(participante)] + niveles_alternativos(nivel_de(participante))
+        analisis = participante.get("Análisis_datos", {})
+        pares = [(dimensiones[dim], 10, dim) for dim in analisis.get("Dimensiones_criticas", [])]
+        pares += [(i.get("Que_mide", ""), 5, i.get("Dimension", "")) for i in items_criticos_de(analisis)]
+        for texto, top_k, dim in pares:
+            if texto.strip():
+                consultas.update((texto, top_k, dim, nivel) for nivel in niveles)
+    consultas = sorted(consultas)
+
+    textos = sorted({c[0] for c in consultas})
+    print(f"[BATCH] {len(consultas)} búsquedas distintas con {len(textos)} textos de consulta")
+    fila = {texto: i for i, texto in enumerate(textos)}
+    query_matrix = np.array(get_gemini_embeddings(get_client(), textos, cache=embedding_cache), dtype=np.float32) \
+        if textos else np.zeros((0, 0), dtype=np.float32)
+
+    busqueda = MatrixSearch(retriever.index, retriever.backend.matrix(retriever.index))
+    requests = [(fila[texto], {"dimension": dim, "nivel": nivel}, top_k) for texto, top_k, dim, nivel in consultas]
+    resultados = {}
+    for consulta, posiciones in zip(consultas, busqueda.search_many(query_matrix, requests)):
+        docs = busqueda.documents(posiciones)
+        # Mismo orden que semantic_query con filtros
+        docs.sort(key=lambda x: len(x.page_content), reverse=True)
+        resultados[consulta] = docs
+
+    def buscar(query_text="", top_k=5, filters=None):
+        filters = filters or {}
+        nivel = filters.get("nivel", "")
+        nivel = nivel[0] if isinstance(nivel, list) and len(nivel) == 1 else nivel
+        consulta = (query_text, top_k, filters.get("dimension", ""), nivel)
+        if isinstance(nivel, str) and consulta in resultados:
+            return resultados[consulta]
+        return semantic_query(query_text, top_k=top_k, filters=filters)
+
+    return buscar
+
+
+# RECOMENDACIONES POR PARTICIPANTE
+def recomendar_participante(participante, buscar):
     datos_personales = participante.get("Datos_personales", {})
-    nivel_usuario = datos_personales.get("Nivel_expertis_ciberseguridad", "promedio").lower()
+    nivel_usuario = nivel_de(participante)
     analisis = participante.get("Análisis_datos", {})
     dim_criticas = analisis.get("Dimensiones_criticas", [])
-    items_criticos = analisis.get("Items_criticos_personales", []) + analisis.get("Items_criticos_debajo_percentil35", [])
+    items_criticos = items_criticos_de(analisis)
 
     recs_por_dimension = []
     recs_por_item = []
@@ -195,8 +186,10 @@ for participante in participantes:
         seen_recs_dim = set()
         niveles = [nivel_usuario] + niveles_alternativos(nivel_usuario)
         recs_dim = []
+        hechas = 0
         for nivel in niveles:
-            docs = semantic_query(
+            hechas += 1
+            docs = buscar(
                 query_text=dimensiones[dim],
                 top_k=10,
                 filters={"dimension": dim, "nivel": nivel}
@@ -205,6 +198,7 @@ for participante in participantes:
             recs_dim.extend(recs)
             if len(recs_dim) >= 10:
                 break
+        registrar_busquedas(hechas, dimensiones[dim], 10, dim, niveles, 10)
         # Actualizamos cada recomendación con metadata extendida
         for r in recs_dim:
             r.update({
@@ -231,14 +225,17 @@ for participante in participantes:
         
         niveles_prueba = [nivel_usuario] + niveles_alternativos(nivel_usuario)
         docs = []
+        hechas = 0
         for nivel in niveles_prueba:
-            docs = semantic_query(
+            hechas += 1
+            docs = buscar(
                 query_text=que_mide,
                 top_k=5,
                 filters={"dimension": dimension, "nivel": [nivel]}
             )
             if len(docs) > 0:
                 break
+        registrar_busquedas(hechas, que_mide, 5, dimension, niveles_prueba, 1)
         
         recs, _ = get_unique_recommendations(docs, existing=seen_recs_item, max_rec=5)
         # Cada item no lleva 'dimension_asociada'
@@ -253,18 +250,58 @@ for participante in participantes:
             })
         recs_por_item.extend(recs)
 
-    recomendaciones_final.append({
+    return {
         "Participante": participante.get("Participante"),
         "Datos_personales": datos_personales,
         "Recomendaciones": {
             "dimension": recs_por_dimension,
             "item": recs_por_item
         }
-    })
+    }
+
+
+def main():
+    global fallback_metrics
+
+    parser = argparse.ArgumentParser(description="Recomendaciones por participante desde la KB")
+    parser.add_argument("--fallback-metrics", action="store_true",
+                        help="Calcula cuántas búsquedas de respaldo por nivel habría hecho el filtrado antiguo (top-k y después filtrar)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Resuelve todas las búsquedas de todos los participantes de una vez con NumPy (un solo producto de matrices)")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=None,
+                        help="Backend vectorial (por defecto KB_BACKEND o chroma)")
+    parser.add_argument("--formato", choices=FORMATOS, default=DEFAULT_FORMATO,
+                        help="Formato de salida de las recomendaciones (json es la lista indentada antigua)")
+    parser.add_argument("--buffer", type=int, default=DEFAULT_BUFFER, help="Participantes por escritura en bloque")
+    args = parser.parse_args()
+    fallback_metrics = args.fallback_metrics
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    get_retriever(args.backend)
+
+    # Los participantes se leen de a uno desde el análisis (json, jsonl, parquet o shards)
+    participantes = leer_participantes(INPUT_DIR)
+    if args.batch:
+        # El modo por lotes necesita todas las consultas antes de empezar
+        participantes = list(participantes)
+        buscar = preparar_busqueda_por_lotes(participantes)
+    else:
+        buscar = semantic_query
+
+    # Procesar cada participante y guardar a medida que se generan
+    with abrir_sink(OUTPUT_DIR, args.formato, buffer=args.buffer) as sink:
+        for participante in participantes:
+            sink.escribir(recomendar_participante(participante, buscar))
 
+    print(f"Recomendaciones de {sink.total} participantes generadas en: {ruta_salida(OUTPUT_DIR, args.formato)}")
+    print(f"[BÚSQUEDAS] Total: {metricas['busquedas']}, de respaldo por nivel: {metricas['busquedas_respaldo']}")
+    if args.fallback_metrics:
+        evitadas = metricas["busquedas_antiguas"] - metricas["busquedas"]
+        print(f"[BÚSQUEDAS] Con el filtrado antiguo habrían sido {metricas['busquedas_antiguas']}: "
+              f"{evitadas} búsquedas de respaldo evitadas")
+    print(f"[RETRIEVER] {retriever.stats}")
+    embedding_cache.print_stats()
 
-# Guardar JSON de salida
-with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-    json.dump(recomendaciones_final, f, indent=2, ensure_ascii=False)
 
-print(f"Recomendaciones generadas en: {OUTPUT_JSON}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
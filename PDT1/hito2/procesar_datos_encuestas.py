@@ -1,16 +1,19 @@
-import pandas as pd
 import os
 import json
+import argparse
+import itertools
 import numpy as np
+from procesar_encuesta import CAMPOS_PERSONALES, RESPUESTAS_CSV, formato_disponible, ruta_tabla, cargar_tablas, cargar_items
+from sketch_percentiles import SketchPercentil, DEFAULT_CAPACIDAD
+from almacen_participantes import FORMATOS, DEFAULT_FORMATO, DEFAULT_BUFFER, abrir_sink, ruta_salida, leer_participantes
 
 # VARIABLES GLOBALES
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_JSON = os.path.join(BASE_DIR, "datos_encuesta/muestra_encuesta_procesado.json")
 OUTPUT_JSON_DIR = os.path.join(BASE_DIR, "analisis_encuesta")
-OUTPUT_JSON = os.path.join(OUTPUT_JSON_DIR, "resumen_participantes.json")
 OUTPUT_GLOBAL = os.path.join(OUTPUT_JSON_DIR, "analisis_global.json")
-
-os.makedirs(OUTPUT_JSON_DIR, exist_ok=True)
+ESTADISTICAS_JSON = os.path.join(OUTPUT_JSON_DIR, "estadisticas_encuesta.json")  # Estadísticas suficientes para --append
+DEFAULT_CHUNK_SIZE = 50000  # Participantes por bloque en el modo streaming
 
 
 def asignar_nivel_expertis(datos):
@@ -37,198 +40,603 @@ def asignar_nivel_expertis(datos):
     return "Básico"
 
 
-# Cargar JSON procesado
-with open(INPUT_JSON, "r", encoding="utf-8") as f:
-    participantes = json.load(f)
+# MATRIZ PARTICIPANTES x ITEMS
+class MatrizEncuesta:
+    """
+    Respuestas de la encuesta como matriz participantes x items (float64), con los datos de cada item por columna.
+    - listado: el item aparece en la lista del participante
+    - respondido: además tiene una respuesta numérica (las que entran en promedios y comparaciones)
+    - posicion: lugar de cada item en la lista de cada participante, solo si no todos siguen el orden
+      de las columnas (JSON con items faltantes o desordenados); las salidas respetan ese orden
+    """
+
+    def __init__(self, ids, informacion, codigos, dimensiones, indica, enunciados, respuestas, listado, respondido,
+                 posicion=None):
+        self.ids = ids
+        self.informacion = informacion
+        self.codigos = codigos
+        self.dimensiones = dimensiones
+        self.indica = indica
+        self.enunciados = enunciados
+        self.respuestas = respuestas
+        self.listado = listado
+        self.respondido = respondido
+        self.posicion = posicion
+
+        # Máscara de ítems de riesgo e inversión (1 lo peor y 5 lo ideal) de toda la matriz a la vez
+        self.riesgo = np.array([i == "Sí" for i in indica], dtype=bool)
+        self.normalizadas = np.where(self.riesgo, 6 - respuestas, respuestas)
+
+        # Índices de columna de cada dimensión, en orden de aparición
+        self.grupos = {}
+        for j, dim in enumerate(dimensiones):
+            if dim:
+                self.grupos.setdefault(dim, []).append(j)
+        self.grupos = {dim: np.array(cols) for dim, cols in self.grupos.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def seleccionar(self, filas):
+        """Submatriz con solo los participantes de las filas indicadas"""
+        return MatrizEncuesta([self.ids[i] for i in filas], [self.informacion[i] for i in filas], self.codigos,
+                              self.dimensiones, self.indica, self.enunciados, self.respuestas[filas],
+                              self.listado[filas], self.respondido[filas],
+                              None if self.posicion is None else self.posicion[filas])
+
+    def posiciones(self):
+        """Matriz con el lugar de cada item en la lista de cada participante"""
+        if self.posicion is not None:
+            return self.posicion
+        return np.broadcast_to(np.arange(len(self.codigos)), self.respuestas.shape)
+
+    def orden_items_global(self):
+        """Columnas con al menos una respuesta, en el orden en que aparece su primera respuesta"""
+        con_respuestas = self.respondido.any(axis=0)
+        cols = np.flatnonzero(con_respuestas)
+        if self.posicion is None:
+            return cols
+        primera_fila = self.respondido.argmax(axis=0)[cols]
+        return cols[np.lexsort((self.posicion[primera_fila, cols], primera_fila))]
+
+    @staticmethod
+    def datos_items(items, codigos):
+        """Dimensión, indica riesgo y enunciado de cada código según la tabla de items (None si no está)"""
+        info = items.astype(object).where(items.notna(), None).set_index("Item")
+        return [[info[c].get(code) if code in info.index else None for code in codigos]
+                for c in ("Dimension", "Indica_riesgo", "Enunciado")]
+
+    @classmethod
+    def desde_tablas(cls, participantes, items, largo):
+        """Desde las tablas en columnas de procesar_encuesta.py (sin pasar por diccionarios por respuesta)"""
+        codigos = [str(c) for c in largo["Item"].cat.categories]
+
+        ids = participantes["Participante"].tolist()
+        fila = {pid: i for i, pid in enumerate(ids)}
+        filas = largo["Participante"].map(fila).to_numpy()
+        cols = largo["Item"].cat.codes.to_numpy()
+
+        respuestas = np.zeros((len(ids), len(codigos)), dtype=np.float64)
+        listado = np.zeros(respuestas.shape, dtype=bool)
+        respuestas[filas, cols] = largo["Respuesta"].to_numpy(dtype=np.float64)
+        listado[filas, cols] = True
+
+        informacion = participantes[list(CAMPOS_PERSONALES.values())].to_dict("records")
+        return cls(ids, informacion, codigos, *cls.datos_items(items, codigos), respuestas, listado, listado.copy())
+
+    @classmethod
+    def desde_csv(cls, bloque, items, inicio=1):
+        """Desde un bloque del CSV de respuestas (una fila por participante), numerando desde 'inicio'"""
+        codigos = [c for c in bloque.columns if c.startswith("i")]
+        respuestas = bloque[codigos].to_numpy(dtype=np.float64)
+        listado = np.ones(respuestas.shape, dtype=bool)
+        informacion = bloque[list(CAMPOS_PERSONALES)].rename(columns=CAMPOS_PERSONALES).to_dict("records")
+        return cls(list(range(inicio, inicio + len(bloque))), informacion, codigos, *cls.datos_items(items, codigos),
+                   respuestas, listado, listado.copy())
+
+    @classmethod
+    def desde_json(cls, participantes):
+        """Desde la lista anidada de muestra_encuesta_procesado.json"""
+        columna = {}
+        meta = {}
+        for p in participantes:
+            for it in p.get("items", []):
+                code = it.get("Item")
+                if code and code not in columna:
+                    columna[code] = len(columna)
+                if code:
+                    meta[code] = (it.get("Dimension", ""), it.get("Indica_riesgo", ""), it.get("Enunciado", ""))
+
+        respuestas = np.zeros((len(participantes), len(columna)), dtype=np.float64)
+        listado = np.zeros(respuestas.shape, dtype=bool)
+        respondido = np.zeros(respuestas.shape, dtype=bool)
+        posicion = np.full(respuestas.shape, len(columna), dtype=np.int64)
+        for i, p in enumerate(participantes):
+            for pos, it in enumerate(p.get("items", [])):
+                j = columna.get(it.get("Item"))
+                if j is None:
+                    continue
+                listado[i, j] = True
+                posicion[i, j] = pos
+                val = it.get("Respuesta", None)
+                if val is None or val == "":
+                    continue
+                try:
+                    respuestas[i, j] = float(val)
+                    respondido[i, j] = True
+                except Exception:
+                    continue
+
+        codigos = list(columna)
+        return cls([p.get("Participante") for p in participantes],
+                   [p.get("informacion_personal", {}) for p in participantes], codigos,
+                   [meta[c][0] for c in codigos], [meta[c][1] for c in codigos], [meta[c][2] for c in codigos],
+                   respuestas, listado, respondido,
+                   None if (posicion == np.arange(len(codigos))).all() else posicion)
+
+
+def cargar_encuesta():
+    """Matriz de la encuesta desde las tablas en columnas o, si no están, desde el JSON antiguo"""
+    formato = formato_disponible()
+    if formato is not None:
+        if os.path.getmtime(ruta_tabla("respuestas", formato)) < os.path.getmtime(RESPUESTAS_CSV):
+            # El CSV recibió respuestas nuevas (--append) después de generar las tablas
+            print("[AVISO] Las tablas son más antiguas que el CSV de respuestas, se lee el CSV (ejecutar procesar_encuesta.py)")
+            return next(leer_por_bloques(chunk_size=None))
+        return MatrizEncuesta.desde_tablas(*cargar_tablas(formato))
+    with open(INPUT_JSON, "r", encoding="utf-8") as f:
+        return MatrizEncuesta.desde_json(json.load(f))
 
 
 # ANALISIS DATOS PROMEDIO GLOBALES SEGUN LA MUESTRA
-item_to_dimension = {}
-item_to_indica = {}
-item_to_enunciado = {}
-respuestas_por_item = {}
-for p in participantes:
-    for it in p.get("items", []):
-        code = it.get("Item")
-        if not code:
-            continue
-
-        item_to_dimension[code] = it.get("Dimension", "") or ""
-        item_to_indica[code] = it.get("Indica_riesgo", "") or ""
-        item_to_enunciado[code] = it.get("Enunciado", "") or ""
-
-        val = it.get("Respuesta", None)
-        if val is None or val == "":
-            continue
-        try:
-            val = float(val)
-        except Exception:
-            continue
-
-        # Invertir si el ítem indica riesgo
-        if item_to_indica[code] == "Sí":
-            val = 6 - val
-
-        respuestas_por_item.setdefault(code, []).append(val)
-
-# Promedio para cada item y su puntaje equivalente al percentil 35
-promedio_por_item = {}
-percentil35_por_item = {}
-for code, vals in respuestas_por_item.items():
-    if len(vals) == 0:
-        continue
-    promedio_por_item[code] = round(np.mean(vals), 2)
-    percentil35_por_item[code] = round(np.percentile(vals, 35), 2)
-
-# Promedio por dimensión (a partir de promedios de ítem)
-dimension_items_vals = {}
-for item_code, prom in promedio_por_item.items():
-    dim = item_to_dimension.get(item_code, "")
-    dimension_items_vals.setdefault(dim, []).append(prom)
-
-promedio_por_dimension = {dim: round(np.mean(vals), 2) for dim, vals in dimension_items_vals.items() if vals}
-
-# Promedio global (promedio de las dimensiones)
-promedio_global = round(np.mean(list(promedio_por_dimension.values())), 2) if promedio_por_dimension else 0.0
-
-print("DATOS PROMEDIO...")
-print("Puntaje_promedio_total:", promedio_global)
-print("Puntaje_promedio_por_dimension:", promedio_por_dimension)
-print()
+def estadisticas_globales(enc):
+    """Promedio y percentil 35 por item (respuestas invertidas), promedio por dimensión y global"""
+    # Una fila contigua por item: el promedio y el percentil se calculan igual que sobre la lista de respuestas
+    por_item = np.ascontiguousarray(enc.normalizadas.T)
+    respondido = enc.respondido.T
+    con_respuestas = respondido.any(axis=1)
+
+    if respondido.all():
+        promedios = np.round(np.mean(por_item, axis=1), 2)
+        percentiles = np.round(np.percentile(por_item, 35, axis=1), 2)
+    else:
+        promedios = np.zeros(len(enc.codigos))
+        percentiles = np.zeros(len(enc.codigos))
+        for j in np.flatnonzero(con_respuestas):
+            vals = por_item[j][respondido[j]]
+            promedios[j] = round(np.mean(vals), 2)
+            percentiles[j] = round(np.percentile(vals, 35), 2)
+
+    return resumen_global(enc.dimensiones, enc.orden_items_global(), promedios, percentiles, con_respuestas)
+
+def resumen_global(dimensiones, orden_items, promedios, percentiles, con_respuestas):
+    """Estadísticas globales a partir del promedio y percentil 35 (ya redondeados) de cada ítem"""
+    # Promedio por dimensión (a partir de promedios de ítem)
+    dimension_items_vals = {}
+    for j in orden_items:
+        dimension_items_vals.setdefault(dimensiones[j] or "", []).append(promedios[j])
+    promedio_por_dimension = {dim: round(np.mean(vals), 2) for dim, vals in dimension_items_vals.items() if vals}
+
+    # Promedio global (promedio de las dimensiones)
+    promedio_global = round(np.mean(list(promedio_por_dimension.values())), 2) if promedio_por_dimension else 0.0
+
+    return {
+        "promedio_item": np.where(con_respuestas, promedios, np.nan),
+        "percentil35_item": np.where(con_respuestas, percentiles, np.nan),
+        "con_respuestas": con_respuestas,
+        "promedio_por_dimension": promedio_por_dimension,
+        "promedio_global": promedio_global
+    }
 
 
-# ANÁLISIS POR PARTICIPANTE
-resumen_participantes = []
-for participante in participantes:
-    items_analisis = []
-    dimension_scores = {}
-
-    for it in participante.get("items", []):
-        item_code = it.get("Item")
-        indica = it.get("Indica_riesgo", "")
-        dim = it.get("Dimension", "")
-        try:
-            respuesta = float(it.get("Respuesta")) if it.get("Respuesta") not in (None, "") else None
-        except Exception:
-            respuesta = None
-
-        # Invertir si es ítem de riesgo
-        if respuesta is not None:
-            if indica == "Sí":
-                respuesta_invertida = 6 - respuesta
-            else:
-                respuesta_invertida = respuesta
-        else:
-            respuesta_invertida = None
-
-        # Registrar valores por dimensión
-        if dim and respuesta_invertida is not None:
-            dimension_scores.setdefault(dim, []).append(respuesta_invertida)
-
-        items_analisis.append({
-            "Item": item_code,
-            "Dimension": dim,
-            "Indica_riesgo": indica,
-            "Enunciado": it.get("Enunciado", "") or "",
-            "Respuesta": respuesta,
-            "respuesta_normalizada": respuesta_invertida, # Realmente a cuanto equivale del 1 al 5 si 1 es lo peor y 5 lo ideal
-            "Promedio_item_global": promedio_por_item.get(item_code), # Para comparar
-            "Percentil35_item_global": percentil35_por_item.get(item_code) # Para comparar
-        })
-
-    # Puntajes por dimensión del participante
-    puntaje_por_dimension = {
-        k: round(np.mean(v), 2) for k, v in dimension_scores.items() if v
-    }
+# MODO STREAMING
+def leer_por_bloques(chunk_size=DEFAULT_CHUNK_SIZE, path=RESPUESTAS_CSV, inicio=1):
+    """Recorre el CSV de respuestas en bloques de chunk_size participantes (todo junto si es None), como MatrizEncuesta"""
+    import pandas as pd
+
+    items = cargar_items()
+    bloques = pd.read_csv(path, chunksize=chunk_size) if chunk_size else [pd.read_csv(path)]
+    for bloque in bloques:
+        yield MatrizEncuesta.desde_csv(bloque, items, inicio)
+        inicio += len(bloque)
+
+class AcumuladorEncuesta:
+    """
+    Estadísticas suficientes de los ítems en una pasada: suma y cantidad de respuestas (invertidas)
+    para el promedio y un SketchPercentil para el percentil 35. La memoria no depende de la cantidad
+    de participantes. Los ítems se ordenan según su primera respuesta, como en estadisticas_globales.
+    """
+
+    def __init__(self, capacidad=DEFAULT_CAPACIDAD):
+        self.capacidad = capacidad
+        self.codigos = []
+        self.dimensiones = []
+        self.sumas = []
+        self.conteos = []
+        self.sketches = []
+        self.participantes = 0
+        self._columna = {}
+
+    def agregar(self, enc):
+        self.participantes += len(enc)
+        for j in enc.orden_items_global():
+            code = enc.codigos[j]
+            if code not in self._columna:
+                self._columna[code] = len(self.codigos)
+                self.codigos.append(code)
+                self.dimensiones.append(enc.dimensiones[j])
+                self.sumas.append(0.0)
+                self.conteos.append(0)
+                self.sketches.append(SketchPercentil(self.capacidad))
+            k = self._columna[code]
+            vals = enc.normalizadas[:, j][enc.respondido[:, j]]
+            self.dimensiones[k] = enc.dimensiones[j]
+            self.sumas[k] += float(vals.sum())
+            self.conteos[k] += len(vals)
+            self.sketches[k].agregar(vals)
+
+    def exacto(self):
+        return all(s.exacto for s in self.sketches)
+
+    def globales(self, codigos):
+        """Estadísticas globales con el formato de estadisticas_globales, alineadas con 'codigos'"""
+        promedios = np.round(np.array(self.sumas) / np.array(self.conteos), 2)
+        percentiles = np.array([round(sk.percentil(35), 2) for sk in self.sketches])
+        globales = resumen_global(self.dimensiones, range(len(self.codigos)), promedios, percentiles,
+                                  np.ones(len(self.codigos), dtype=bool))
+
+        # Reordenar por item según las columnas del bloque que se va a analizar
+        columnas = [self._columna.get(code) for code in codigos]
+        globales["con_respuestas"] = np.array([k is not None for k in columnas], dtype=bool)
+        globales["promedio_item"] = np.array([promedios[k] if k is not None else np.nan for k in columnas])
+        globales["percentil35_item"] = np.array([percentiles[k] if k is not None else np.nan for k in columnas])
+        return globales
+
+    def to_dict(self):
+        return {
+            "participantes": self.participantes,
+            "capacidad": self.capacidad,
+            "items": [{"Item": code, "Dimension": dim, "suma": suma, "conteo": conteo, "sketch": sk.to_dict()}
+                      for code, dim, suma, conteo, sk in zip(self.codigos, self.dimensiones, self.sumas,
+                                                             self.conteos, self.sketches)]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        acumulador = cls(data.get("capacidad", DEFAULT_CAPACIDAD))
+        acumulador.participantes = data["participantes"]
+        for item in data["items"]:
+            acumulador._columna[item["Item"]] = len(acumulador.codigos)
+            acumulador.codigos.append(item["Item"])
+            acumulador.dimensiones.append(item["Dimension"])
+            acumulador.sumas.append(item["suma"])
+            acumulador.conteos.append(item["conteo"])
+            acumulador.sketches.append(SketchPercentil.from_dict(item["sketch"]))
+        return acumulador
+
+def guardar_estadisticas(acumulador, path=ESTADISTICAS_JSON):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(acumulador.to_dict(), f, ensure_ascii=False)
+
+def cargar_estadisticas(path=ESTADISTICAS_JSON):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No se encontró {path}: ejecutar primero procesar_datos_encuestas.py sin --append")
+    with open(path, "r", encoding="utf-8") as f:
+        return AcumuladorEncuesta.from_dict(json.load(f))
+
 
-    # Puntaje promedio total del participante
-    puntaje_total = (
-        round(np.mean(list(puntaje_por_dimension.values())), 2)
-        if puntaje_por_dimension else 0
-    )
-
-    # Items criticos vs si mismo
-    items_criticos_personales = []
-    for i in items_analisis:
-        r = i["Respuesta"]
-        if r is None:
-            continue
-        if i["Indica_riesgo"] == "Sí" and r >= 4:
-            items_criticos_personales.append({**i})
-        elif i["Indica_riesgo"] == "No" and r <= 2:
-            items_criticos_personales.append({**i})
-
-    # Dimensiones críticas: aquellas con peor puntaje o debajo de la media
-    conteo_extremos_por_dimension = {}
-    for i in items_criticos_personales:
-        dim = i.get("Dimension")
-        if not dim:
-            continue
-        conteo_extremos_por_dimension[dim] = conteo_extremos_por_dimension.get(dim, 0) + 1
-
-    # Identificar la(s) dimensión(es) con mayor cantidad de respuestas extremas
-    max_extremos = max(conteo_extremos_por_dimension.values(), default=0)
-    dimensiones_por_respuestas_extremas = [
-        dim for dim, count in conteo_extremos_por_dimension.items()
-        if count == max_extremos and count > 0
-    ]
+# ANÁLISIS POR PARTICIPANTE
+def puntajes_por_dimension(enc):
+    """Puntaje de cada participante en cada dimensión de enc.grupos (NaN si no respondió ningún ítem de ella)"""
+    puntajes = np.full((len(enc), len(enc.grupos)), np.nan)
+    tiene_dim = np.zeros((len(enc), len(enc.grupos)), dtype=bool)
+    for d, cols in enumerate(enc.grupos.values()):
+        conteo = enc.respondido[:, cols].sum(axis=1)
+        suma = np.where(enc.respondido[:, cols], enc.normalizadas[:, cols], 0.0).sum(axis=1)
+        tiene_dim[:, d] = conteo > 0
+        puntajes[:, d] = np.round(suma / np.maximum(conteo, 1), 2)
+    return puntajes, tiene_dim
+
+def criticos_personales(enc):
+    """Items criticos vs si mismo: riesgo con 4 o 5, no riesgo con 1 o 2"""
+    no_riesgo = np.array([i == "No" for i in enc.indica], dtype=bool)
+    R = enc.respuestas
+    return enc.respondido & ((enc.riesgo & (R >= 4)) | (no_riesgo & (R <= 2)))
+
+def marcas_criticas(enc, globales, puntajes, tiene_dim, personales):
+    """
+    Dimensiones críticas (columnas de enc.grupos) e ítems bajo el percentil 35 de cada participante,
+    lo único del análisis que depende de las estadísticas globales
+    """
+    # Dimensión(es) con mayor cantidad de respuestas extremas
+    extremos = np.stack([personales[:, cols].sum(axis=1) for cols in enc.grupos.values()], axis=1) \
+        if enc.grupos else np.zeros((len(enc), 0), dtype=int)
+    max_extremos = extremos.max(axis=1, initial=0)
+    por_extremos = (extremos == max_extremos[:, None]) & (extremos > 0)
 
     # Dimensiones con promedio por debajo del promedio global
-    dimensiones_bajo_promedio_global = [
-        d for d, val in puntaje_por_dimension.items()
-        if val < promedio_global
-    ]
-
-    # Unir ambas condiciones
-    dimensiones_criticas = sorted(
-        set(dimensiones_por_respuestas_extremas + dimensiones_bajo_promedio_global)
-    )
-
-
-    # Ítems críticos vs percentil 35
-    items_criticos_vs_media = []
-    for i in items_analisis:
-        prom_item = i.get("Promedio_item_global")
-        perc35 = i.get("Percentil35_item_global")
-        if prom_item is None or perc35 is None:
-            continue
-
-        if i["Indica_riesgo"] == "Sí":
-            desempeño = 6 - (i["respuesta_normalizada"] or 0)
-        else:
-            desempeño = i["respuesta_normalizada"] or 0
-
-        if desempeño <= perc35:
-            items_criticos_vs_media.append(i)
-
-    datos_personales = participante.get("informacion_personal", {})
-    datos_personales["Nivel_expertis_ciberseguridad"] = asignar_nivel_expertis(datos_personales)
-
-    salida = {
-        "Participante": participante.get("Participante"),
-        "Datos_personales": datos_personales,
-        "Datos globales": {
-            "Puntaje_promedio_global": promedio_global,
-            "Puntaje_global_por_dimension": promedio_por_dimension
-        },
-        "Análisis_datos": {
-            "Puntaje_promedio_total": puntaje_total,
-            "Puntaje_promedio_por_dimension": puntaje_por_dimension,
-            "Dimensiones_criticas": dimensiones_criticas,
-            "Items_criticos_personales": items_criticos_personales, # Aquellos con puntaje 1,2 o 4,5 segun si son de riesgo o no
-            "Items_criticos_debajo_percentil35": items_criticos_vs_media  # Debajo percentil 35
-        }
+    bajo_promedio = tiene_dim & (puntajes < globales["promedio_global"])
+    criticas = por_extremos | bajo_promedio
+
+    # Ítems críticos vs percentil 35 (con la misma regla que antes: respuesta sin responder cuenta como 0 o 6)
+    normalizada_o_0 = np.where(enc.respondido, enc.normalizadas, 0.0)
+    desempeño = np.where(enc.riesgo, 6 - normalizada_o_0, normalizada_o_0)
+    criticos_p35 = enc.listado & globales["con_respuestas"] & (desempeño <= globales["percentil35_item"])
+    return criticas, criticos_p35
+
+def analizar_participantes(enc, globales):
+    """
+    Resultado de cada participante (en el orden de la encuesta).
+    Puntajes por dimensión, respuestas extremas y comparación con el percentil 35 se calculan para
+    todos los participantes a la vez; solo los ítems críticos se arman como diccionarios.
+    """
+    R = enc.respuestas
+    resp = enc.respondido
+    promedio_global = globales["promedio_global"]
+
+    dims = list(enc.grupos)
+    puntajes, tiene_dim = puntajes_por_dimension(enc)
+
+    # Orden de las dimensiones de cada participante: el de su primer ítem respondido de cada una
+    posiciones = enc.posiciones()
+    primera = np.stack([np.where(resp[:, cols], posiciones[:, cols], posiciones.shape[1]).min(axis=1)
+                        for cols in enc.grupos.values()], axis=1) if dims else np.zeros((len(enc), 0), dtype=int)
+    orden = np.argsort(primera, axis=1, kind="stable")
+    puntajes_orden = np.take_along_axis(puntajes, orden, axis=1)
+    tiene_orden = np.take_along_axis(tiene_dim, orden, axis=1)
+
+    # Puntaje promedio total del participante (promedio de sus dimensiones, sumadas en ese orden)
+    totales = np.zeros(len(enc))
+    completos = tiene_orden.all(axis=1)
+    if len(dims):
+        totales[completos] = np.round(np.mean(puntajes_orden[completos], axis=1), 2)
+    for i in np.flatnonzero(~completos & tiene_orden.any(axis=1)):
+        totales[i] = round(np.mean(puntajes_orden[i][tiene_orden[i]]), 2)
+
+    personales = criticos_personales(enc)
+    criticas, criticos_p35 = marcas_criticas(enc, globales, puntajes, tiene_dim, personales)
+    orden_dims = np.argsort(np.array(dims, dtype=object)) if dims else np.zeros(0, dtype=int)
+
+    # El análisis de un ítem solo depende del ítem y de la respuesta, así que se arma un diccionario
+    # por (ítem, respuesta distinta) y los participantes comparten esos objetos (nadie los modifica después)
+    valores, codigo = np.unique(np.where(resp, R, 0.0), return_inverse=True)
+    codigo = np.where(resp, codigo.reshape(R.shape), len(valores))  # Última columna: sin respuesta
+    promedio_item = [v if c else None for v, c in zip(globales["promedio_item"].tolist(), globales["con_respuestas"])]
+    percentil_item = [v if c else None for v, c in zip(globales["percentil35_item"].tolist(), globales["con_respuestas"])]
+    tabla = np.empty((len(enc.codigos), len(valores) + 1), dtype=object)
+    for j in range(len(enc.codigos)):
+        for v, respuesta in enumerate(valores.tolist() + [None]):
+            tabla[j, v] = {
+                "Item": enc.codigos[j],
+                "Dimension": enc.dimensiones[j],
+                "Indica_riesgo": enc.indica[j],
+                "Enunciado": enc.enunciados[j] or "",
+                "Respuesta": respuesta,
+                "respuesta_normalizada": (6 - respuesta if enc.riesgo[j] else respuesta) if respuesta is not None else None, # Realmente a cuanto equivale del 1 al 5 si 1 es lo peor y 5 lo ideal
+                "Promedio_item_global": promedio_item[j], # Para comparar
+                "Percentil35_item_global": percentil_item[j] # Para comparar
+            }
+
+    def items_por_participante(mascara):
+        """Análisis de los ítems marcados de cada participante, en el orden de su lista, con un solo nonzero"""
+        filas, cols = np.nonzero(mascara)
+        if enc.posicion is not None:
+            orden_lista = np.lexsort((enc.posicion[filas, cols], filas))
+            filas, cols = filas[orden_lista], cols[orden_lista]
+        items = tabla[cols, codigo[filas, cols]].tolist()
+        limites = [0] + np.searchsorted(filas, np.arange(1, len(mascara) + 1)).tolist()
+        return [items[a:b] for a, b in zip(limites, limites[1:])]
+
+    items_personales = items_por_participante(personales)
+    items_p35 = items_por_participante(criticos_p35)
+
+    puntajes_list = puntajes_orden.tolist()
+    tiene_list = tiene_orden.tolist()
+    dims_orden = [[dims[d] for d in fila] for fila in orden.tolist()]
+    criticas_list = criticas[:, orden_dims].tolist()
+    dims_alfabetico = [dims[d] for d in orden_dims]
+    totales_list = totales.tolist()
+    datos_globales = {
+        "Puntaje_promedio_global": promedio_global,
+        "Puntaje_global_por_dimension": globales["promedio_por_dimension"]
     }
+    for i in range(len(enc)):
+        puntaje_por_dimension = {dim: val for dim, val, tiene in zip(dims_orden[i], puntajes_list[i], tiene_list[i]) if tiene}
+        puntaje_total = totales_list[i] if puntaje_por_dimension else 0
+
+        datos_personales = enc.informacion[i]
+        datos_personales["Nivel_expertis_ciberseguridad"] = asignar_nivel_expertis(datos_personales)
+
+        yield {
+            "Participante": enc.ids[i],
+            "Datos_personales": datos_personales,
+            "Datos globales": datos_globales,
+            "Análisis_datos": {
+                "Puntaje_promedio_total": puntaje_total,
+                "Puntaje_promedio_por_dimension": puntaje_por_dimension,
+                "Dimensiones_criticas": [dim for dim, critica in zip(dims_alfabetico, criticas_list[i]) if critica],
+                "Items_criticos_personales": items_personales[i], # Aquellos con puntaje 1,2 o 4,5 segun si son de riesgo o no
+                "Items_criticos_debajo_percentil35": items_p35[i]  # Debajo percentil 35
+            }
+        }
+
 
-    # Guardar JSON individual
-    json_individual = os.path.join(OUTPUT_JSON_DIR, f"participante_{participante.get('Participante')}.json")
+# SALIDA
+def guardar_individual(salida):
+    json_individual = os.path.join(OUTPUT_JSON_DIR, f"participante_{salida['Participante']}.json")
     with open(json_individual, "w", encoding="utf-8") as f:
         json.dump(salida, f, indent=2, ensure_ascii=False)
-
-    resumen_participantes.append(salida)
-
-with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-    json.dump(resumen_participantes, f, indent=2, ensure_ascii=False)
-
-print(f"JSON individuales guardados en: {OUTPUT_JSON_DIR}")
-print(f"JSON agregado guardado en: {OUTPUT_JSON}")
\ No newline at end of file
+    return salida
+
+def mostrar_globales(globales):
+    print("DATOS PROMEDIO...")
+    print("Puntaje_promedio_total:", globales["promedio_global"])
+    print("Puntaje_promedio_por_dimension:", globales["promedio_por_dimension"])
+    print()
+
+
+def analisis_completo(acumulador):
+    """Carga la encuesta completa en una matriz y analiza a todos los participantes"""
+    enc = cargar_encuesta()
+    acumulador.agregar(enc)
+    globales = estadisticas_globales(enc)
+    mostrar_globales(globales)
+    yield from analizar_participantes(enc, globales)
+
+def analisis_streaming(chunk_size, acumulador):
+    """
+    Dos pasadas por bloques sobre el CSV de respuestas: la primera acumula las estadísticas de los ítems
+    y la segunda analiza a los participantes con esas estadísticas. La memoria depende del tamaño de bloque
+    """
+    for enc in leer_por_bloques(chunk_size):
+        acumulador.agregar(enc)
+    print(f"[STREAMING] {acumulador.participantes} participantes leídos en bloques de {chunk_size}")
+    if not acumulador.exacto():
+        print(f"[STREAMING] Más de {acumulador.capacidad} valores distintos en algún ítem: el percentil 35 es aproximado (sin cota de error)")
+
+    globales = None
+    for enc in leer_por_bloques(chunk_size):
+        globales_bloque = acumulador.globales(enc.codigos)
+        if globales is None:
+            globales = globales_bloque
+            mostrar_globales(globales)
+        yield from analizar_participantes(enc, globales_bloque)
+
+
+
+# MODO INCREMENTAL (--append)
+def valores_globales_items(globales, codigos):
+    """Código -> (promedio, percentil 35) con que se comparan los ítems (None si el ítem no tiene respuestas)"""
+    return {code: (p, q) if c else (None, None) for code, p, q, c in
+            zip(codigos, globales["promedio_item"].tolist(), globales["percentil35_item"].tolist(), globales["con_respuestas"])}
+
+def actualizar_globales(registro, globales, valores_items):
+    """Registro ya analizado con las estadísticas globales nuevas, cuando sus ítems y dimensiones críticas no cambian"""
+    registro["Datos globales"] = {
+        "Puntaje_promedio_global": globales["promedio_global"],
+        "Puntaje_global_por_dimension": globales["promedio_por_dimension"]
+    }
+    analisis = registro["Análisis_datos"]
+    for item in analisis["Items_criticos_personales"] + analisis["Items_criticos_debajo_percentil35"]:
+        item["Promedio_item_global"], item["Percentil35_item_global"] = valores_items.get(item["Item"], (None, None))
+    return registro
+
+def analisis_incremental(nuevas_path, chunk_size, previo, acumulador, conteo):
+    """
+    Suma las respuestas de 'nuevas_path' a las estadísticas guardadas (previo) y arma el resumen completo:
+    - participantes nuevos: se analizan con las estadísticas actualizadas
+    - participantes anteriores cuyas dimensiones críticas o ítems bajo el percentil 35 cambian: se vuelven a analizar
+    - el resto: se reutiliza su análisis anterior y solo se actualizan los valores globales que incluye
+    'acumulador' empieza igual que 'previo' y termina con las respuestas nuevas; 'conteo' recibe cuántos hubo de cada caso.
+    """
+    inicio_nuevos = previo.participantes + 1
+    for enc in leer_por_bloques(chunk_size, nuevas_path, inicio_nuevos):
+        acumulador.agregar(enc)
+    conteo["nuevos"] = acumulador.participantes - previo.participantes
+    print(f"[APPEND] {conteo['nuevos']} participantes nuevos, {acumulador.participantes} en total")
+    if not acumulador.exacto():
+        print(f"[APPEND] Más de {acumulador.capacidad} valores distintos en algún ítem: el percentil 35 es aproximado (sin cota de error)")
+
+    registros = leer_participantes(OUTPUT_JSON_DIR)
+    mostrado = False
+    for enc in leer_por_bloques(chunk_size):
+        antes, despues = previo.globales(enc.codigos), acumulador.globales(enc.codigos)
+        if not mostrado:
+            mostrar_globales(despues)
+            mostrado = True
+
+        # Comparar las marcas que dependen de las estadísticas globales, para todo el bloque a la vez
+        puntajes, tiene_dim = puntajes_por_dimension(enc)
+        personales = criticos_personales(enc)
+        criticas_antes, p35_antes = marcas_criticas(enc, antes, puntajes, tiene_dim, personales)
+        criticas_despues, p35_despues = marcas_criticas(enc, despues, puntajes, tiene_dim, personales)
+        cambia = (criticas_antes != criticas_despues).any(axis=1) | (p35_antes != p35_despues).any(axis=1)
+        recalculados = analizar_participantes(enc.seleccionar(np.flatnonzero(cambia)), despues)
+
+        valores_items = valores_globales_items(despues, enc.codigos)
+        anteriores = list(itertools.islice(registros, len(enc)))
+        if len(anteriores) != len(enc) or any(r["Participante"] != pid for r, pid in zip(anteriores, enc.ids)):
+            raise ValueError("El resumen guardado no corresponde al CSV de respuestas, ejecutar sin --append")
+        for registro, recalcular in zip(anteriores, cambia.tolist()):
+            yield next(recalculados) if recalcular else actualizar_globales(registro, despues, valores_items)
+        conteo["recalculados"] += int(cambia.sum())
+        conteo["actualizados"] += int((~cambia).sum())
+
+    if next(registros, None) is not None or conteo["recalculados"] + conteo["actualizados"] != previo.participantes:
+        raise ValueError("El resumen guardado no corresponde al CSV de respuestas, ejecutar sin --append")
+
+    for enc in leer_por_bloques(chunk_size, nuevas_path, inicio_nuevos):
+        yield from analizar_participantes(enc, acumulador.globales(enc.codigos))
+
+def agregar_respuestas(nuevas_path, path=RESPUESTAS_CSV):
+    """Agrega las filas de 'nuevas_path' al final del CSV de respuestas, con sus columnas"""
+    import pandas as pd
+
+    columnas = pd.read_csv(path, nrows=0).columns
+    salto = False
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            salto = f.read(1) != b"\n"
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        if salto:
+            f.write("\n")
+        for bloque in pd.read_csv(nuevas_path, chunksize=DEFAULT_CHUNK_SIZE):
+            bloque.reindex(columns=columnas).to_csv(f, header=False, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Análisis de la encuesta por participante y global")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Lee el CSV de respuestas por bloques en dos pasadas, con memoria acotada")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Participantes por bloque (--streaming)")
+    parser.add_argument("--capacidad-sketch", type=int, default=DEFAULT_CAPACIDAD,
+                        help="Valores distintos por ítem que se guardan exactos para el percentil 35 "
+                             "(--streaming; con --append se usa la de las estadísticas guardadas)")
+    parser.add_argument("--append", metavar="CSV",
+                        help="CSV con respuestas nuevas (mismas columnas que el de respuestas): actualiza las estadísticas "
+                             "guardadas y vuelve a analizar solo a los nuevos y a quienes les cambian los ítems críticos")
+    parser.add_argument("--formato", choices=FORMATOS, default=DEFAULT_FORMATO,
+                        help="Formato del resumen de participantes (json es la lista indentada antigua)")
+    parser.add_argument("--buffer", type=int, default=DEFAULT_BUFFER, help="Participantes por escritura en bloque")
+    parser.add_argument("--individuales", action="store_true",
+                        help="Además guarda un participante_<n>.json por participante")
+    args = parser.parse_args()
+
+    os.makedirs(OUTPUT_JSON_DIR, exist_ok=True)
+
+    if args.append:
+        # El resumen anterior se lee mientras el sink escribe el nuevo en un temporal, que lo reemplaza al terminar
+        previo = cargar_estadisticas()
+        acumulador = cargar_estadisticas()
+        conteo = {"nuevos": 0, "recalculados": 0, "actualizados": 0}
+        salidas = analisis_incremental(args.append, args.chunk_size, previo, acumulador, conteo)
+    elif args.streaming:
+        acumulador = AcumuladorEncuesta(args.capacidad_sketch)
+        salidas = analisis_streaming(args.chunk_size, acumulador)
+    else:
+        acumulador = AcumuladorEncuesta(args.capacidad_sketch)
+        salidas = analisis_completo(acumulador)
+
+    # Guardar el resumen (y los JSON individuales si se piden) a medida que se generan
+    with abrir_sink(OUTPUT_JSON_DIR, args.formato, buffer=args.buffer) as sink:
+        for salida in salidas:
+            if args.individuales:
+                guardar_individual(salida)
+            sink.escribir(salida)
+
+    destino = ruta_salida(OUTPUT_JSON_DIR, args.formato)
+    if args.append:
+        agregar_respuestas(args.append)
+        print(f"[APPEND] Respuestas agregadas a {RESPUESTAS_CSV} (ejecutar procesar_encuesta.py para actualizar las tablas)")
+        print(f"[APPEND] Recalculados: {conteo['nuevos']} nuevos + {conteo['recalculados']} con ítems o dimensiones "
+              f"críticas distintas; {conteo['actualizados']} solo con los valores globales actualizados")
+    guardar_estadisticas(acumulador)
+
+    if args.individuales:
+        print(f"JSON individuales guardados en: {OUTPUT_JSON_DIR}")
+    print(f"Resumen de {sink.total} participantes guardado en: {destino}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-import pandas as pd
 import os
 import json
+import time
+import argparse
 
 # VARIABLES GLOBALES
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -8,58 +9,145 @@ ITEMS_CSV = os.path.join(BASE_DIR, "datos_encuesta/items_imech.csv")
 RESPUESTAS_CSV = os.path.join(BASE_DIR, "datos_encuesta/muestra_encuesta.csv")
 RESULTADO_JSON = os.path.join(BASE_DIR, "datos_encuesta/muestra_encuesta_procesado.json")
 
-# Lee items del IMECH
-items_df = pd.read_csv(ITEMS_CSV)
-
-# Adapta a diccionario
-items_dict = {}
-for _, row in items_df.iterrows():
-    items_dict[row["Items"]] = {
-        "item": row["Items"],
-        "dimension": row["Dimensión"],
-        "indica_riesgo": row["Comportamiento de Riesgo"],
-        "enunciado": row["Enunciado"],
-        "que_mide": row["Aspecto de la variable latente medido"] if pd.notna(row["Aspecto de la variable latente medido"]) else ""
-    }
-
-print(f"Items cargados: {len(items_dict)}")
-
-# Lee respuestas
-respuestas_df = pd.read_csv(RESPUESTAS_CSV)
-respuestas_por_participante = []
-
-for idx, row in respuestas_df.iterrows():
-    participante = {
-        "Participante": idx + 1,
-        "informacion_personal": {
-            "Sexo": row["p01"],
-            "Rango_etario": row["p02"],
-            "Area_servicio_salud": row["p03"],
-            "Responsabilidad": row["p11"],
-            "Posee_capacitacion": row["p12"]
-        },
-        "items": []
-    }
-    
-    # Recorre todos los items
-    for col in respuestas_df.columns:
-        if col.startswith("i"):
-            respuesta_val = row[col]
-            item_info = items_dict.get(col, {})
-            participante["items"].append({
-                "Item": col,
-                "Respuesta": respuesta_val,
-                "Nombre_item": item_info.get("item"),
-                "Dimension": item_info.get("dimension"),
-                "Indica_riesgo": item_info.get("indica_riesgo"),
-                "Enunciado": item_info.get("enunciado"),
-                "Que_mide": item_info.get("que_mide")
-            })
-    
-    respuestas_por_participante.append(participante)
-
-# Guarda en JSON
-with open(RESULTADO_JSON, "w", encoding="utf-8") as f:
-    json.dump(respuestas_por_participante, f, ensure_ascii=False, indent=2)
-
-print(f"JSON procesado guardado en: {RESULTADO_JSON}")
\ No newline at end of file
+# Salida en columnas (formato largo): una fila por (participante, item) con solo la respuesta,
+# el texto de cada item se guarda una vez en la tabla de items y los datos personales en la de participantes.
+RESULTADO_BASE = os.path.join(BASE_DIR, "datos_encuesta/muestra_encuesta")
+TABLAS = ("respuestas", "items", "participantes")
+FORMATOS = {"parquet": ".parquet", "feather": ".feather"}
+
+# Columna del CSV -> campo de informacion_personal
+CAMPOS_PERSONALES = {
+    "p01": "Sexo",
+    "p02": "Rango_etario",
+    "p03": "Area_servicio_salud",
+    "p11": "Responsabilidad",
+    "p12": "Posee_capacitacion"
+}
+
+
+# FUNCIONES AUXILIARES
+def ruta_tabla(tabla, formato, base=RESULTADO_BASE):
+    return f"{base}_{tabla}{FORMATOS[formato]}"
+
+def formato_disponible(base=RESULTADO_BASE):
+    """Formato de las tablas generadas más recientemente (o None si no se han generado)"""
+    disponibles = [f for f in FORMATOS if all(os.path.exists(ruta_tabla(t, f, base)) for t in TABLAS)]
+    if not disponibles:
+        return None
+    return max(disponibles, key=lambda f: os.path.getmtime(ruta_tabla("respuestas", f, base)))
+
+def cargar_items(path=ITEMS_CSV):
+    """Tabla de items del IMECH con los nombres de campo de la salida"""
+    import pandas as pd
+
+    items = pd.read_csv(path).rename(columns={
+        "Items": "Item",
+        "Dimensión": "Dimension",
+        "Comportamiento de Riesgo": "Indica_riesgo",
+        "Enunciado": "Enunciado",
+        "Aspecto de la variable latente medido": "Que_mide"
+    })
+    items["Nombre_item"] = items["Item"]
+    items["Que_mide"] = items["Que_mide"].fillna("")
+    return items[["Item", "Nombre_item", "Dimension", "Indica_riesgo", "Enunciado", "Que_mide"]]
+
+def reformar_respuestas(respuestas_df, items):
+    """
+    CSV ancho (una columna por item) -> tablas de participantes y de respuestas en formato largo.
+    El orden de las filas es participante y luego el orden de las columnas del CSV, como en el JSON.
+    """
+    import pandas as pd
+
+    item_cols = [c for c in respuestas_df.columns if c.startswith("i")]
+    respuestas_df = respuestas_df.assign(Participante=range(1, len(respuestas_df) + 1))
+
+    participantes = respuestas_df[["Participante"] + list(CAMPOS_PERSONALES)].rename(columns=CAMPOS_PERSONALES)
+
+    largo = respuestas_df.melt(id_vars="Participante", value_vars=item_cols, var_name="Item", value_name="Respuesta")
+    # melt deja los items uno tras otro; el sort estable vuelve a agrupar por participante
+    largo = largo.sort_values("Participante", kind="stable", ignore_index=True)
+    largo = largo.merge(items[["Item", "Dimension", "Indica_riesgo"]], on="Item", how="left", sort=False)
+    largo["Item"] = pd.Categorical(largo["Item"], categories=item_cols)
+    for col in ("Dimension", "Indica_riesgo"):
+        largo[col] = largo[col].astype("category")
+    return participantes, largo
+
+def guardar_tablas(tablas, formato, base=RESULTADO_BASE):
+    for nombre, df in tablas.items():
+        path = ruta_tabla(nombre, formato, base)
+        if formato == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(path)
+
+def cargar_tablas(formato=None, base=RESULTADO_BASE):
+    """Lee las tablas (participantes, items, respuestas) generadas por este script"""
+    import pandas as pd
+
+    formato = formato or formato_disponible(base)
+    if formato is None:
+        raise FileNotFoundError(f"No se encontraron las tablas {base}_*.parquet/.feather, ejecutar procesar_encuesta.py")
+    leer = pd.read_parquet if formato == "parquet" else pd.read_feather
+    return tuple(leer(ruta_tabla(t, formato, base)) for t in ("participantes", "items", "respuestas"))
+
+def tablas_a_participantes(participantes, items, largo):
+    """Arma la lista de participantes con la forma del JSON procesado (muestra_encuesta_procesado.json)"""
+    campos = ["Item", "Nombre_item", "Dimension", "Indica_riesgo", "Enunciado", "Que_mide"]
+    info_items = {}
+    for fila in items[campos].astype(object).where(items[campos].notna(), None).itertuples(index=False):
+        info_items[fila.Item] = dict(zip(campos, fila))
+
+    codigos = largo["Item"].astype(str).tolist()
+    valores = largo["Respuesta"].tolist()
+    ids_largo = largo["Participante"].tolist()
+
+    personales = participantes[list(CAMPOS_PERSONALES.values())].to_dict("records")
+    resultado = []
+    i = 0
+    for pid, info in zip(participantes["Participante"].tolist(), personales):
+        lista = []
+        while i < len(ids_largo) and ids_largo[i] == pid:
+            base = info_items.get(codigos[i])
+            item = {"Item": codigos[i], "Respuesta": valores[i]}
+            if base is None:
+                item.update({"Nombre_item": None, "Dimension": None, "Indica_riesgo": None, "Enunciado": None, "Que_mide": None})
+            else:
+                item.update({k: base[k] for k in campos[1:]})
+            lista.append(item)
+            i += 1
+        resultado.append({"Participante": pid, "informacion_personal": info, "items": lista})
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lleva las respuestas de la encuesta a formato largo (una fila por participante e item)")
+    parser.add_argument("--formato", choices=list(FORMATOS), default="parquet", help="Formato de las tablas de salida")
+    parser.add_argument("--json", action="store_true",
+                        help=f"Además guarda el JSON anidado antiguo en {os.path.relpath(RESULTADO_JSON, BASE_DIR)}")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    inicio = time.perf_counter()
+
+    # Lee items del IMECH
+    items = cargar_items()
+    print(f"Items cargados: {len(items)}")
+
+    # Lee respuestas y las reforma
+    respuestas_df = pd.read_csv(RESPUESTAS_CSV)
+    participantes, largo = reformar_respuestas(respuestas_df, items)
+
+    guardar_tablas({"respuestas": largo, "items": items, "participantes": participantes}, args.formato)
+    print(f"{len(participantes)} participantes, {len(largo)} respuestas guardadas en: "
+          f"{RESULTADO_BASE}_{{{','.join(TABLAS)}}}{FORMATOS[args.formato]} ({time.perf_counter() - inicio:.2f}s)")
+
+    # Guarda en JSON
+    if args.json:
+        with open(RESULTADO_JSON, "w", encoding="utf-8") as f:
+            json.dump(tablas_a_participantes(participantes, items, largo), f, ensure_ascii=False, indent=2)
+        print(f"JSON procesado guardado en: {RESULTADO_JSON}")
+
+
+if __name__ == "__main__":
+    main()
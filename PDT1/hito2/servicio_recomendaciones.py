@@ -0,0 +1,198 @@
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import obtener_querys
+
+# Servicio local que deja la KB cargada en memoria: el vector store, el índice de metadata y el cache
+# de embeddings se abren una sola vez al iniciar y cada request solo paga las búsquedas.
+# Endpoints:
+# - POST /recomendar: un participante (o lista) con la forma de los registros de analisis_encuesta/resumen_participantes.*,
+#   responde lo mismo que obtener_querys.py guarda en recomendaciones/resumen_participantes.*
+# - GET /health: estado y tamaño de la KB
+# - GET /metrics: requests, errores, latencias (p50/p95/p99) y métricas de búsqueda y del cache
+
+# VARIABLES GLOBALES
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+LATENCY_WINDOW = 1000  # Latencias recientes usadas para los percentiles
+
+
+class ServiceMetrics:
+    """Contadores y latencias recientes por endpoint, compartidos entre los threads del servidor"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.started = time.time()
+        self.requests = {}
+        self.errors = {}
+        self.latencies = {}
+        self.in_flight = 0
+        self.window = window
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, endpoint, seconds, ok):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            self.latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    @staticmethod
+    def percentiles(values):
+        if not values:
+            return {}
+        values = sorted(values)
+        pick = lambda p: round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 2)
+        return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(values[-1] * 1000, 2)}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "in_flight": self.in_flight,
+                "requests": dict(self.requests),
+                "errors": dict(self.errors),
+                "latencia": {ep: self.percentiles(list(v)) for ep, v in self.latencies.items()},
+            }
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    server_version = "RecomendacionesKB/1.0"
+    metrics = None      # ServiceMetrics, se asigna en serve()
+    slots = None        # Semáforo que limita cuántas recomendaciones se calculan a la vez
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, extra_headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (extra_headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def timed(self, endpoint, handler):
+        """Ejecuta el handler del endpoint registrando su latencia y si terminó en error"""
+        self.metrics.start()
+        inicio = time.perf_counter()
+        status = 500
+        try:
+            status, payload = handler()
+        except Exception as e:
+            payload = {"error": f"{type(e).__name__}: {e}"}
+        dt = time.perf_counter() - inicio
+        self.metrics.finish(endpoint, dt, status < 400)
+        self.send_json(status, payload, {"X-Latencia-ms": f"{dt * 1000:.2f}"})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.timed("/health", self.health)
+        elif self.path == "/metrics":
+            self.timed("/metrics", self.metrics_payload)
+        else:
+            self.send_json(404, {"error": f"Ruta desconocida: {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/recomendar":
+            self.timed("/recomendar", self.recomendar)
+        else:
+            self.send_json(404, {"error": f"Ruta desconocida: {self.path}"})
+
+    def health(self):
+        retriever = obtener_querys.retriever
+        return 200, {
+            "estado": "ok" if retriever is not None else "cargando",
+            "backend": retriever.backend.name if retriever is not None else None,
+            "vectores": len(retriever) if retriever is not None else 0,
+        }
+
+    def metrics_payload(self):
+        payload = self.metrics.snapshot()
+        with obtener_querys._metricas_lock:
+            payload["busquedas"] = dict(obtener_querys.metricas)
+        if obtener_querys.retriever is not None:
+            payload["retriever"] = dict(obtener_querys.retriever.stats)
+        if obtener_querys.embedding_cache is not None:
+            payload["embedding_cache"] = obtener_querys.embedding_cache.stats()
+        return 200, payload
+
+    def recomendar(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b"null")
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return 400, {"error": f"JSON inválido: {e}"}
+        participantes = data if isinstance(data, list) else [data]
+        if not participantes or not all(isinstance(p, dict) for p in participantes):
+            return 400, {"error": "Se espera un participante (objeto) o una lista de participantes"}
+        for p in participantes:
+            desconocidas = [d for d in p.get("Análisis_datos", {}).get("Dimensiones_criticas", [])
+                            if d not in obtener_querys.dimensiones]
+            if desconocidas:
+                return 400, {"error": f"Dimensiones desconocidas: {desconocidas}"}
+
+        with self.slots:
+            resultado = [obtener_querys.recomendar_participante(p, obtener_querys.semantic_query)
+                         for p in participantes]
+        return 200, resultado if isinstance(data, list) else resultado[0]
+
+
+def warm_up():
+    """Deja en el cache los embeddings de las consultas por dimensión, que piden casi todos los participantes"""
+    retriever = obtener_querys.get_retriever()
+    for texto in obtener_querys.dimensiones.values():
+        retriever.embed_fn(texto)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, backend=None, max_concurrent=8, quiet=False, warm=True):
+    inicio = time.perf_counter()
+    obtener_querys.get_retriever(backend)
+    if warm:
+        warm_up()
+    print(f"[SERVICIO] KB cargada en {time.perf_counter() - inicio:.2f}s")
+
+    RecommendationHandler.metrics = ServiceMetrics()
+    RecommendationHandler.slots = threading.BoundedSemaphore(max_concurrent)
+    RecommendationHandler.quiet = quiet
+    server = ThreadingHTTPServer((host, port), RecommendationHandler)
+    server.daemon_threads = True
+    print(f"[SERVICIO] Escuchando en http://{host}:{server.server_address[1]} (POST /recomendar, GET /health, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[SERVICIO] Deteniendo")
+    finally:
+        server.server_close()
+        obtener_querys.embedding_cache.print_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio local de recomendaciones con la KB cargada en memoria")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=None,
+                        help="Backend vectorial (por defecto KB_BACKEND o chroma)")
+    parser.add_argument("--max-concurrent", type=int, default=8,
+                        help="Recomendaciones calculándose a la vez; el resto de las requests espera")
+    parser.add_argument("--quiet", action="store_true", help="No imprimir una línea por request")
+    parser.add_argument("--no-warm", action="store_true", help="No precargar los embeddings de las dimensiones")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.backend, args.max_concurrent, args.quiet, warm=not args.no_warm)
+
+
+if __name__ == "__main__":
+    main()
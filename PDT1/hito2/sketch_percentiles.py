@@ -0,0 +1,94 @@
+import numpy as np
+
+# Percentiles en una pasada y memoria acotada para las respuestas de un ítem.
+# Guarda pares (valor, peso) ordenados: el percentil es EXACTO (igual a np.percentile sobre todas las
+# respuestas) solo mientras haya a lo más 'capacidad' valores distintos (DEFAULT_CAPACIDAD = 2048).
+# Es el caso de esta encuesta: las respuestas Likert tienen 5 valores posibles.
+# Si se supera la capacidad, los valores vecinos se fusionan de a pares en su promedio ponderado para
+# no crecer más. Eso NO es un t-digest ni un KLL: el resultado no tiene una cota de error garantizada
+# (con datos continuos puede alejarse arbitrariamente), por eso 'exacto' pasa a False y quien lo use debe avisarlo.
+
+DEFAULT_CAPACIDAD = 2048
+
+
+def lerp(a, b, t):
+    """Interpolación lineal con la misma fórmula que usa np.percentile (estable para t >= 0.5)"""
+    diff = b - a
+    return b - diff * (1 - t) if t >= 0.5 else a + diff * t
+
+
+class SketchPercentil:
+
+    def __init__(self, capacidad=DEFAULT_CAPACIDAD):
+        self.capacidad = capacidad
+        self.valores = np.zeros(0, dtype=np.float64)
+        self.pesos = np.zeros(0, dtype=np.int64)
+        self.nan = 0
+        self.exacto = True
+
+    def __len__(self):
+        return int(self.pesos.sum()) + self.nan
+
+    def agregar(self, valores, pesos=None):
+        """Agrega un arreglo de respuestas (o valores ya agrupados con sus pesos)"""
+        valores = np.asarray(valores, dtype=np.float64)
+        pesos = np.ones(len(valores), dtype=np.int64) if pesos is None else np.asarray(pesos, dtype=np.int64)
+        es_nan = np.isnan(valores)
+        self.nan += int(pesos[es_nan].sum())
+        valores, pesos = valores[~es_nan], pesos[~es_nan]
+        if not len(valores):
+            return
+
+        todos = np.concatenate([self.valores, valores])
+        unicos, inversa = np.unique(todos, return_inverse=True)
+        self.valores = unicos
+        self.pesos = np.bincount(inversa, weights=np.concatenate([self.pesos, pesos]), minlength=len(unicos)).astype(np.int64)
+        while len(self.valores) > self.capacidad:
+            self._comprimir()
+
+    def unir(self, otro):
+        """Suma otro sketch a este (por ejemplo el de otro bloque o de otra ejecución)"""
+        self.nan += otro.nan
+        self.exacto = self.exacto and otro.exacto
+        self.agregar(otro.valores, otro.pesos)
+
+    def _comprimir(self):
+        """Fusiona los valores vecinos de a pares en su promedio ponderado"""
+        n = len(self.valores) // 2 * 2
+        v, p = self.valores[:n].reshape(-1, 2), self.pesos[:n].reshape(-1, 2)
+        pesos = p.sum(axis=1)
+        valores = (v * p).sum(axis=1) / pesos
+        self.valores = np.concatenate([valores, self.valores[n:]])
+        self.pesos = np.concatenate([pesos, self.pesos[n:]])
+        self.exacto = False
+
+    def _valor_en(self, acumulado, rango):
+        return self.valores[np.searchsorted(acumulado, rango, side="right")]
+
+    def percentil(self, q):
+        """Percentil q (0 a 100) con la interpolación 'linear' de np.percentile"""
+        if self.nan:
+            return np.float64(np.nan)
+        n = int(self.pesos.sum())
+        if not n:
+            return np.float64(np.nan)
+        virtual = (n - 1) * np.true_divide(q, 100)
+        anterior = np.floor(virtual)
+        gamma = virtual - anterior
+        acumulado = np.cumsum(self.pesos)
+        a = self._valor_en(acumulado, int(anterior))
+        b = self._valor_en(acumulado, min(int(anterior) + 1, n - 1))
+        return np.float64(lerp(a, b, gamma))
+
+    def to_dict(self):
+        return {"valores": self.valores.tolist(), "pesos": self.pesos.tolist(), "nan": self.nan,
+                "exacto": self.exacto, "capacidad": self.capacidad}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data.get("capacidad", DEFAULT_CAPACIDAD))
+        sketch.valores = np.asarray(data["valores"], dtype=np.float64)
+        sketch.pesos = np.asarray(data["pesos"], dtype=np.int64)
+        sketch.nan = data.get("nan", 0)
+        sketch.exacto = data.get("exacto", True)
+        return sketch